@@ -0,0 +1,228 @@
+import asyncio
+import contextlib
+import dataclasses
+import json
+import logging
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from flask_jwt_extended import decode_token
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
+from marshmallow import ValidationError
+from werkzeug.http import HTTP_STATUS_CODES
+
+from app.ai.routes import (
+    SmartContractSchema,
+    UpdateSmartContractSchema,
+    generation_inputs,
+    llm_clients_for_user,
+    run_context_from_headers,
+    update_inputs,
+)
+from app.gen_smart_contract.cancellation import CancelToken
+from app.gen_smart_contract.checkpointer import checkpointer, new_run_id, run_config
+from app.gen_smart_contract.instrumentation import RunStats, finish_run
+from app.gen_smart_contract.metrics import metrics
+from app.gen_smart_contract.preflight import PromptTooLarge
+from app.gen_smart_contract.run_context import RunContext, run_context
+from app.gen_smart_contract.token_stream import astream_with_tokens
+from app.gen_smart_contract.update_workflow import update_smart_contract_workflow
+from app.gen_smart_contract.user_clients import UserLLMClients
+from app.gen_smart_contract.workflow import smart_contract_generator
+from app.models import RevokedTokenModel
+
+logger = logging.getLogger(__name__)
+
+# Request bodies are a description and at most one contract
+MAX_BODY_BYTES = 1024 * 1024
+
+Scope = Dict[str, Any]
+Receive = Callable[[], Awaitable[Dict[str, Any]]]
+Send = Callable[[Dict[str, Any]], Awaitable[None]]
+
+
+def astream_workflow(graph, inputs: Optional[dict], stream_mode: str,
+                     config: Optional[dict] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    The asyncio counterpart of routes.stream_workflow.
+    """
+    if stream_mode == "tokens":
+        return astream_with_tokens(graph, inputs, config)
+    return graph.astream(inputs, config)
+
+
+class Headers:
+    """
+    Case-insensitive access to the headers of an ASGI scope.
+    """
+
+    def __init__(self, raw: List[Tuple[bytes, bytes]]):
+        self._headers = {name.decode("latin-1").lower(): value.decode("latin-1") for name, value in raw}
+
+    def get(self, name: str, default: str = "") -> str:
+        return self._headers.get(name.lower(), default)
+
+
+class AsyncAIRoutes:
+    """
+    An ASGI app serving the streaming generation endpoints of the AI blueprint on
+    the event loop, so that an open stream costs a task instead of a worker thread.
+    Every other request is passed to the fallback app, normally the Flask app
+    served by a2wsgi on a pool of threads. Given the Flask app, runs of signed-in users
+    call the models with their own OpenAI API key, as on the Flask routes.
+    """
+
+    def __init__(self, fallback, prefix: str = "/api/ai", flask_app=None):
+        self.fallback = fallback
+        self.flask_app = flask_app
+        self.routes = {
+            ("POST", f"{prefix}/smart-contract"): self.generate_smart_contract,
+            ("POST", f"{prefix}/smart-contract/update"): self.update_smart_contract,
+        }
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        handler = self.routes.get((scope.get("method"), scope.get("path"))) if scope["type"] == "http" else None
+        if handler is None:
+            return await self.fallback(scope, receive, send)
+        await handler(scope, receive, send)
+
+    async def generate_smart_contract(self, scope: Scope, receive: Receive, send: Send):
+        logger.info("Generating smart contract...")
+        await self._stream(scope, receive, send, SmartContractSchema(), smart_contract_generator, generation_inputs)
+
+    async def update_smart_contract(self, scope: Scope, receive: Receive, send: Send):
+        logger.info("Updating smart contract...")
+        await self._stream(scope, receive, send, UpdateSmartContractSchema(), update_smart_contract_workflow,
+                           update_inputs)
+
+    async def _stream(self, scope: Scope, receive: Receive, send: Send, schema, graph, build_inputs):
+        body = await self._read_body(receive)
+        if body is None:
+            return await self._error(send, 413, "Request body too large")
+
+        try:
+            data = json.loads(body) if body else None
+        except ValueError:
+            return await self._error(send, 400, "Invalid JSON")
+        if not data:
+            return await self._error(send, 400, "No data provided")
+
+        try:
+            validated_data = schema.load(data)
+        except ValidationError as err:
+            logger.error(f"Validation error: {err.messages}")
+            return await self._error(send, 400, err.messages)
+
+        try:
+            inputs = build_inputs(validated_data)
+        except PromptTooLarge as e:
+            logger.error(f"Prompt too large: {e}")
+            return await self._error(send, 413, str(e))
+
+        cancel_token = CancelToken()
+        request_headers = Headers(scope["headers"])
+        context = dataclasses.replace(
+            run_context_from_headers(request_headers), cancel_token=cancel_token, stats=RunStats(),
+            llm_clients=await asyncio.to_thread(self._llm_clients, request_headers),
+        )
+        run_id = new_run_id()
+        headers = self._headers(b"application/json") + [(b"x-run-id", run_id.encode())]
+
+        await send({"type": "http.response.start", "status": 200, "headers": headers})
+
+        run = asyncio.create_task(
+            self._run(send, context, graph, inputs, validated_data["stream"], run_id)
+        )
+        disconnect = asyncio.create_task(self._wait_for_disconnect(receive))
+        await asyncio.wait((run, disconnect), return_when=asyncio.FIRST_COMPLETED)
+
+        if not run.done():
+            # The client is gone: cancelling the task aborts the pending OpenAI request, and the token
+            # kills the compilations and candidate threads that task cancellation cannot reach
+            logger.info(f"Client disconnected, cancelling run {run_id}")
+            metrics.incr("runs_cancelled")
+            cancel_token.cancel()
+            run.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await run
+            return
+
+        disconnect.cancel()
+        await run
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+
+    async def _run(self, send: Send, context: RunContext, graph, inputs: dict, stream_mode: str, run_id: str):
+        try:
+            with run_context(context):
+                async for output in astream_workflow(graph, inputs, stream_mode, run_config(run_id)):
+                    for key, value in output.items():
+                        try:
+                            # Convert the Pydantic model instance to a dictionary before serialization
+                            if hasattr(value, 'dict'):
+                                value = value.dict()
+                            json_data = json.dumps({key: value})
+                        except TypeError as e:
+                            logger.error(f"Serialization error: {e}")
+                            json_data = json.dumps({"error": f"Serialization error: {e}"})
+                        if key != "token":
+                            logger.info(json_data)
+                        await send({"type": "http.response.body", "body": f"{json_data}\n".encode(), "more_body": True})
+        except Exception as e:
+            logger.error(f"Error generating smart contract: {e}")
+            error = json.dumps({"error": f"Error generating smart contract: {e}", "run_id": run_id})
+            await send({"type": "http.response.body", "body": f"{error}\n".encode(), "more_body": True})
+        else:
+            if checkpointer is not None:
+                await checkpointer.adelete_thread(run_id)
+
+        summary = json.dumps({"run_summary": finish_run(context.stats)})
+        await send({"type": "http.response.body", "body": f"{summary}\n".encode(), "more_body": True})
+
+    @staticmethod
+    async def _wait_for_disconnect(receive: Receive):
+        while (await receive())["type"] != "http.disconnect":
+            pass
+
+    def _llm_clients(self, headers: Headers) -> Optional[UserLLMClients]:
+        """
+        The LLM clients of the user signed in with the request's access token, as
+        routes.llm_clients_from_request. Queries the database, so runs in a thread.
+        """
+        scheme, _, token = headers.get("authorization").partition(" ")
+        if self.flask_app is None or scheme.lower() != "bearer" or not token:
+            return None
+        with self.flask_app.app_context():
+            try:
+                claims = decode_token(token.strip())
+            except (JWTExtendedException, PyJWTError) as e:
+                logger.warning(f"Ignoring an invalid access token: {e}")
+                return None
+            if claims.get("type") != "access" or RevokedTokenModel.is_jti_blacklisted(claims["jti"]):
+                return None
+            return llm_clients_for_user(claims.get(self.flask_app.config["JWT_IDENTITY_CLAIM"]))
+
+    @staticmethod
+    async def _read_body(receive: Receive):
+        body = b""
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return b""
+            body += message.get("body", b"")
+            if len(body) > MAX_BODY_BYTES:
+                return None
+            if not message.get("more_body"):
+                return body
+
+    @staticmethod
+    def _headers(content_type: bytes) -> List[Tuple[bytes, bytes]]:
+        # Matches the Flask-CORS defaults of the Flask app
+        return [(b"content-type", content_type), (b"access-control-allow-origin", b"*")]
+
+    async def _error(self, send: Send, status_code: int, message):
+        """
+        Send the same JSON error payload as errors.handlers.error_response.
+        """
+        payload = json.dumps({"error": HTTP_STATUS_CODES.get(status_code, "Unknown error"), "msg": message})
+        await send({"type": "http.response.start", "status": status_code, "headers": self._headers(b"application/json")})
+        await send({"type": "http.response.body", "body": payload.encode()})
@@ -1,28 +1,155 @@
-from typing import Tuple, Union, Generator
+from typing import Optional, Tuple, Union, Generator
+from cryptography.fernet import InvalidToken
 from flask import Response, request, jsonify, stream_with_context
-from marshmallow import Schema, fields, ValidationError
+from flask_jwt_extended import get_jwt_identity, verify_jwt_in_request
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt.exceptions import PyJWTError
+from marshmallow import Schema, fields, validate, ValidationError
 from app.ai import bp
+from app.encryption import decrypt_data
 from app.errors.handlers import error_response, bad_request
+from app.models import Users
+import dataclasses
 import logging
 import json
-from solcx import compile_source, install_solc
-
-from app.gen_smart_contract.common import documentation_gen_chain
+import time
+import uuid
+
+from app.gen_smart_contract.cancellation import CancelToken
+from app.gen_smart_contract.checkpointer import checkpointer, new_run_id, run_config
+from app.gen_smart_contract.compile_cache import compile_cache
+from app.gen_smart_contract.compile_pool import CompileQueueFull
+from app.gen_smart_contract.compiler import compile_contract
+from app.gen_smart_contract.diagnostics import Diagnostic
+from app.gen_smart_contract.documentation_service import documentation_status, get_documentation
+from app.gen_smart_contract.instrumentation import RunStats, finish_run
+from app.gen_smart_contract.jobs import JobFollowTimeout, JobNotFound, get_job_queue
+from app.gen_smart_contract.metrics import metrics
+from app.gen_smart_contract.preflight import PromptTooLarge, check_request
+from app.gen_smart_contract.run_context import RunContext, run_context
+from app.gen_smart_contract.solc_manager import SolcVersionUnavailable
+from app.gen_smart_contract.token_stream import HEARTBEAT, stream_in_background
 from app.gen_smart_contract.update_workflow import update_smart_contract_workflow
+from app.gen_smart_contract.user_clients import UserLLMClients, user_llm_clients
 from app.gen_smart_contract.workflow import smart_contract_generator
+from config import Config
 
 # Set up logging
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 
+def run_context_from_headers(headers) -> RunContext:
+    """
+    Build the per-run options from the request headers. Sending `X-LLM-Cache: bypass`
+    skips cached LLM responses and refreshes them.
+    """
+    return RunContext(cache_bypass=headers.get("X-LLM-Cache", "").lower() == "bypass")
+
+
+def llm_clients_for_user(user_id) -> Optional[UserLLMClients]:
+    """
+    The LLM clients of a user's own OpenAI API key, None if they have not saved one,
+    in which case their runs use the app's key. Needs an app context.
+    """
+    try:
+        user_id = uuid.UUID(str(user_id))
+    except ValueError:
+        return None
+    user = Users.query.filter_by(id=user_id).first()
+    if user is None or not user.openai_api_key:
+        return None
+    try:
+        api_key = decrypt_data(user.openai_api_key)
+    except InvalidToken:
+        logger.warning(f"Cannot decrypt the OpenAI API key of user {user_id}, using the app's key")
+        return None
+    return user_llm_clients.get(str(user.id), api_key)
+
+
+def llm_clients_from_request() -> Optional[UserLLMClients]:
+    """
+    The LLM clients of the signed-in user. The AI endpoints stay open to anonymous
+    clients, so an invalid or expired token is treated like no token.
+    """
+    try:
+        verify_jwt_in_request(optional=True)
+        user_id = get_jwt_identity()
+    except (JWTExtendedException, PyJWTError) as e:
+        logger.warning(f"Ignoring an invalid access token: {e}")
+        return None
+    return llm_clients_for_user(user_id)
+
+
+def run_context_from_request() -> RunContext:
+    return dataclasses.replace(run_context_from_headers(request.headers), llm_clients=llm_clients_from_request())
+
+
+DOCUMENTATION_MODES = ("inline", "deferred")
+STREAM_MODES = ("nodes", "tokens")
+UPDATE_MODES = ("auto", "functions", "full")
+
+
+def stream_workflow(graph, inputs: Optional[dict], stream_mode: str, config: Optional[dict] = None):
+    """
+    Stream the node outputs of a workflow, interleaved with token events in "tokens" mode
+    and with heartbeats. Passing no inputs resumes the run of the config from its last checkpoint.
+    """
+    return stream_in_background(graph, inputs, config, tokens=stream_mode == "tokens",
+                                heartbeat=Config.STREAM_HEARTBEAT_SECONDS)
+
+
+def generation_inputs(validated_data: dict) -> dict:
+    """
+    The initial state of the generate workflow for a validated SmartContractSchema request.
+    Raises PromptTooLarge if the description cannot fit the prompt budgets.
+    """
+    check_request(validated_data["description"])
+    return {
+        "prompt": validated_data["description"],
+        "error_message": "",
+        "error": "no",
+        "iterations": 0,
+        "started_at": time.time(),
+        "tokens_used": 0,
+        "documentation_mode": validated_data["documentation"],
+    }
+
+
+def update_inputs(validated_data: dict) -> dict:
+    """
+    The initial state of the update workflow for a validated UpdateSmartContractSchema request.
+    Raises PromptTooLarge if the description and contract cannot fit the prompt budgets.
+    """
+    check_request(validated_data["description"], validated_data["contract"])
+    return {
+        "prompt": validated_data["description"],
+        "existing_contract": validated_data["contract"],
+        "update_mode": validated_data["mode"] or Config.UPDATE_MODE,
+        "error_message": "",
+        "iterations": 0,
+        "started_at": time.time(),
+        "tokens_used": 0,
+        "documentation_mode": validated_data["documentation"],
+    }
+
+
 class SmartContractSchema(Schema):
     description = fields.Str(required=True)
+    documentation = fields.Str(load_default="inline", validate=validate.OneOf(DOCUMENTATION_MODES))
+    stream = fields.Str(load_default="nodes", validate=validate.OneOf(STREAM_MODES))
 
 
 class UpdateSmartContractSchema(Schema):
     description = fields.Str(required=True)
     contract = fields.Str(required=True)
+    documentation = fields.Str(load_default="inline", validate=validate.OneOf(DOCUMENTATION_MODES))
+    stream = fields.Str(load_default="nodes", validate=validate.OneOf(STREAM_MODES))
+    mode = fields.Str(load_default=None, validate=validate.OneOf(UPDATE_MODES))
+
+
+class ResumeSchema(Schema):
+    stream = fields.Str(load_default="nodes", validate=validate.OneOf(STREAM_MODES))
 
 
 @bp.post("/smart-contract")
@@ -43,39 +170,18 @@ def generate_smart_contract() -> Union[Tuple[Response, int], Response]:
             return error_response(400, "No data provided")
 
         validated_data = schema.load(data)
-        smart_contract_description = validated_data["description"]
-
-        def generate() -> Generator[str, None, None]:
-            try:
-                for output in smart_contract_generator.stream(
-                        {
-                            "prompt": smart_contract_description,
-                            "error_message": "",
-                            "error": "no",
-                            "iterations": 0
-                         }):
-                    for key, value in output.items():
-                        logger.info(f"{key}")
-                        try:
-                            # Convert the Pydantic model instance to a dictionary before serialization
-                            if hasattr(value, 'dict'):
-                                value = value.dict()
-                            json_data = json.dumps({key: value})
-                            logger.info(json_data)
-                            yield f"{json_data}\n"
-                        except TypeError as e:
-                            logger.error(f"Serialization error: {e}")
-                            yield json.dumps({"error": f"Serialization error: {e}"})
-            except Exception as e:
-                logger.error(f"Error generating smart contract: {e}")
-                yield json.dumps({"error": f"Error generating smart contract: {e}"})
 
-        return Response(stream_with_context(generate()), mimetype="application/json")
+        return workflow_response(smart_contract_generator, generation_inputs(validated_data), new_run_id(),
+                                 validated_data["stream"])
 
     except ValidationError as err:
         logger.error(f"Validation error: {err.messages}")
         return bad_request(err.messages)
 
+    except PromptTooLarge as e:
+        logger.error(f"Prompt too large: {e}")
+        return error_response(413, str(e))
+
     except Exception as e:
         logger.error(f"Unexpected error: {str(e)}")
         return error_response(500, "An unexpected error occurred")
@@ -99,43 +205,151 @@ def update_smart_contract() -> Union[Tuple[Response, int], Response]:
             return error_response(400, "No data provided")
 
         validated_data = schema.load(data)
-        smart_contract_description = validated_data["description"]
-        smart_contract_code = validated_data["contract"]
-
-        def generate() -> Generator[str, None, None]:
-            try:
-                for output in update_smart_contract_workflow.stream(
-                        {
-                            "prompt": smart_contract_description,
-                            "existing_contract": smart_contract_code,
-                            "error_message": "",
-                            "iterations": 0
-                        }):
+
+        return workflow_response(update_smart_contract_workflow, update_inputs(validated_data), new_run_id(),
+                                 validated_data["stream"])
+
+    except ValidationError as err:
+        logger.error(f"Validation error: {err.messages}")
+        return bad_request(err.messages)
+
+    except PromptTooLarge as e:
+        logger.error(f"Prompt too large: {e}")
+        return error_response(413, str(e))
+
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return error_response(500, "An unexpected error occurred")
+
+
+@bp.post("/smart-contract/<run_id>/resume")
+def resume_smart_contract(run_id: str) -> Union[Tuple[Response, int], Response]:
+    """
+    Endpoint resuming a generation run that failed or was interrupted, from its
+    last completed node.
+
+    Parameters
+    ----------
+    run_id : str
+        The run ID from the `X-Run-Id` header or the error event of the original stream
+
+    Returns
+    -------
+    Union[Tuple[Response, int], Response]
+        The stream of the remaining node outputs, or an error message.
+    """
+    logger.info(f"Resuming smart contract generation {run_id}...")
+    return resume_run(smart_contract_generator, run_id)
+
+
+@bp.post("/smart-contract/update/<run_id>/resume")
+def resume_update_smart_contract(run_id: str) -> Union[Tuple[Response, int], Response]:
+    """
+    Endpoint resuming an update run that failed or was interrupted, from its last
+    completed node.
+
+    Parameters
+    ----------
+    run_id : str
+        The run ID from the `X-Run-Id` header or the error event of the original stream
+
+    Returns
+    -------
+    Union[Tuple[Response, int], Response]
+        The stream of the remaining node outputs, or an error message.
+    """
+    logger.info(f"Resuming smart contract update {run_id}...")
+    return resume_run(update_smart_contract_workflow, run_id)
+
+
+def resume_run(graph, run_id: str) -> Union[Tuple[Response, int], Response]:
+    try:
+        validated_data = ResumeSchema().load(request.get_json(silent=True) or {})
+
+        if checkpointer is None:
+            return error_response(404, "Run checkpoints are disabled")
+
+        state = graph.get_state(run_config(run_id))
+        if not state.values:
+            return error_response(404, f"Run {run_id} not found")
+        if not state.next:
+            return error_response(409, f"Run {run_id} has already finished")
+
+        # The retry deadline counts from when the run resumes, as a job's does from when it starts
+        graph.update_state(run_config(run_id), {"started_at": time.time()})
+
+        return workflow_response(graph, None, run_id, validated_data["stream"])
+
+    except ValidationError as err:
+        logger.error(f"Validation error: {err.messages}")
+        return bad_request(err.messages)
+
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return error_response(500, "An unexpected error occurred")
+
+
+def workflow_response(graph, inputs: Optional[dict], run_id: str, stream_mode: str) -> Response:
+    """
+    Stream a workflow run as NDJSON. The run is checkpointed under `run_id`, which
+    is sent in the `X-Run-Id` header and with a failure, so that the client can
+    resume it. Its checkpoints are dropped once it finishes.
+
+    Blank lines are written while the run is quiet. If the client has disconnected,
+    writing one fails and the run is cancelled, aborting its LLM call or killing
+    its solc process instead of finishing work nobody will receive.
+
+    The last line is a `run_summary` with the time, tokens and estimated cost the
+    run spent per chain and node, also on failure.
+    """
+    cancel_token = CancelToken()
+    stats = RunStats()
+    context = dataclasses.replace(run_context_from_request(), cancel_token=cancel_token, stats=stats)
+
+    def generate() -> Generator[str, None, None]:
+        finished = False
+        try:
+            with run_context(context):
+                for output in stream_workflow(graph, inputs, stream_mode, run_config(run_id)):
+                    if output is HEARTBEAT:
+                        yield "\n"
+                        continue
                     for key, value in output.items():
+                        if key == "token":
+                            yield f"{json.dumps(output)}\n"
+                            continue
                         logger.info(f"{key}")
                         try:
                             # Convert the Pydantic model instance to a dictionary before serialization
                             if hasattr(value, 'dict'):
                                 value = value.dict()
                             json_data = json.dumps({key: value})
+                            logger.info(json_data)
                             yield f"{json_data}\n"
-                            logger.info(f"{json_data}")
                         except TypeError as e:
                             logger.error(f"Serialization error: {e}")
                             yield json.dumps({"error": f"Serialization error: {e}"})
-            except Exception as e:
-                logger.error(f"Error generating smart contract: {e}")
-                yield json.dumps({"error": f"Error generating smart contract: {e}"})
-
-        return Response(stream_with_context(generate()), mimetype="application/json")
-
-    except ValidationError as err:
-        logger.error(f"Validation error: {err.messages}")
-        return bad_request(err.messages)
-
-    except Exception as e:
-        logger.error(f"Unexpected error: {str(e)}")
-        return error_response(500, "An unexpected error occurred")
+            finished = True
+        except Exception as e:
+            finished = True
+            logger.error(f"Error generating smart contract: {e}")
+            yield json.dumps({"error": f"Error generating smart contract: {e}", "run_id": run_id}) + "\n"
+            yield f"{json.dumps({'run_summary': finish_run(stats)})}\n"
+            return
+        finally:
+            # Closed before the end, the client is gone
+            if not finished:
+                logger.info(f"Client disconnected, cancelling run {run_id}")
+                metrics.incr("runs_cancelled")
+                cancel_token.cancel()
+
+        yield f"{json.dumps({'run_summary': finish_run(stats)})}\n"
+        if checkpointer is not None:
+            checkpointer.delete_thread(run_id)
+
+    response = Response(stream_with_context(generate()), mimetype="application/json")
+    response.headers["X-Run-Id"] = run_id
+    return response
 
 
 @bp.post("/smart-contract/compile")
@@ -147,21 +361,27 @@ def compile_solidity():
         if not source_code:
             return jsonify({'success': False, 'errors': ['No source code provided']}), 400
 
-        # Install the requested Solidity compiler version
-        install_solc(solc_version)
+        result = compile_contract(source_code, solc_version)
 
-        compiled_sol = compile_source(
-            source_code,
-            output_values=['abi', 'bin'],
-            solc_version=solc_version
-        )
+        if not result.success:
+            logger.error(f"Error compiling solidity: {result.errors}")
+            errors = [Diagnostic(**d).format() for d in result.diagnostics if d["severity"] == "error"]
+            return jsonify({'success': False, 'errors': errors, 'diagnostics': result.diagnostics}), 500
 
-        contract_id, contract_interface = compiled_sol.popitem()
+        contract_id, contract_interface = result.main_contract(source_code)
         abi = contract_interface['abi']
         bytecode = contract_interface['bin']
 
         return jsonify({'success': True, 'abi': abi, 'bytecode': bytecode}), 200
 
+    except SolcVersionUnavailable as e:
+        logger.error(f"Error compiling solidity: {e}")
+        return jsonify({'success': False, 'errors': [str(e)]}), 400
+
+    except CompileQueueFull as e:
+        logger.error(f"Error compiling solidity: {e}")
+        return jsonify({'success': False, 'errors': [str(e)]}), 503
+
     except Exception as e:
         logger.error(f"Error compiling solidity: {e}")
         return jsonify({'success': False, 'errors': [str(e)]}), 500
@@ -175,12 +395,167 @@ def generate_documentation() -> Union[Tuple[Response, int], Response]:
         if not source_code:
             return jsonify({'success': False, 'errors': ['No source code provided']}), 400
 
-        documentation = documentation_gen_chain.invoke({
-            "contract": source_code
-        })
+        with run_context(run_context_from_request()):
+            documentation = get_documentation(source_code)
 
-        return jsonify({'success': True, 'documentation': documentation.documentation}), 200
+        return jsonify({'success': True, 'documentation': documentation}), 200
+
+    except PromptTooLarge as e:
+        return jsonify({'success': False, 'errors': [str(e)]}), 413
 
     except Exception as e:
         logger.error(f"Error generating documentation: {e}")
         return jsonify({'success': False, 'errors': [str(e)]}), 500
+
+
+@bp.get("/smart-contract/documentation/<contract_hash>")
+def get_deferred_documentation(contract_hash: str) -> Tuple[Response, int]:
+    """
+    Endpoint polling the documentation a deferred workflow run started in the background.
+
+    Parameters
+    ----------
+    contract_hash : str
+        The contract hash returned by the workflow's `defer_document` event
+
+    Returns
+    -------
+    Tuple[Response, int]
+        200 with the documentation once finished, 202 while it is pending, 404 if unknown
+    """
+    status = documentation_status(contract_hash)
+
+    if status is None:
+        return jsonify({'success': False, 'errors': ['No documentation for this contract']}), 404
+
+    if status["status"] == "pending":
+        return jsonify({'success': True, 'status': 'pending'}), 202
+
+    return jsonify({'success': True, 'status': 'finished', 'documentation': status["documentation"]}), 200
+
+
+@bp.post("/smart-contract/jobs")
+def submit_smart_contract_job() -> Union[Tuple[Response, int], Response]:
+    """
+    Endpoint queueing a smart contract generation as a background job.
+
+    Returns
+    -------
+    Union[Tuple[Response, int], Response]
+        202 with the queued job, whose events can be polled or streamed by its ID
+    """
+    return submit_job("generate", SmartContractSchema(), generation_inputs)
+
+
+@bp.post("/smart-contract/update/jobs")
+def submit_update_smart_contract_job() -> Union[Tuple[Response, int], Response]:
+    """
+    Endpoint queueing a smart contract update as a background job.
+
+    Returns
+    -------
+    Union[Tuple[Response, int], Response]
+        202 with the queued job, whose events can be polled or streamed by its ID
+    """
+    return submit_job("update", UpdateSmartContractSchema(), update_inputs)
+
+
+def submit_job(kind: str, schema: Schema, build_inputs) -> Union[Tuple[Response, int], Response]:
+    try:
+        data = request.get_json()
+        if not data:
+            return error_response(400, "No data provided")
+
+        validated_data = schema.load(data)
+        job = get_job_queue().submit(kind, build_inputs(validated_data), run_context_from_request())
+
+        return jsonify(job), 202
+
+    except ValidationError as err:
+        logger.error(f"Validation error: {err.messages}")
+        return bad_request(err.messages)
+
+    except PromptTooLarge as e:
+        logger.error(f"Prompt too large: {e}")
+        return error_response(413, str(e))
+
+    except Exception as e:
+        logger.error(f"Unexpected error: {str(e)}")
+        return error_response(500, "An unexpected error occurred")
+
+
+@bp.get("/jobs/<job_id>")
+def get_job(job_id: str) -> Union[Tuple[Response, int], Response]:
+    """
+    Endpoint polling a background job.
+
+    Parameters
+    ----------
+    job_id : str
+        The job ID
+    offset : int, optional
+        Query parameter, the number of events the client already has
+
+    Returns
+    -------
+    Union[Tuple[Response, int], Response]
+        The job status and its events from the offset on, in the format of the streaming endpoints
+    """
+    try:
+        offset = request.args.get("offset", 0, type=int)
+        job_queue = get_job_queue()
+        job = job_queue.get(job_id)
+        events = [json.loads(event) for event in job_queue.events(job_id, offset)]
+
+        return jsonify({**job, "offset": offset, "events": events}), 200
+
+    except JobNotFound as e:
+        return error_response(404, str(e))
+
+
+@bp.get("/jobs/<job_id>/stream")
+def stream_job(job_id: str) -> Union[Tuple[Response, int], Response]:
+    """
+    Endpoint streaming the events of a background job as NDJSON, starting at the
+    `offset` query parameter and following the job until it finishes. Reconnecting
+    with the number of lines already received resumes the stream.
+
+    Parameters
+    ----------
+    job_id : str
+        The job ID
+
+    Returns
+    -------
+    Union[Tuple[Response, int], Response]
+        The stream of events, in the format of the streaming endpoints
+    """
+    offset = request.args.get("offset", 0, type=int)
+    job_queue = get_job_queue()
+
+    try:
+        job_queue.get(job_id)
+    except JobNotFound as e:
+        return error_response(404, str(e))
+
+    def generate() -> Generator[str, None, None]:
+        try:
+            for event in job_queue.follow(job_id, offset):
+                yield f"{event}\n"
+        except (JobNotFound, JobFollowTimeout) as e:
+            yield json.dumps({"error": str(e)})
+
+    return Response(stream_with_context(generate()), mimetype="application/json")
+
+
+@bp.get("/metrics")
+def get_metrics() -> Tuple[Response, int]:
+    """
+    Endpoint exposing the in-process metrics of the smart contract pipeline.
+
+    Returns
+    -------
+    Tuple[Response, int]
+        A JSON object containing the counters, gauges and histograms
+    """
+    return jsonify({**metrics.snapshot(), "compile_cache": compile_cache.stats()}), 200
@@ -0,0 +1,85 @@
+import logging
+import threading
+from typing import Any, Callable, Dict
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+
+logger = logging.getLogger(__name__)
+
+
+class RunCancelled(Exception):
+    """Raised inside a workflow run that was cancelled, e.g. because its client disconnected."""
+
+
+class CancelToken:
+    """
+    Cancels the work of one workflow run from another thread. The run checks the
+    token between steps and registers callbacks, such as killing a solc process,
+    that stop the work it is blocked on.
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: Dict[int, Callable[[], None]] = {}
+        self._next_id = 0
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks.values())
+            self._callbacks.clear()
+
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning(f"Cancellation callback failed: {e}")
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """
+        Call `callback` when the token is cancelled, or right away if it already is.
+
+        Returns:
+            callable: Unregisters the callback once the work it would stop has finished
+        """
+        with self._lock:
+            if not self._event.is_set():
+                callback_id = self._next_id
+                self._next_id += 1
+                self._callbacks[callback_id] = callback
+                return lambda: self._remove(callback_id)
+
+        callback()
+        return lambda: None
+
+    def _remove(self, callback_id: int):
+        with self._lock:
+            self._callbacks.pop(callback_id, None)
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise RunCancelled("The workflow run was cancelled")
+
+
+class CancellationHandler(BaseCallbackHandler):
+    """
+    Aborts a streamed chat model call at the next chunk once the token is
+    cancelled, which closes the HTTP response.
+    """
+
+    raise_error = True
+    run_inline = True
+
+    def __init__(self, token: CancelToken):
+        self.token = token
+
+    def on_llm_new_token(self, token: str, *, run_id: UUID, **kwargs: Any):
+        self.token.raise_if_cancelled()
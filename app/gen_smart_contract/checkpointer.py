@@ -0,0 +1,228 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, AsyncIterator, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import BaseCheckpointSaver, Checkpoint, CheckpointMetadata, CheckpointTuple
+from sqlalchemy import create_engine, delete, insert, select
+
+from app.models import WorkflowCheckpoint, WorkflowCheckpointWrite
+from config import Config
+
+checkpoint_table = WorkflowCheckpoint.__table__
+write_table = WorkflowCheckpointWrite.__table__
+
+
+def new_run_id() -> str:
+    return uuid.uuid4().hex
+
+
+def run_config(run_id: str) -> RunnableConfig:
+    """
+    The graph config of a workflow run, whose checkpoints are kept under its run ID.
+    """
+    return {"configurable": {"thread_id": run_id}}
+
+
+class SQLAlchemyCheckpointSaver(BaseCheckpointSaver):
+    """
+    Stores the LangGraph checkpoints of the workflows in the app database, or any
+    other SQLAlchemy URL, so that a run which failed or was interrupted can be
+    resumed from its last completed node.
+
+    The tables are the WorkflowCheckpoint and WorkflowCheckpointWrite models. The
+    saver uses its own engine because workflow nodes run outside of the Flask app
+    context, in LangGraph's threads or on the event loop.
+    """
+
+    def __init__(self, url: str):
+        super().__init__()
+        self.engine = create_engine(url, pool_pre_ping=True)
+        self._is_setup = False
+
+    def setup(self):
+        if self._is_setup:
+            return
+        # A no-op once the migration has run, needed for the local SQLite fallback
+        WorkflowCheckpoint.metadata.create_all(self.engine, tables=[checkpoint_table, write_table], checkfirst=True)
+        self._is_setup = True
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        self.setup()
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_id = config["configurable"].get("thread_ts")
+
+        query = select(checkpoint_table).where(checkpoint_table.c.thread_id == thread_id)
+        if checkpoint_id:
+            query = query.where(checkpoint_table.c.checkpoint_id == str(checkpoint_id))
+        else:
+            query = query.order_by(checkpoint_table.c.checkpoint_id.desc()).limit(1)
+
+        with self.engine.connect() as connection:
+            row = connection.execute(query).first()
+            if row is None:
+                return None
+            pending = connection.execute(
+                select(write_table.c.task_id, write_table.c.channel, write_table.c.value)
+                .where(write_table.c.thread_id == thread_id, write_table.c.checkpoint_id == row.checkpoint_id)
+                .order_by(write_table.c.task_id, write_table.c.idx)
+            ).all()
+
+        return self._tuple(row, [(task_id, channel, self.serde.loads(value)) for task_id, channel, value in pending])
+
+    def list(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> Iterator[CheckpointTuple]:
+        self.setup()
+        query = select(checkpoint_table).order_by(checkpoint_table.c.checkpoint_id.desc())
+        if config is not None:
+            query = query.where(checkpoint_table.c.thread_id == str(config["configurable"]["thread_id"]))
+        if before is not None:
+            query = query.where(checkpoint_table.c.checkpoint_id < str(before["configurable"]["thread_ts"]))
+        if limit and not filter:
+            query = query.limit(limit)
+
+        with self.engine.connect() as connection:
+            rows = connection.execute(query).all()
+
+        count = 0
+        for row in rows:
+            checkpoint_tuple = self._tuple(row)
+            # Metadata is stored serialized, so the filter is applied here rather than in SQL
+            if filter and any(checkpoint_tuple.metadata.get(k) != v for k, v in filter.items()):
+                continue
+            yield checkpoint_tuple
+            count += 1
+            if limit and count >= limit:
+                return
+
+    def put(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata) -> RunnableConfig:
+        self.setup()
+        thread_id = str(config["configurable"]["thread_id"])
+
+        with self.engine.begin() as connection:
+            connection.execute(
+                delete(checkpoint_table).where(
+                    checkpoint_table.c.thread_id == thread_id, checkpoint_table.c.checkpoint_id == checkpoint["id"]
+                )
+            )
+            connection.execute(insert(checkpoint_table).values(
+                thread_id=thread_id,
+                checkpoint_id=checkpoint["id"],
+                parent_id=config["configurable"].get("thread_ts"),
+                checkpoint=self.serde.dumps(checkpoint),
+                checkpoint_metadata=self.serde.dumps(metadata),
+                created_at=datetime.utcnow(),
+            ))
+
+        return {"configurable": {"thread_id": thread_id, "thread_ts": checkpoint["id"]}}
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str) -> None:
+        self.setup()
+        thread_id = str(config["configurable"]["thread_id"])
+        checkpoint_id = str(config["configurable"]["thread_ts"])
+
+        with self.engine.begin() as connection:
+            connection.execute(
+                delete(write_table).where(
+                    write_table.c.thread_id == thread_id,
+                    write_table.c.checkpoint_id == checkpoint_id,
+                    write_table.c.task_id == task_id,
+                )
+            )
+            if writes:
+                connection.execute(insert(write_table), [
+                    {
+                        "thread_id": thread_id,
+                        "checkpoint_id": checkpoint_id,
+                        "task_id": task_id,
+                        "idx": idx,
+                        "channel": channel,
+                        "value": self.serde.dumps(value),
+                    }
+                    for idx, (channel, value) in enumerate(writes)
+                ])
+
+    def delete_thread(self, thread_id: str):
+        """
+        Drop the checkpoints of a run, once it has finished and cannot be resumed.
+        """
+        self.setup()
+        with self.engine.begin() as connection:
+            connection.execute(delete(write_table).where(write_table.c.thread_id == thread_id))
+            connection.execute(delete(checkpoint_table).where(checkpoint_table.c.thread_id == thread_id))
+
+    def prune(self, max_age_seconds: float) -> int:
+        """
+        Drop the runs whose last checkpoint is older than `max_age_seconds`.
+
+        Returns:
+            int: The number of runs dropped
+        """
+        self.setup()
+        cutoff = datetime.utcnow() - timedelta(seconds=max_age_seconds)
+
+        with self.engine.begin() as connection:
+            recent = select(checkpoint_table.c.thread_id).where(checkpoint_table.c.created_at >= cutoff)
+            stale = connection.execute(
+                select(checkpoint_table.c.thread_id).where(checkpoint_table.c.thread_id.not_in(recent)).distinct()
+            ).scalars().all()
+            if stale:
+                connection.execute(delete(write_table).where(write_table.c.thread_id.in_(stale)))
+                connection.execute(delete(checkpoint_table).where(checkpoint_table.c.thread_id.in_(stale)))
+
+        return len(stale)
+
+    # Database drivers are blocking, so the asyncio path runs the queries in a thread
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return await asyncio.to_thread(self.get_tuple, config)
+
+    async def alist(
+        self,
+        config: Optional[RunnableConfig],
+        *,
+        filter: Optional[Dict[str, Any]] = None,
+        before: Optional[RunnableConfig] = None,
+        limit: Optional[int] = None,
+    ) -> AsyncIterator[CheckpointTuple]:
+        checkpoint_tuples = await asyncio.to_thread(
+            lambda: list(self.list(config, filter=filter, before=before, limit=limit))
+        )
+        for checkpoint_tuple in checkpoint_tuples:
+            yield checkpoint_tuple
+
+    async def aput(self, config: RunnableConfig, checkpoint: Checkpoint, metadata: CheckpointMetadata) -> RunnableConfig:
+        return await asyncio.to_thread(self.put, config, checkpoint, metadata)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[Tuple[str, Any]], task_id: str) -> None:
+        await asyncio.to_thread(self.put_writes, config, writes, task_id)
+
+    async def adelete_thread(self, thread_id: str):
+        await asyncio.to_thread(self.delete_thread, thread_id)
+
+    def _tuple(self, row, pending_writes: Optional[List[Tuple[str, str, Any]]] = None) -> CheckpointTuple:
+        return CheckpointTuple(
+            {"configurable": {"thread_id": row.thread_id, "thread_ts": row.checkpoint_id}},
+            self.serde.loads(row.checkpoint),
+            self.serde.loads(row.checkpoint_metadata) if row.checkpoint_metadata is not None else {},
+            {"configurable": {"thread_id": row.thread_id, "thread_ts": row.parent_id}} if row.parent_id else None,
+            pending_writes,
+        )
+
+
+def build_checkpointer() -> Optional[SQLAlchemyCheckpointSaver]:
+    """
+    Build the checkpointer shared by both workflows, or None when CHECKPOINT_ENABLED is off.
+    """
+    if not Config.CHECKPOINT_ENABLED:
+        return None
+    return SQLAlchemyCheckpointSaver(Config.CHECKPOINT_DATABASE_URL)
+
+
+checkpointer = build_checkpointer()
@@ -1,15 +1,46 @@
-from langchain_openai import ChatOpenAI
+from functools import lru_cache
 
+from app.gen_smart_contract.llm_models import chat_model, model_settings
 from app.gen_smart_contract.prompts.classify_contract_prompt import classify_contract_prompt
 from app.gen_smart_contract.prompts.code_gen_prompt import code_gen_prompt
 from app.gen_smart_contract.prompts.documentation_gen_prompt import documentation_gen_prompt
 from app.gen_smart_contract.prompts.update_contract_prompt import update_contract_prompt
-from app.gen_smart_contract.schema import classifyContractModel, generateContractModel, documentationGenerateModel
+from app.gen_smart_contract.prompts.update_functions_prompt import update_functions_prompt
+from app.gen_smart_contract.schema import (
+    classifyContractModel,
+    documentationGenerateModel,
+    generateContractModel,
+    updateFunctionsModel,
+)
+from app.gen_smart_contract.structured_chain import StructuredChain
 
-expt_llm = "gpt-4o-mini"
-llm = ChatOpenAI(temperature=0, model=expt_llm)
 
-classify_contract_chain = classify_contract_prompt | llm.with_structured_output(classifyContractModel)
-code_gen_chain = code_gen_prompt | llm.with_structured_output(generateContractModel)
-code_update_chain = update_contract_prompt | llm.with_structured_output(generateContractModel)
-documentation_gen_chain = documentation_gen_prompt | llm.with_structured_output(documentationGenerateModel)
\ No newline at end of file
+def routed_chain(name: str, prompt, output_model, stream_fields=(), temperature: float = 0.0) -> StructuredChain:
+    """
+    A chain on the model configured for it in LLM_MODELS, with its fallback model if it has one.
+    Only chains at temperature 0 are cached.
+    """
+    settings = model_settings(name)
+    fallback = settings.get("fallback")
+    return StructuredChain(
+        name, prompt, chat_model(settings, temperature), output_model, stream_fields=stream_fields,
+        fallback_llm=chat_model(settings, temperature, model=fallback) if fallback else None,
+        cacheable=temperature == 0,
+    )
+
+
+classify_contract_chain = routed_chain("classify", classify_contract_prompt, classifyContractModel)
+code_gen_chain = routed_chain("code_gen", code_gen_prompt, generateContractModel, stream_fields=("contract",))
+code_update_chain = routed_chain("code_update", update_contract_prompt, generateContractModel,
+                                 stream_fields=("contract",))
+code_functions_chain = routed_chain("code_functions", update_functions_prompt, updateFunctionsModel)
+documentation_gen_chain = routed_chain("documentation", documentation_gen_prompt, documentationGenerateModel,
+                                       stream_fields=("documentation",))
+
+
+@lru_cache(maxsize=16)
+def code_gen_candidate_chain(temperature: float) -> StructuredChain:
+    """
+    A code generation chain sampling at the given temperature, for speculative candidates.
+    """
+    return routed_chain("code_gen", code_gen_prompt, generateContractModel, temperature=temperature)
@@ -0,0 +1,169 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional
+
+from app.gen_smart_contract.metrics import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Bump when the shape of cached results changes so that stale entries are never read
+FORMAT_VERSION = "2"
+
+
+class CompileCache:
+    """
+    A content-addressed cache of compilation results.
+
+    An in-process LRU sits in front of a directory of JSON files. Both tiers
+    evict least recently used entries once their size budget in bytes is exceeded.
+    """
+
+    def __init__(self, directory: Optional[str], memory_max_bytes: int, disk_max_bytes: int):
+        self.directory = directory
+        self.memory_max_bytes = memory_max_bytes
+        self.disk_max_bytes = disk_max_bytes
+
+        self._lock = threading.Lock()
+        self._memory: "OrderedDict[str, bytes]" = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes: Optional[int] = None
+
+    @staticmethod
+    def key(source: str, solc_version: str, output_values: Iterable[str]) -> str:
+        digest = hashlib.sha256()
+        for part in (FORMAT_VERSION, source, solc_version, ",".join(sorted(output_values))):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            payload = self._memory.get(key)
+            if payload is not None:
+                self._memory.move_to_end(key)
+
+        if payload is not None:
+            metrics.incr("compile_cache_hits", tier="memory")
+            return json.loads(payload)
+
+        payload = self._read_disk(key)
+        if payload is not None:
+            metrics.incr("compile_cache_hits", tier="disk")
+            self._put_memory(key, payload)
+            return json.loads(payload)
+
+        metrics.incr("compile_cache_misses")
+        return None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        payload = json.dumps(value).encode("utf-8")
+        self._put_memory(key, payload)
+        self._write_disk(key, payload)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "hits": metrics.counter("compile_cache_hits", tier="memory")
+            + metrics.counter("compile_cache_hits", tier="disk"),
+            "misses": metrics.counter("compile_cache_misses"),
+            "memory_entries": len(self._memory),
+            "memory_bytes": self._memory_bytes,
+            "disk_bytes": self._disk_bytes,
+        }
+
+    def _put_memory(self, key: str, payload: bytes):
+        if len(payload) > self.memory_max_bytes:
+            return
+
+        with self._lock:
+            previous = self._memory.pop(key, None)
+            if previous is not None:
+                self._memory_bytes -= len(previous)
+
+            self._memory[key] = payload
+            self._memory_bytes += len(payload)
+
+            while self._memory_bytes > self.memory_max_bytes:
+                _, evicted = self._memory.popitem(last=False)
+                self._memory_bytes -= len(evicted)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read_disk(self, key: str) -> Optional[bytes]:
+        if not self.directory:
+            return None
+
+        try:
+            with open(self._path(key), "rb") as f:
+                payload = f.read()
+            # Touch the file so that disk eviction is least recently used
+            os.utime(self._path(key))
+            return payload
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            logger.warning(f"Could not read compile cache entry {key}: {e}")
+            return None
+
+    def _write_disk(self, key: str, payload: bytes):
+        if not self.directory:
+            return
+
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            tmp_path = f"{self._path(key)}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(payload)
+            # Overwriting an entry, such as one written concurrently by another process, replaces its bytes
+            try:
+                replaced = os.stat(self._path(key)).st_size
+            except FileNotFoundError:
+                replaced = 0
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"Could not write compile cache entry {key}: {e}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is None:
+                self._disk_bytes = self._scan_disk_bytes()
+            else:
+                self._disk_bytes += len(payload) - replaced
+
+            if self._disk_bytes > self.disk_max_bytes:
+                self._evict_disk()
+
+    def _scan_disk_bytes(self) -> int:
+        return sum(entry.stat().st_size for entry in os.scandir(self.directory) if entry.name.endswith(".json"))
+
+    def _evict_disk(self):
+        entries = sorted(
+            (entry for entry in os.scandir(self.directory) if entry.name.endswith(".json")),
+            key=lambda entry: entry.stat().st_mtime,
+        )
+        total = sum(entry.stat().st_size for entry in entries)
+
+        # Evict down to 90% of the budget so that every write does not trigger a scan
+        for entry in entries:
+            if total <= self.disk_max_bytes * 0.9:
+                break
+            try:
+                size = entry.stat().st_size
+                os.remove(entry.path)
+                total -= size
+            except OSError:
+                continue
+
+        self._disk_bytes = total
+
+
+compile_cache = CompileCache(
+    directory=Config.COMPILE_CACHE_DIR if Config.COMPILE_CACHE_ENABLED else None,
+    memory_max_bytes=Config.COMPILE_CACHE_MEMORY_BYTES if Config.COMPILE_CACHE_ENABLED else 0,
+    disk_max_bytes=Config.COMPILE_CACHE_DISK_BYTES,
+)
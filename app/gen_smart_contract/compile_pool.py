@@ -0,0 +1,196 @@
+import asyncio
+import subprocess
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import List, Optional
+
+from app.gen_smart_contract.metrics import metrics
+from config import Config
+
+try:
+    import resource
+except ImportError:  # Not available on Windows
+    resource = None
+
+
+class CompileQueueFull(Exception):
+    """Raised when the compile queue stays full for longer than the caller is willing to wait."""
+
+
+class CompileTimeout(Exception):
+    """Raised when solc exceeds its wall-clock limit and is killed."""
+
+
+class CompileCancelled(Exception):
+    """Raised when a compile job is cancelled before it finishes."""
+
+
+@dataclass
+class SolcOutput:
+    returncode: int
+    stdout: str
+    stderr: str
+
+
+class CompileJob:
+    """
+    A handle on a queued or running solc invocation.
+    """
+
+    def __init__(self, command: List[str], stdin: str):
+        self.command = command
+        self.stdin = stdin
+        self.submitted_at = time.perf_counter()
+        self.future: Optional[Future] = None
+        self.cancelled = False
+        self._proc: Optional[subprocess.Popen] = None
+
+    def result(self, timeout: Optional[float] = None) -> SolcOutput:
+        return self.future.result(timeout)
+
+    def cancel(self):
+        """
+        Drop the job if it is still queued, or kill its solc process if it is running.
+        """
+        self.cancelled = True
+        if self.future is not None:
+            self.future.cancel()
+        proc = self._proc
+        if proc is not None and proc.poll() is None:
+            proc.kill()
+
+
+class CompilePool:
+    """
+    A bounded pool of solc processes.
+
+    At most `workers` compilers run at once and at most `queue_size` more jobs wait
+    for a slot. Submitting to a full queue blocks for up to `queue_wait` seconds and
+    then fails with CompileQueueFull, so a burst of compiles pushes back on the
+    caller instead of piling up subprocesses on the host. Every solc process runs
+    under a wall-clock timeout and an address space limit.
+    """
+
+    def __init__(self, workers: int, queue_size: int, timeout: float, memory_bytes: int, queue_wait: float):
+        self.timeout = timeout
+        self.memory_bytes = memory_bytes
+        self.queue_wait = queue_wait
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="solc")
+        self._slots = threading.BoundedSemaphore(workers + queue_size)
+        self._lock = threading.Lock()
+        self._queued = 0
+        self._running = 0
+
+    def submit(self, command: List[str], stdin: str, queue_wait: Optional[float] = None) -> CompileJob:
+        """
+        Queue a solc invocation.
+
+        Args:
+            command (list): The solc command line
+            stdin (str): The data to pass to solc on stdin
+            queue_wait (float, optional): Overrides how long to wait for room in the queue
+
+        Returns:
+            CompileJob: A handle on the queued job
+
+        Raises:
+            CompileQueueFull: If the queue has no room within the wait time
+        """
+        if not self._slots.acquire(timeout=self.queue_wait if queue_wait is None else queue_wait):
+            metrics.incr("compile_rejected")
+            raise CompileQueueFull("Too many compilations in progress, please retry shortly")
+
+        return self._start(command, stdin)
+
+    async def asubmit(self, command: List[str], stdin: str, queue_wait: Optional[float] = None) -> CompileJob:
+        """
+        Queue a solc invocation without blocking the event loop. Only waiting for
+        room in a full queue is done in a thread.
+        """
+        if self._slots.acquire(blocking=False):
+            return self._start(command, stdin)
+        return await asyncio.to_thread(self.submit, command, stdin, queue_wait)
+
+    def run(self, command: List[str], stdin: str, queue_wait: Optional[float] = None) -> SolcOutput:
+        return self.submit(command, stdin, queue_wait).result()
+
+    def _start(self, command: List[str], stdin: str) -> CompileJob:
+        job = CompileJob(command, stdin)
+        self._update(queued=1)
+
+        job.future = self._executor.submit(self._run, job)
+        job.future.add_done_callback(lambda future: self._finish(job, future))
+
+        return job
+
+    def _finish(self, job: CompileJob, future: Future):
+        # A job cancelled while still queued never reaches _run
+        if future.cancelled():
+            self._update(queued=-1)
+        self._slots.release()
+
+    def _update(self, queued: int = 0, running: int = 0):
+        with self._lock:
+            self._queued += queued
+            self._running += running
+            metrics.set_gauge("compile_queue_depth", self._queued)
+            metrics.set_gauge("compile_running", self._running)
+
+    def _limit_memory(self, proc: subprocess.Popen):
+        # Set on the child after it started: a preexec_fn is not safe in the threaded servers this pool runs in.
+        # solc does no work until it reads its input, which is only written after this. prlimit is Linux-only
+        if not (self.memory_bytes and hasattr(resource, "prlimit")):
+            return
+        try:
+            resource.prlimit(proc.pid, resource.RLIMIT_AS, (self.memory_bytes, self.memory_bytes))
+        except ProcessLookupError:
+            # solc already exited, e.g. it could not start
+            pass
+
+    def _run(self, job: CompileJob) -> SolcOutput:
+        started = time.perf_counter()
+        self._update(queued=-1, running=1)
+        metrics.observe("compile_queue_wait_seconds", started - job.submitted_at)
+
+        try:
+            if job.cancelled:
+                raise CompileCancelled("Compilation was cancelled")
+
+            proc = subprocess.Popen(
+                job.command,
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                stderr=subprocess.PIPE,
+                encoding="utf8",
+            )
+            job._proc = proc
+            self._limit_memory(proc)
+
+            try:
+                stdout, stderr = proc.communicate(job.stdin, timeout=self.timeout)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+                proc.communicate()
+                metrics.incr("compile_timeouts")
+                raise CompileTimeout(f"Compilation exceeded the {self.timeout:g}s time limit")
+
+            if job.cancelled:
+                raise CompileCancelled("Compilation was cancelled")
+
+            return SolcOutput(proc.returncode, stdout, stderr)
+
+        finally:
+            metrics.observe("compile_seconds", time.perf_counter() - started)
+            self._update(running=-1)
+
+
+compile_pool = CompilePool(
+    workers=Config.COMPILE_WORKERS,
+    queue_size=Config.COMPILE_QUEUE_SIZE,
+    timeout=Config.COMPILE_TIMEOUT_SECONDS,
+    memory_bytes=Config.COMPILE_MEMORY_LIMIT_MB * 1024 * 1024,
+    queue_wait=Config.COMPILE_QUEUE_WAIT_SECONDS,
+)
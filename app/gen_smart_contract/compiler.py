@@ -0,0 +1,222 @@
+import asyncio
+import json
+import re
+from concurrent.futures import CancelledError
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.gen_smart_contract.compile_cache import compile_cache
+from app.gen_smart_contract.compile_pool import CompileCancelled, CompileJob, SolcOutput, compile_pool
+from app.gen_smart_contract.diagnostics import Diagnostic, format_for_prompt, parse_errors, to_dicts
+from app.gen_smart_contract.run_context import current_run_context
+from app.gen_smart_contract.solc_manager import solc_manager
+
+DEFAULT_OUTPUT_VALUES = ("abi", "bin")
+
+# The name the source is compiled under, which prefixes every contract identifier
+SOURCE_NAME = "<stdin>"
+
+# Map the combined-json output names used by callers to standard-JSON output selections
+_OUTPUT_SELECTION = {
+    "abi": "abi",
+    "bin": "evm.bytecode.object",
+    "bin-runtime": "evm.deployedBytecode.object",
+}
+
+
+@dataclass
+class CompileResult:
+    """
+    The outcome of compiling a Solidity source.
+
+    Attributes:
+        success: Whether the source compiled without errors.
+        contracts: The compiler output per contract, keyed by contract identifier.
+        errors: The formatted compiler errors if compilation failed.
+        solc_version: The installed solc version the source was compiled with.
+        diagnostics: The structured errors and warnings reported by solc.
+    """
+
+    success: bool
+    contracts: Dict[str, Dict[str, Any]] = field(default_factory=dict)
+    errors: str = ""
+    solc_version: str = ""
+    diagnostics: List[Dict[str, Any]] = field(default_factory=list)
+
+    def main_contract(self, source: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """
+        Pick the contract a user would deploy: the last deployable contract defined in the source.
+
+        Args:
+            source (str): The compiled source
+
+        Returns:
+            tuple: The contract identifier and its outputs, or None if nothing was compiled
+        """
+        if not self.contracts:
+            return None
+
+        def position(item):
+            match = re.search(rf"\bcontract\s+{re.escape(item[0].rsplit(':', 1)[-1])}\b", source)
+            return match.start() if match else -1
+
+        deployable = [item for item in self.contracts.items() if item[1].get("bin") != ""]
+        return max(deployable or list(self.contracts.items()), key=position)
+
+
+def _standard_json_input(source: str, output_values: Tuple[str, ...]) -> str:
+    return json.dumps({
+        "language": "Solidity",
+        "sources": {SOURCE_NAME: {"content": source}},
+        "settings": {
+            "outputSelection": {"*": {"*": [_OUTPUT_SELECTION[v] for v in output_values]}},
+        },
+    })
+
+
+def _select_outputs(data: Dict[str, Any], output_values: Tuple[str, ...]) -> Dict[str, Any]:
+    outputs = {}
+    for value in output_values:
+        node = data
+        for part in _OUTPUT_SELECTION[value].split("."):
+            node = node.get(part, {})
+        outputs[value] = node
+    return outputs
+
+
+def compile_contract(source: str, solc_version: str,
+                     output_values: Tuple[str, ...] = DEFAULT_OUTPUT_VALUES,
+                     queue_wait: Optional[float] = None,
+                     on_submit: Optional[Callable[[CompileJob], None]] = None) -> CompileResult:
+    """
+    Compile a Solidity source through solc's standard-JSON interface, reusing the
+    cached result of an identical earlier compile.
+
+    Args:
+        source (str): The Solidity source code
+        solc_version (str): The solc version or pragma range to compile with
+        output_values (tuple): The compiler outputs to select, any of "abi", "bin" and "bin-runtime"
+        queue_wait (float, optional): How long to wait for room in the compile queue
+        on_submit (callable, optional): Called with the queued CompileJob, e.g. to cancel it later
+
+    Returns:
+        CompileResult: The compiled contracts, or the compiler errors
+
+    Raises:
+        SolcVersionUnavailable: If no installed solc binary matches the requested version
+        CompileQueueFull: If the compile pool has no room for the job
+        CompileTimeout: If solc exceeds its time limit
+        CompileCancelled: If the job was cancelled through on_submit or the run's cancel token
+    """
+    version = solc_manager.resolve(solc_version, source)
+    key = compile_cache.key(source, str(version), output_values)
+
+    cached = compile_cache.get(key)
+    if cached is not None:
+        return CompileResult(**cached)
+
+    command = [str(solc_manager.executable(version)), "--standard-json"]
+    job = compile_pool.submit(command, _standard_json_input(source, output_values), queue_wait=queue_wait)
+    if on_submit is not None:
+        on_submit(job)
+
+    unwatch = _watch(job)
+    try:
+        output = job.result()
+    except CancelledError:
+        raise CompileCancelled("Compilation was cancelled")
+    finally:
+        unwatch()
+
+    result = _build_result(output, source, str(version), output_values)
+    if _deterministic(output):
+        compile_cache.set(key, asdict(result))
+
+    return result
+
+
+async def acompile_contract(source: str, solc_version: str,
+                            output_values: Tuple[str, ...] = DEFAULT_OUTPUT_VALUES,
+                            queue_wait: Optional[float] = None,
+                            on_submit: Optional[Callable[[CompileJob], None]] = None) -> CompileResult:
+    """
+    The asyncio counterpart of compile_contract, awaiting the compile pool instead
+    of blocking a thread on it. The compiler registry, whose first use scans or
+    installs the compilers, and the compile cache on disk are read in a thread.
+    """
+    version = await asyncio.to_thread(solc_manager.resolve, solc_version, source)
+    key = compile_cache.key(source, str(version), output_values)
+
+    cached = await asyncio.to_thread(compile_cache.get, key)
+    if cached is not None:
+        return CompileResult(**cached)
+
+    command = [str(solc_manager.executable(version)), "--standard-json"]
+    job = await compile_pool.asubmit(command, _standard_json_input(source, output_values), queue_wait=queue_wait)
+    if on_submit is not None:
+        on_submit(job)
+
+    unwatch = _watch(job)
+    try:
+        output = await asyncio.wrap_future(job.future)
+    except asyncio.CancelledError:
+        # Cancelling the task only drops a queued job, a running solc has to be killed
+        job.cancel()
+        if asyncio.current_task().cancelling():
+            raise
+        raise CompileCancelled("Compilation was cancelled")
+    finally:
+        unwatch()
+
+    result = _build_result(output, source, str(version), output_values)
+    if _deterministic(output):
+        await asyncio.to_thread(compile_cache.set, key, asdict(result))
+
+    return result
+
+
+def _watch(job: CompileJob) -> Callable[[], None]:
+    # Kill the job if the run is cancelled while it waits for it
+    cancel_token = current_run_context().cancel_token
+    return cancel_token.on_cancel(job.cancel) if cancel_token is not None else (lambda: None)
+
+
+def _deterministic(output: SolcOutput) -> bool:
+    """
+    Whether solc finished on its own with a standard-JSON answer. A solc killed by
+    a signal or the memory limit fails transiently, so its result is not cached.
+    """
+    if output.returncode < 0:
+        return False
+    try:
+        json.loads(output.stdout)
+    except ValueError:
+        return False
+    return True
+
+
+def _build_result(output: SolcOutput, source: str, version: str, output_values: Tuple[str, ...]) -> CompileResult:
+    try:
+        standard_output = json.loads(output.stdout)
+        diagnostics = parse_errors(standard_output.get("errors", []), source)
+    except ValueError:
+        # solc only fails outright on invalid input or when it is killed, e.g. by the memory limit; see _deterministic
+        standard_output = {}
+        diagnostics = [Diagnostic(severity="error", message=output.stderr.strip() or "solc failed")]
+
+    contracts = {
+        f"{file_name}:{contract_name}": _select_outputs(data, output_values)
+        for file_name, file_contracts in standard_output.get("contracts", {}).items()
+        for contract_name, data in file_contracts.items()
+    }
+
+    if not contracts and all(d.severity != "error" for d in diagnostics):
+        diagnostics.insert(0, Diagnostic(severity="error", message="No contracts found in the source"))
+
+    if contracts and all(d.severity != "error" for d in diagnostics):
+        return CompileResult(success=True, contracts=contracts, solc_version=version,
+                             diagnostics=to_dicts(diagnostics))
+
+    # Compiler errors are deterministic for a given source, so they are cached too
+    return CompileResult(success=False, errors=format_for_prompt(to_dicts(diagnostics)),
+                         solc_version=version, diagnostics=to_dicts(diagnostics))
@@ -0,0 +1,288 @@
+import re
+import textwrap
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional, Tuple
+
+ADD = "add"
+REPLACE = "replace"
+DELETE = "delete"
+
+_CONTAINER = re.compile(r"\b(?:abstract\s+)?(contract|library|interface)\s+(\w+)")
+_NAMED = re.compile(r"^\s*(function|modifier|event|error|struct|enum)\s+(\w+)")
+_SPECIAL = re.compile(r"^\s*(constructor|receive|fallback)\b")
+_VARIABLE = re.compile(r"(\w+)\s*;")
+
+
+class PatchError(Exception):
+    """Raised when patches cannot be spliced into a contract unambiguously."""
+
+
+@dataclass
+class Member:
+    """
+    A declaration in the body of a contract, with its leading comments.
+
+    Attributes:
+        kind: "function", "modifier", "constructor", "event", "variable", ...
+        name: The declared name, or the keyword for constructor, receive and fallback.
+        signature: The name and parameter types, such as "transfer(address,uint256)", for functions.
+        start: Offset of the first character, including leading comments.
+        declaration_start: Offset of the declaration itself, after its leading comments.
+        end: Offset after the closing brace or semicolon.
+    """
+
+    kind: str
+    name: str
+    signature: str
+    start: int
+    declaration_start: int
+    end: int
+
+
+@dataclass
+class Container:
+    """
+    A contract, library or interface, and the members of its body.
+    """
+
+    kind: str
+    name: str
+    start: int
+    end: int
+    members: List[Member] = field(default_factory=list)
+
+
+def _code_mask(source: str) -> List[bool]:
+    """
+    Mark which characters are code rather than comments or string literals.
+    """
+    mask = [True] * len(source)
+    i, n = 0, len(source)
+    while i < n:
+        two = source[i:i + 2]
+        if two == "//":
+            end = source.find("\n", i)
+            end = n if end == -1 else end
+        elif two == "/*":
+            end = source.find("*/", i + 2)
+            end = n if end == -1 else end + 2
+        elif source[i] in "\"'":
+            quote, end = source[i], i + 1
+            while end < n and source[end] != quote and source[end] != "\n":
+                end += 2 if source[end] == "\\" else 1
+            end = min(end + 1, n)
+        else:
+            i += 1
+            continue
+        for j in range(i, end):
+            mask[j] = False
+        i = end
+    return mask
+
+
+def _strip(text: str, mask: Iterable[bool]) -> str:
+    return "".join(c if code else " " for c, code in zip(text, mask))
+
+
+def _parameter_types(parameters: str) -> List[str]:
+    return [p.split()[0] for p in parameters.split(",") if p.strip()]
+
+
+def _describe(text: str) -> Tuple[str, str, str]:
+    """
+    Work out the kind, name and signature of a member from its comment-free source.
+    """
+    match = _NAMED.match(text)
+    if match:
+        kind, name = match.groups()
+        if kind != "function":
+            return kind, name, name
+        parameters = re.match(r"\s*\(([^)]*)\)", text[match.end():])
+        types = _parameter_types(parameters.group(1)) if parameters else []
+        return kind, name, f"{name}({','.join(types)})"
+
+    match = _SPECIAL.match(text)
+    if match:
+        return match.group(1), match.group(1), match.group(1)
+
+    if re.match(r"^\s*using\b", text):
+        return "using", " ".join(text.split()), " ".join(text.split())
+
+    # A state variable or constant, named by the last identifier before its initializer
+    declaration = re.split(r"=(?!>)", text, 1)[0]
+    names = _VARIABLE.findall(declaration.rstrip().rstrip(";") + ";")
+    name = names[-1] if names else " ".join(text.split())
+    return "variable", name, name
+
+
+def parse_contract(source: str) -> List[Container]:
+    """
+    Split a Solidity source into its contracts and their members.
+
+    Returns:
+        list: The contracts, libraries and interfaces in source order
+    """
+    mask = _code_mask(source)
+    code = _strip(source, mask)
+    containers: List[Container] = []
+
+    position = 0
+    while True:
+        match = _CONTAINER.search(code, position)
+        if match is None:
+            break
+        body = code.find("{", match.end())
+        if body == -1:
+            break
+
+        container = Container(match.group(1), match.group(2), match.start(), len(source))
+        depth, member_start, member_has_block = 1, body + 1, False
+        i = body + 1
+        while i < len(code):
+            c = code[i]
+            if c == "{":
+                depth += 1
+                member_has_block = True
+            elif c == "}":
+                depth -= 1
+                if depth == 0:
+                    container.end = i + 1
+                    break
+                if depth == 1 and member_has_block:
+                    container.members.append(_member(source, code, member_start, i + 1))
+                    member_start, member_has_block = i + 1, False
+            elif c == ";" and depth == 1:
+                container.members.append(_member(source, code, member_start, i + 1))
+                member_start = i + 1
+            i += 1
+
+        containers.append(container)
+        position = container.end
+
+    return containers
+
+
+def _member(source: str, code: str, start: int, end: int) -> Member:
+    # Leading comments belong to the member that follows them
+    while start < end and source[start].isspace():
+        start += 1
+    declaration_start = start
+    while declaration_start < end and code[declaration_start].isspace():
+        declaration_start += 1
+    kind, name, signature = _describe(code[start:end])
+    return Member(kind, name, signature, start, declaration_start, end)
+
+
+def _normalize_signature(name: str) -> str:
+    return re.sub(r"\s+", "", name)
+
+
+def _find(containers: List[Container], name: str, code: str, contract_name: str) -> Optional[Tuple[Container, Member]]:
+    """
+    Find the member a patch refers to, by signature when overloads share its name.
+    """
+    candidates = [c for c in containers if not contract_name or c.name == contract_name]
+    wanted = _normalize_signature(name)
+    by_signature = "(" in wanted
+
+    matches = [
+        (c, m) for c in candidates for m in c.members
+        if (m.signature if by_signature else m.name) == wanted
+    ]
+    if len(matches) > 1 and code:
+        # Overloads or homonyms in several contracts, disambiguated by the new code's signature
+        signature = _describe(_strip(code, _code_mask(code)).lstrip())[2]
+        matches = [(c, m) for c, m in matches if m.signature == signature] or matches
+    if len(matches) > 1:
+        # An interface declaration and its implementation, the implementation is meant
+        matches = [(c, m) for c, m in matches if c.kind == "contract"] or matches
+    if len(matches) > 1:
+        raise PatchError(f"{name} is ambiguous, it matches {len(matches)} declarations")
+    return matches[0] if matches else None
+
+
+def _main_container(containers: List[Container], contract_name: str) -> Container:
+    if contract_name:
+        for container in containers:
+            if container.name == contract_name:
+                return container
+        raise PatchError(f"Contract {contract_name} not found")
+
+    contracts = [c for c in containers if c.kind == "contract"] or containers
+    if not contracts:
+        raise PatchError("No contract to add the function to")
+    return contracts[-1]
+
+
+def _indent_of(source: str, offset: int) -> str:
+    line_start = source.rfind("\n", 0, offset) + 1
+    return re.match(r"[ \t]*", source[line_start:]).group(0)
+
+
+def _reindent(code: str, indent: str) -> str:
+    return textwrap.indent(textwrap.dedent(code.strip("\n")).strip(), indent).lstrip()
+
+
+def apply_patches(source: str, patches) -> str:
+    """
+    Splice function-level patches into a contract. A patch replaces, adds or
+    deletes one function, or another contract member such as a modifier, event or
+    state variable, identified by its name or its signature.
+
+    Args:
+        source (str): The contract source
+        patches (list): functionModel patches with an action, function_name, code and optional contract_name
+
+    Returns:
+        str: The patched source
+
+    Raises:
+        PatchError: If a patch replaces a member that does not exist, refers to an
+            ambiguous member, or patches overlap
+    """
+    containers = parse_contract(source)
+    if not containers:
+        raise PatchError("No contract found in the source")
+
+    edits: List[Tuple[int, int, str]] = []
+    additions: dict = {}
+    for patch in patches:
+        action = (patch.action or REPLACE).lower()
+        contract_name = getattr(patch, "contract_name", "") or ""
+        found = _find(containers, patch.function_name, patch.code, contract_name)
+
+        if action == DELETE:
+            if found is not None:
+                _, member = found
+                # Take the line the member was on with it
+                start = source.rfind("\n", 0, member.start) + 1
+                end = source.find("\n", member.end)
+                edits.append((start, member.end if end == -1 else end + 1, ""))
+        elif action != ADD:
+            if found is None:
+                # Most likely a misspelled name or signature, adding the code would declare the member twice
+                raise PatchError(f"{patch.function_name} not found, it cannot be replaced")
+            _, member = found
+            # The member's comments are kept unless the new code comes with its own
+            start = member.start if patch.code.lstrip().startswith(("//", "/*")) else member.declaration_start
+            edits.append((start, member.end, _reindent(patch.code, _indent_of(source, start))))
+        else:
+            container = _main_container(containers, contract_name)
+            additions.setdefault(container.end - 1, []).append(patch.code)
+
+    for offset, codes in additions.items():
+        indent = _indent_of(source, offset) + "    "
+        block = "\n".join(f"{indent}{_reindent(code, indent)}\n" for code in codes)
+        # Added members go last, before the closing brace, on its own line unless it shares one with code
+        line_start = source.rfind("\n", 0, offset) + 1
+        at = offset if source[line_start:offset].strip() else line_start
+        edits.append((at, at, "\n" + block))
+
+    edits.sort(key=lambda e: (e[0], e[1]))
+    for (start_a, end_a, _), (start_b, _, _) in zip(edits, edits[1:]):
+        if start_b < end_a:
+            raise PatchError("Patches overlap")
+
+    for start, end, text in reversed(edits):
+        source = source[:start] + text + source[end:]
+    return source
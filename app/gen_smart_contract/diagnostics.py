@@ -0,0 +1,137 @@
+from dataclasses import asdict, dataclass
+from typing import Any, Dict, List, Optional
+
+# Lines of source shown on each side of the offending line
+SNIPPET_CONTEXT_LINES = 2
+
+# Upper bound on the diagnostics sent back to the model in a retry prompt
+MAX_PROMPT_DIAGNOSTICS = 8
+
+
+@dataclass
+class Diagnostic:
+    """
+    A single compiler error or warning.
+
+    Attributes:
+        severity: "error", "warning" or "info".
+        code: The solc error code, e.g. "7576".
+        type: The solc error type, e.g. "DeclarationError".
+        message: The short error message.
+        line: The 1-based line of the error in the source, if known.
+        column: The 1-based column of the error in the source, if known.
+        snippet: The source lines around the error, with the offending line marked.
+    """
+
+    severity: str
+    message: str
+    code: Optional[str] = None
+    type: Optional[str] = None
+    line: Optional[int] = None
+    column: Optional[int] = None
+    snippet: str = ""
+
+    def format(self) -> str:
+        location = f"line {self.line}:{self.column} " if self.line else ""
+        label = " ".join(p for p in (self.type, f"({self.code})" if self.code else None) if p)
+        header = f"{location}{self.severity}: {label + ': ' if label else ''}{self.message}"
+        return f"{header}\n{self.snippet}" if self.snippet else header
+
+
+def _position(source_bytes: bytes, offset: int):
+    # solc reports byte offsets into the UTF-8 encoded source
+    before = source_bytes[:max(offset, 0)]
+    line = before.count(b"\n") + 1
+    column = len(before) - (before.rfind(b"\n") + 1) + 1
+    return line, column
+
+
+def _snippet(lines: List[str], line: int) -> str:
+    start = max(line - 1 - SNIPPET_CONTEXT_LINES, 0)
+    end = min(line + SNIPPET_CONTEXT_LINES, len(lines))
+    width = len(str(end))
+    return "\n".join(
+        f"{'>' if number == line else ' '} {number:>{width}} | {lines[number - 1]}"
+        for number in range(start + 1, end + 1)
+    )
+
+
+def parse_errors(errors: List[Dict[str, Any]], source: str) -> List[Diagnostic]:
+    """
+    Convert the "errors" of a solc standard-JSON output into diagnostics.
+
+    Args:
+        errors (list): The error objects reported by solc
+        source (str): The compiled source, used to locate errors and cut snippets
+
+    Returns:
+        list: The diagnostics, errors first
+    """
+    source_bytes = source.encode("utf-8")
+    lines = source.splitlines()
+
+    diagnostics = []
+    for error in errors:
+        location = error.get("sourceLocation") or {}
+        line = column = None
+        snippet = ""
+        if "start" in location and location["start"] >= 0:
+            line, column = _position(source_bytes, location["start"])
+            snippet = _snippet(lines, line) if lines else ""
+
+        diagnostics.append(Diagnostic(
+            severity=error.get("severity", "error"),
+            message=error.get("message", "").strip(),
+            code=error.get("errorCode"),
+            type=error.get("type"),
+            line=line,
+            column=column,
+            snippet=snippet,
+        ))
+
+    return sorted(diagnostics, key=lambda d: d.severity != "error")
+
+
+def to_dicts(diagnostics: List[Diagnostic]) -> List[Dict[str, Any]]:
+    return [asdict(d) for d in diagnostics]
+
+
+def format_for_prompt(diagnostics: List[Dict[str, Any]], limit: int = MAX_PROMPT_DIAGNOSTICS) -> str:
+    """
+    Render the errors among the diagnostics compactly for a retry prompt.
+
+    Args:
+        diagnostics (list): Diagnostics as dictionaries
+        limit (int): The maximum number of errors to render, in the order solc reported them
+
+    Returns:
+        str: One block per error, with its location and source snippet
+    """
+    errors = [Diagnostic(**d) for d in diagnostics if d["severity"] == "error"]
+    blocks = [d.format() for d in errors[:limit]]
+
+    if len(errors) > limit:
+        blocks.append(f"... and {len(errors) - limit} more errors")
+
+    return "\n\n".join(blocks)
+
+
+def prompt_error_count(diagnostics: List[Dict[str, Any]]) -> int:
+    """
+    The number of errors format_for_prompt renders by default.
+    """
+    return min(sum(d["severity"] == "error" for d in diagnostics), MAX_PROMPT_DIAGNOSTICS)
+
+
+def retry_message(errors: str) -> str:
+    """
+    The instructions appended to the prompt of a round that retries a contract
+    which failed to compile with the given formatted errors.
+    """
+    return (
+        "\n ----- \n"
+        "The previous contract failed to compile with these errors:\n\n"
+        f"{errors}\n"
+        "\n ----- \n"
+        "Fix these errors and return the complete corrected contract."
+    )
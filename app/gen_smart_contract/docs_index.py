@@ -0,0 +1,300 @@
+import functools
+import json
+import logging
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.gen_smart_contract.docs_snapshot import get_docs_content, load_manifest, snapshot_dir
+from app.gen_smart_contract.tokens import count_tokens
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+PAGE_SEPARATOR = "\n\n\n --- \n\n\n"
+SECTION_SEPARATOR = "\n\n --- \n\n"
+
+# Sphinx renders a pilcrow after every heading, which survives the HTML to text extraction
+HEADING_MARKER = "¶"
+
+# Sections longer than this are split into paragraph windows
+MAX_SECTION_TOKENS = 400
+
+# BM25 parameters
+K1 = 1.5
+B = 0.75
+
+_TOKEN_PATTERN = re.compile(r"[a-z0-9_]+")
+
+
+def tokenize(text: str) -> List[str]:
+    return _TOKEN_PATTERN.findall(text.lower())
+
+
+def split_sections(content: str) -> List[Dict[str, str]]:
+    """
+    Split the concatenated documentation into heading-delimited sections,
+    breaking up sections that are too long to be useful prompt context.
+
+    Args:
+        content (str): The concatenated documentation
+
+    Returns:
+        list: Sections with a title and text
+    """
+    sections = []
+
+    for page in content.split(PAGE_SEPARATOR):
+        title = ""
+        lines = []
+
+        for line in page.splitlines():
+            if line.rstrip().endswith(HEADING_MARKER):
+                sections.extend(_window(title, "\n".join(lines)))
+                title = line.rstrip().rstrip(HEADING_MARKER).strip()
+                lines = [title]
+            else:
+                lines.append(line)
+
+        sections.extend(_window(title, "\n".join(lines)))
+
+    return sections
+
+
+def _window(title: str, text: str) -> List[Dict[str, str]]:
+    text = re.sub(r"\n{3,}", "\n\n", text).strip()
+    if not text:
+        return []
+
+    if count_tokens(text) <= MAX_SECTION_TOKENS:
+        return [{"title": title, "text": text}]
+
+    windows = []
+    current = []
+    current_tokens = 0
+    for paragraph in text.split("\n\n"):
+        paragraph_tokens = count_tokens(paragraph)
+        if current and current_tokens + paragraph_tokens > MAX_SECTION_TOKENS:
+            windows.append({"title": title, "text": "\n\n".join(current)})
+            current, current_tokens = [], 0
+        current.append(paragraph)
+        current_tokens += paragraph_tokens
+
+    if current:
+        windows.append({"title": title, "text": "\n\n".join(current)})
+
+    return windows
+
+
+class DocsIndex:
+    """
+    A BM25 index over the sections of the Solidity documentation snapshot.
+
+    The term frequencies are stored column-wise (one posting list per term) so
+    that a query only touches the postings of its own terms.
+    """
+
+    def __init__(self, sections: List[Dict[str, str]], vocabulary: Dict[str, int], indptr: np.ndarray,
+                 doc_ids: np.ndarray, term_freqs: np.ndarray, doc_lengths: np.ndarray, section_tokens: np.ndarray):
+        self.sections = sections
+        self.vocabulary = vocabulary
+        self.indptr = indptr
+        self.doc_ids = doc_ids
+        self.term_freqs = term_freqs
+        self.doc_lengths = doc_lengths
+        self.section_tokens = section_tokens
+
+        doc_freqs = np.diff(indptr).astype(np.float64)
+        n_docs = len(sections)
+        self.idf = np.log(1 + (n_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        self.avg_length = float(doc_lengths.mean()) if n_docs else 0.0
+
+    @classmethod
+    def build(cls, content: str) -> "DocsIndex":
+        sections = split_sections(content)
+        counts = [Counter(tokenize(s["text"])) for s in sections]
+
+        vocabulary = {}
+        for counter in counts:
+            for term in counter:
+                vocabulary.setdefault(term, len(vocabulary))
+
+        postings = [[] for _ in vocabulary]
+        for doc_id, counter in enumerate(counts):
+            for term, freq in counter.items():
+                postings[vocabulary[term]].append((doc_id, freq))
+
+        indptr = np.zeros(len(vocabulary) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(p) for p in postings])
+        doc_ids = np.array([d for p in postings for d, _ in p], dtype=np.int32)
+        term_freqs = np.array([f for p in postings for _, f in p], dtype=np.float32)
+        doc_lengths = np.array([sum(c.values()) for c in counts], dtype=np.float32)
+        section_tokens = np.array([count_tokens(s["text"]) for s in sections], dtype=np.int64)
+
+        return cls(sections, vocabulary, indptr, doc_ids, term_freqs, doc_lengths, section_tokens)
+
+    def save(self, path: str):
+        np.savez_compressed(path + ".npz", indptr=self.indptr, doc_ids=self.doc_ids,
+                            term_freqs=self.term_freqs, doc_lengths=self.doc_lengths,
+                            section_tokens=self.section_tokens)
+        with open(path + ".json", "w", encoding="utf-8") as f:
+            json.dump({"sections": self.sections, "vocabulary": self.vocabulary}, f)
+
+    @classmethod
+    def load(cls, path: str) -> "DocsIndex":
+        with open(path + ".json", encoding="utf-8") as f:
+            meta = json.load(f)
+        arrays = np.load(path + ".npz")
+        return cls(meta["sections"], meta["vocabulary"], arrays["indptr"], arrays["doc_ids"],
+                   arrays["term_freqs"], arrays["doc_lengths"], arrays["section_tokens"])
+
+    def scores(self, query: str) -> np.ndarray:
+        scores = np.zeros(len(self.sections), dtype=np.float64)
+
+        for term, query_freq in Counter(tokenize(query)).items():
+            term_id = self.vocabulary.get(term)
+            if term_id is None:
+                continue
+
+            start, end = self.indptr[term_id], self.indptr[term_id + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.term_freqs[start:end]
+            norm = K1 * (1 - B + B * self.doc_lengths[docs] / self.avg_length)
+            scores[docs] += query_freq * self.idf[term_id] * tf * (K1 + 1) / (tf + norm)
+
+        return scores
+
+    def search(self, query: str, top_k: int, token_budget: int, exclude: Sequence[int] = ()) -> List[int]:
+        """
+        Select the best matching sections that fit in the token budget.
+
+        Args:
+            query (str): The text to match sections against
+            top_k (int): The maximum number of sections to return
+            token_budget (int): The maximum number of tokens across the returned sections
+            exclude (list, optional): IDs of sections that are already selected
+
+        Returns:
+            list: The IDs of the selected sections in ranked order
+        """
+        scores = self.scores(query)
+        scores[list(exclude)] = 0
+        ranked = np.argsort(-scores, kind="stable")
+
+        selected = []
+        used = 0
+        for doc_id in ranked:
+            if len(selected) == top_k or scores[doc_id] <= 0:
+                break
+            if used + self.section_tokens[doc_id] > token_budget:
+                continue
+            selected.append(int(doc_id))
+            used += int(self.section_tokens[doc_id])
+
+        return selected
+
+
+_index: Optional[DocsIndex] = None
+_index_lock = threading.Lock()
+
+
+def _index_path() -> str:
+    return os.path.join(snapshot_dir(), f"docs-index.{load_manifest()['sha256'][:12]}")
+
+
+def build_index() -> DocsIndex:
+    """
+    Build the index for the current snapshot and persist it next to the snapshot,
+    replacing indexes of older snapshots. Run by the refresh command, as the
+    snapshot directory may be read-only when serving requests.
+
+    Returns:
+        DocsIndex: The new index
+    """
+    global _index
+
+    index = DocsIndex.build(get_docs_content())
+    path = _index_path()
+    index.save(path)
+
+    for name in os.listdir(snapshot_dir()):
+        if name.startswith("docs-index.") and not name.startswith(os.path.basename(path)):
+            os.remove(os.path.join(snapshot_dir(), name))
+
+    _index = index
+    return index
+
+
+def get_index() -> DocsIndex:
+    """
+    Load the persisted index on first use. If the snapshot has none yet, the
+    index is built in memory for this process only.
+
+    Returns:
+        DocsIndex: The index for the current snapshot
+    """
+    global _index
+
+    if _index is None:
+        with _index_lock:
+            if _index is None:
+                path = _index_path()
+                if os.path.exists(path + ".npz"):
+                    _index = DocsIndex.load(path)
+                else:
+                    logger.warning(f"No docs index at {path}, building it in memory. "
+                                   f"Run the refresh-solidity-docs command to persist it.")
+                    _index = DocsIndex.build(get_docs_content())
+
+    return _index
+
+
+@functools.lru_cache(maxsize=4)
+def pinned_sections(index: DocsIndex, query: str, token_budget: int) -> Tuple[int, ...]:
+    """
+    The sections that lead every retrieved context, in a fixed order, so that the
+    prompts of all requests start with the same documentation.
+    """
+    if not query or token_budget <= 0:
+        return ()
+    return tuple(index.search(query, top_k=len(index.sections), token_budget=token_budget))
+
+
+def retrieve_context(*queries: str, token_budget: Optional[int] = None, top_k: Optional[int] = None,
+                     pinned_token_budget: Optional[int] = None) -> str:
+    """
+    Build the documentation context for a prompt: the pinned sections, then the
+    sections most relevant to the given queries. Falls back to the whole corpus
+    when retrieval is disabled.
+
+    Args:
+        queries (str): The prompt, requirements and compiler errors to match against
+        token_budget (int, optional): Overrides DOCS_CONTEXT_TOKEN_BUDGET
+        top_k (int, optional): Overrides DOCS_TOP_K
+        pinned_token_budget (int, optional): Overrides DOCS_PINNED_TOKEN_BUDGET
+
+    Returns:
+        str: The documentation context
+    """
+    if not Config.DOCS_RETRIEVAL_ENABLED:
+        return get_docs_content()
+
+    index = get_index()
+    token_budget = token_budget or Config.DOCS_CONTEXT_TOKEN_BUDGET
+
+    if pinned_token_budget is None:
+        pinned_token_budget = Config.DOCS_PINNED_TOKEN_BUDGET
+
+    pinned = pinned_sections(index, Config.DOCS_PINNED_QUERY, min(pinned_token_budget, token_budget))
+    relevant = index.search(
+        "\n".join(q for q in queries if q),
+        top_k=top_k or Config.DOCS_TOP_K,
+        token_budget=token_budget - int(index.section_tokens[list(pinned)].sum()),
+        exclude=pinned,
+    )
+
+    return SECTION_SEPARATOR.join(index.sections[doc_id]["text"] for doc_id in (*pinned, *relevant))
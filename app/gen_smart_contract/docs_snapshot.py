@@ -0,0 +1,170 @@
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import threading
+from datetime import datetime
+from functools import lru_cache
+from typing import Any, Dict, List, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_NAME = "solidity-docs.json"
+
+# Set when the snapshot had to be scraped at run time into a temporary directory,
+# because none was shipped and DOCS_SNAPSHOT_DIR is read-only
+_fallback_dir: Optional[str] = None
+_fallback_lock = threading.Lock()
+
+
+class DocsSnapshotError(RuntimeError):
+    """Raised when the Solidity documentation snapshot is missing or corrupt."""
+
+
+def snapshot_dir() -> str:
+    return _fallback_dir or Config.DOCS_SNAPSHOT_DIR
+
+
+def _manifest_path() -> str:
+    return os.path.join(snapshot_dir(), MANIFEST_NAME)
+
+
+def write_snapshot(content: str, version: str, sources: List[str]) -> Dict[str, Any]:
+    """
+    Write the concatenated documentation to a content-hashed snapshot file
+    and point the manifest at it.
+
+    Args:
+        content (str): The concatenated documentation text
+        version (str): The Solidity documentation version that was scraped
+        sources (list): The URLs the content was loaded from
+
+    Returns:
+        dict: The manifest that was written
+    """
+    digest = hashlib.sha256(content.encode("utf-8")).hexdigest()
+    file_name = f"solidity-docs-v{version}.{digest[:12]}.txt"
+
+    os.makedirs(snapshot_dir(), exist_ok=True)
+    with open(os.path.join(snapshot_dir(), file_name), "w", encoding="utf-8") as f:
+        f.write(content)
+
+    manifest = {
+        "version": version,
+        "file": file_name,
+        "sha256": digest,
+        "characters": len(content),
+        "sources": sources,
+        "created_at": datetime.utcnow().isoformat(timespec="seconds") + "Z",
+    }
+
+    # Write the manifest last so readers never see a manifest without its file
+    tmp_path = _manifest_path() + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_path, _manifest_path())
+
+    # Remove snapshots superseded by this one
+    for name in os.listdir(snapshot_dir()):
+        if name.startswith("solidity-docs-v") and name.endswith(".txt") and name != file_name:
+            os.remove(os.path.join(snapshot_dir(), name))
+
+    load_manifest.cache_clear()
+    get_docs_content.cache_clear()
+
+    return manifest
+
+
+def refresh_snapshot() -> Dict[str, Any]:
+    """
+    Scrape the Solidity documentation over the network and write a new snapshot.
+    This is the only code path that touches the network loader.
+
+    Returns:
+        dict: The manifest of the new snapshot
+    """
+    # Imported here so that the scraping dependencies are never loaded on the request path
+    from app.gen_smart_contract.load_data import DOCS_VERSION, load_concatenated_content, urls
+
+    content = load_concatenated_content(urls)
+    # The loader skips pages it cannot fetch, so an offline scrape comes back empty
+    if not content.strip():
+        raise DocsSnapshotError("Scraping the Solidity documentation returned no content")
+
+    return write_snapshot(content, DOCS_VERSION, urls)
+
+
+def _scrape_missing_snapshot() -> Dict[str, Any]:
+    """
+    Scrape the documentation when no snapshot was shipped, as the app did before
+    snapshots existed, and keep it as the snapshot of later reads and processes.
+    Falls back to a temporary directory when DOCS_SNAPSHOT_DIR is read-only.
+
+    Returns:
+        dict: The manifest of the scraped snapshot
+    """
+    global _fallback_dir
+
+    with _fallback_lock:
+        # Another thread may have scraped it while this one waited
+        if os.path.exists(_manifest_path()):
+            with open(_manifest_path(), encoding="utf-8") as f:
+                return json.load(f)
+
+        logger.warning(
+            f"No Solidity docs snapshot found in {snapshot_dir()}, scraping the documentation. "
+            "Run `flask --app flask_api_template refresh-solidity-docs` and ship the snapshot to avoid this."
+        )
+        try:
+            return refresh_snapshot()
+        except OSError as e:
+            _fallback_dir = os.path.join(tempfile.gettempdir(), "solidity-docs")
+            logger.warning(f"Cannot write the docs snapshot ({e}), writing it to {_fallback_dir}")
+            return refresh_snapshot()
+
+
+@lru_cache(maxsize=1)
+def load_manifest() -> Dict[str, Any]:
+    """
+    Read the snapshot manifest, scraping a new snapshot if there is none and
+    DOCS_SCRAPE_IF_MISSING is enabled.
+
+    Returns:
+        dict: The manifest describing the current snapshot
+    """
+    try:
+        with open(_manifest_path(), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        if not Config.DOCS_SCRAPE_IF_MISSING:
+            raise DocsSnapshotError(
+                f"No Solidity docs snapshot found in {snapshot_dir()}. "
+                "Run `flask --app flask_api_template refresh-solidity-docs` to create one."
+            )
+    return _scrape_missing_snapshot()
+
+
+@lru_cache(maxsize=1)
+def get_docs_content() -> str:
+    """
+    Load the Solidity documentation snapshot on first use and keep it in memory.
+
+    Returns:
+        str: The concatenated Solidity documentation
+    """
+    manifest = load_manifest()
+    path = os.path.join(snapshot_dir(), manifest["file"])
+
+    try:
+        with open(path, encoding="utf-8") as f:
+            content = f.read()
+    except FileNotFoundError:
+        raise DocsSnapshotError(f"Solidity docs snapshot file {path} is missing")
+
+    if hashlib.sha256(content.encode("utf-8")).hexdigest() != manifest["sha256"]:
+        raise DocsSnapshotError(f"Solidity docs snapshot {path} does not match its manifest hash")
+
+    return content
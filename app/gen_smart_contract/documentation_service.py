@@ -0,0 +1,165 @@
+import hashlib
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+from app.gen_smart_contract.common import documentation_gen_chain
+from app.gen_smart_contract.llm_cache import llm_cache
+from app.gen_smart_contract.preflight import check_prompt
+from app.gen_smart_contract.run_context import RunContext, current_run_context, run_context
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Number of finished documents kept in memory, on top of the LLM response cache
+MAX_FINISHED_DOCUMENTS = 256
+
+_executor = ThreadPoolExecutor(max_workers=Config.DOCUMENTATION_WORKERS, thread_name_prefix="documentation")
+_lock = threading.Lock()
+_pending: "dict[str, Future]" = {}
+_finished: "OrderedDict[str, str]" = OrderedDict()
+
+
+def contract_hash(contract: str) -> str:
+    return hashlib.sha256(contract.encode("utf-8")).hexdigest()
+
+
+# The status of every process's background documentation is shared through the LLM cache backend, so that any
+# process can answer a poll; with LLM_CACHE_BACKEND=memory or none it is only known to the process generating it
+
+def _publish(key: str, status: dict):
+    if llm_cache is not None:
+        llm_cache.set_shared(f"documentation:{key}", status)
+
+
+def _shared_status(key: str) -> Optional[dict]:
+    status = llm_cache.get_shared(f"documentation:{key}") if llm_cache is not None else None
+    if status is None or status["status"] == "failed":
+        return None
+    # The process generating it may have died
+    if status["status"] == "pending" and time.time() - status["started_at"] > Config.DOCUMENTATION_PENDING_SECONDS:
+        return None
+    return status
+
+
+def _generate(key: str, contract: str) -> str:
+    check_prompt("document", documentation_gen_chain, {"contract": contract})
+    documentation = documentation_gen_chain.invoke({"contract": contract}).documentation
+
+    _remember(key, documentation)
+    _publish(key, {"status": "finished", "documentation": documentation})
+    return documentation
+
+
+def _remember(key: str, documentation: str):
+    with _lock:
+        _pending.pop(key, None)
+        _finished[key] = documentation
+        _finished.move_to_end(key)
+        while len(_finished) > MAX_FINISHED_DOCUMENTS:
+            _finished.popitem(last=False)
+
+
+def _generate_in_background(key: str, contract: str, llm_clients) -> str:
+    # The worker thread has no run context, so the calls use the LLM clients of the run that asked for the document
+    with run_context(RunContext(llm_clients=llm_clients)):
+        return _generate(key, contract)
+
+
+def _on_failure(key: str, future: Future):
+    if future.exception() is not None:
+        logger.error(f"Error generating documentation for {key}: {future.exception()}")
+        with _lock:
+            _pending.pop(key, None)
+        _publish(key, {"status": "failed"})
+
+
+def schedule_documentation(contract: str) -> str:
+    """
+    Start generating the documentation of a contract in the background, unless it is
+    already finished or in progress.
+
+    Args:
+        contract (str): The Solidity source to document
+
+    Returns:
+        str: The contract hash the documentation can be fetched by
+    """
+    key = contract_hash(contract)
+
+    with _lock:
+        if key in _finished or key in _pending:
+            return key
+
+    # Finished, or in progress, in another process
+    if _shared_status(key) is not None:
+        return key
+
+    with _lock:
+        if key not in _finished and key not in _pending:
+            _publish(key, {"status": "pending", "started_at": time.time()})
+            future = _executor.submit(_generate_in_background, key, contract, current_run_context().llm_clients)
+            future.add_done_callback(lambda f: _on_failure(key, f))
+            _pending[key] = future
+
+    return key
+
+
+def get_documentation(contract: str) -> str:
+    """
+    Return the documentation of a contract, waiting for a background job that is
+    already generating it or generating it now otherwise. A run with the LLM cache
+    bypassed always generates it again.
+
+    Args:
+        contract (str): The Solidity source to document
+
+    Returns:
+        str: The documentation
+    """
+    key = contract_hash(contract)
+
+    if current_run_context().cache_bypass:
+        return _generate(key, contract)
+
+    with _lock:
+        if key in _finished:
+            return _finished[key]
+        future = _pending.get(key)
+
+    if future is not None:
+        return future.result()
+
+    status = _shared_status(key)
+    if status is not None and status["status"] == "finished":
+        _remember(key, status["documentation"])
+        return status["documentation"]
+
+    return _generate(key, contract)
+
+
+def documentation_status(key: str) -> Optional[dict]:
+    """
+    Look up background documentation by contract hash.
+
+    Args:
+        key (str): The contract hash
+
+    Returns:
+        dict: The status and, once finished, the documentation; None if unknown
+    """
+    with _lock:
+        if key in _finished:
+            return {"status": "finished", "documentation": _finished[key]}
+        if key in _pending:
+            return {"status": "pending"}
+
+    status = _shared_status(key)
+    if status is None:
+        return None
+    if status["status"] == "finished":
+        return {"status": "finished", "documentation": status["documentation"]}
+    return {"status": "pending"}
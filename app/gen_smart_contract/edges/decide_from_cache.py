@@ -0,0 +1,30 @@
+from langgraph.graph import END
+
+from app.gen_smart_contract.semantic_cache import HIT
+from app.gen_smart_contract.state import GraphState
+
+
+def decide_from_cache(state: GraphState):
+    """
+    Determines where a run continues after the cache lookup.
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        str: Next node to call
+    """
+    status = state.get("cache_status")
+
+    if status == HIT:
+        print("---DECISION: ANSWER FROM CACHE---")
+        if state.get("documentation_mode") == "deferred":
+            return "defer_document"
+        # Cached without documentation when it was generated in deferred mode
+        if not state.get("documentation"):
+            return "document"
+        return END
+    else:
+        # A warm start is classified like a miss, then generation adapts the cached contract
+        print("---DECISION: CLASSIFY---")
+        return "classify"
@@ -14,9 +14,12 @@ def decide_to_finish_update(state: GraphState):
         str: Next node to call
     """
     error = state["error"]
+    stop_reason = (state.get("retry_budget") or {}).get("stop_reason")
 
-    if error == "no":
+    if error == "no" or stop_reason:
         print("---DECISION: FINISH---")
+        if state.get("documentation_mode") == "deferred":
+            return "defer_document"
         return "document"
     else:
         print("---DECISION: RE-TRY SOLUTION---")
@@ -0,0 +1,80 @@
+import importlib
+import logging
+from typing import List
+
+import numpy as np
+
+from app.gen_smart_contract.local_classifier import hashed_features
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class Embedder:
+    """
+    Turns texts into L2-normalized vectors whose dot product measures how similar
+    the texts are. `name` identifies the vector space, so that vectors stored by
+    one embedder are never compared with those of another.
+    """
+
+    name: str = ""
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        raise NotImplementedError
+
+
+def normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    return (vectors / np.where(norms == 0, 1, norms)).astype(np.float32)
+
+
+class HashingEmbedder(Embedder):
+    """
+    A deterministic local embedder folding the hashed word and character n-grams
+    of the local classifier into `dimension` signed buckets. It needs no model or
+    network, and the same text always gets the same vector.
+    """
+
+    def __init__(self, dimension: int = 1024):
+        self.dimension = dimension
+        self.name = f"hashing-{dimension}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dimension), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for bucket, weight in hashed_features(text).items():
+                # The bucket's high bit signs it, so that colliding features tend to cancel out
+                sign = -1.0 if bucket & 1 << 17 else 1.0
+                vectors[row, bucket % self.dimension] += sign * weight
+        return normalize(vectors)
+
+
+class OpenAIEmbedder(Embedder):
+    """
+    Embeds texts with the OpenAI embeddings API.
+    """
+
+    def __init__(self, model: str):
+        from langchain_openai import OpenAIEmbeddings
+
+        self.embeddings = OpenAIEmbeddings(model=model)
+        self.name = f"openai-{model}"
+
+    def embed(self, texts: List[str]) -> np.ndarray:
+        return normalize(np.array(self.embeddings.embed_documents(texts), dtype=np.float32))
+
+
+def build_embedder(spec: str) -> Embedder:
+    """
+    Build the embedder named by `spec`: "hashing", "openai", or the import path of
+    a factory returning an Embedder, such as "my_package.embedders:build".
+    """
+    if spec == "hashing":
+        return HashingEmbedder(Config.SEMANTIC_CACHE_DIMENSION)
+    if spec == "openai":
+        return OpenAIEmbedder(Config.SEMANTIC_CACHE_OPENAI_MODEL)
+
+    module_name, _, factory_name = spec.partition(":")
+    if not factory_name:
+        raise ValueError(f"Unknown embedder {spec!r}, expected hashing, openai or module:factory")
+    return getattr(importlib.import_module(module_name), factory_name)()
@@ -0,0 +1,185 @@
+import functools
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+from langgraph.utils import RunnableCallable
+
+from app.gen_smart_contract.metrics import metrics
+from app.gen_smart_contract.run_context import current_run_context
+from config import Config
+
+# Nodes whose repeated runs are retries of a contract that did not compile
+RETRY_NODES = ("generate", "reflect")
+
+
+def estimate_cost(model: str, prompt_tokens: int, completion_tokens: int, cached_tokens: int = 0) -> float:
+    """
+    Estimate the USD cost of a call from the per-million-token prices in LLM_PRICES,
+    0 for models without a price. Prompt tokens served from the provider's prompt
+    cache are billed at the "cached_input" price when the model has one.
+    """
+    prices = Config.LLM_PRICES.get(model)
+    if not prices:
+        return 0.0
+    cached_price = prices.get("cached_input", prices["input"])
+    return ((prompt_tokens - cached_tokens) * prices["input"] + cached_tokens * cached_price
+            + completion_tokens * prices["output"]) / 1_000_000
+
+
+def cached_prompt_tokens(message: Any) -> int:
+    """
+    The prompt tokens of a response that the provider read from its prompt cache,
+    0 when the response does not report them.
+    """
+    usage = getattr(message, "usage_metadata", None) or {}
+    details = usage.get("input_token_details") or {}
+    if "cache_read" in details:
+        return details["cache_read"] or 0
+
+    token_usage = (getattr(message, "response_metadata", None) or {}).get("token_usage") or {}
+    return (token_usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+
+
+def _totals() -> Dict[str, Any]:
+    return {"calls": 0, "cache_hits": 0, "seconds": 0.0, "prompt_tokens": 0, "cached_prompt_tokens": 0,
+            "completion_tokens": 0, "cost_usd": 0.0}
+
+
+class RunStats:
+    """
+    Collects where the time, tokens and money of one workflow run go: every chain
+    invocation and every node execution, including those of the threads the run
+    starts, which share the run context and so this object.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._lock = threading.Lock()
+        self._chains: Dict[str, Dict[str, Any]] = {}
+        self._nodes: Dict[str, Dict[str, Any]] = {}
+
+    def record_llm(self, chain: str, seconds: float, prompt_tokens: int = 0, completion_tokens: int = 0,
+                   cost: float = 0.0, cache_hit: bool = False, cached_prompt_tokens: int = 0):
+        with self._lock:
+            totals = self._chains.setdefault(chain, _totals())
+            totals["calls"] += 1
+            totals["cache_hits"] += int(cache_hit)
+            totals["seconds"] += seconds
+            totals["prompt_tokens"] += prompt_tokens
+            totals["cached_prompt_tokens"] += cached_prompt_tokens
+            totals["completion_tokens"] += completion_tokens
+            totals["cost_usd"] += cost
+
+    def record_node(self, node: str, seconds: float):
+        with self._lock:
+            totals = self._nodes.setdefault(node, {"calls": 0, "seconds": 0.0})
+            totals["calls"] += 1
+            totals["seconds"] += seconds
+
+    def summary(self) -> Dict[str, Any]:
+        """
+        Returns:
+            dict: The wall time, the totals of all LLM calls, the per-chain and per-node
+                breakdowns and the number of retry rounds
+        """
+        with self._lock:
+            chains = {name: _rounded(totals) for name, totals in self._chains.items()}
+            nodes = {name: _rounded(totals) for name, totals in self._nodes.items()}
+
+        llm = _totals()
+        for totals in chains.values():
+            for key in llm:
+                llm[key] += totals[key]
+
+        return {
+            "wall_seconds": round(time.perf_counter() - self.started, 3),
+            "llm": _rounded(llm),
+            "chains": chains,
+            "nodes": nodes,
+            "retries": max(sum(nodes.get(node, {}).get("calls", 0) for node in RETRY_NODES) - 1, 0),
+        }
+
+
+def _rounded(totals: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        key: round(value, 6 if key == "cost_usd" else 3) if isinstance(value, float) else value
+        for key, value in totals.items()
+    }
+
+
+def record_llm_call(chain: str, model: str, seconds: float, prompt_tokens: int, completion_tokens: int,
+                    cached_tokens: int = 0):
+    """
+    Record an LLM call in the process metrics and the stats of the current run.
+    """
+    cost = estimate_cost(model, prompt_tokens, completion_tokens, cached_tokens)
+
+    metrics.incr("llm_calls", chain=chain, model=model)
+    metrics.observe("llm_seconds", seconds, chain=chain, model=model)
+    metrics.incr("llm_prompt_tokens", prompt_tokens, chain=chain)
+    metrics.incr("llm_cached_prompt_tokens", cached_tokens, chain=chain)
+    metrics.incr("llm_completion_tokens", completion_tokens, chain=chain)
+    metrics.incr("llm_cost_usd", cost, chain=chain)
+
+    stats = current_run_context().stats
+    if stats is not None:
+        stats.record_llm(chain, seconds, prompt_tokens, completion_tokens, cost, cached_prompt_tokens=cached_tokens)
+
+
+def record_cache_hit(chain: str, seconds: float):
+    stats = current_run_context().stats
+    if stats is not None:
+        stats.record_llm(chain, seconds, cache_hit=True)
+
+
+def record_node(node: str, seconds: float):
+    metrics.observe("node_seconds", seconds, node=node)
+
+    stats = current_run_context().stats
+    if stats is not None:
+        stats.record_node(node, seconds)
+
+
+def finish_run(stats: Optional[RunStats]) -> Optional[Dict[str, Any]]:
+    """
+    Summarize a finished run and add its totals to the process metrics.
+
+    Returns:
+        dict: The summary streamed to the client as the run_summary event
+    """
+    if stats is None:
+        return None
+
+    summary = stats.summary()
+    metrics.observe("run_seconds", summary["wall_seconds"])
+    metrics.incr("run_retries", summary["retries"])
+    metrics.incr("run_cost_usd", summary["llm"]["cost_usd"])
+    return summary
+
+
+def timed_node(name: str, func: Callable, afunc: Optional[Callable] = None) -> RunnableCallable:
+    """
+    Wrap a node, and its asyncio implementation if it has one, so that each
+    execution records its wall time.
+    """
+
+    @functools.wraps(func)
+    def run(state):
+        started = time.perf_counter()
+        try:
+            return func(state)
+        finally:
+            record_node(name, time.perf_counter() - started)
+
+    arun = None
+    if afunc is not None:
+        @functools.wraps(afunc)
+        async def arun(state):
+            started = time.perf_counter()
+            try:
+                return await afunc(state)
+            finally:
+                record_node(name, time.perf_counter() - started)
+
+    return RunnableCallable(run, arun, name=name)
@@ -0,0 +1,563 @@
+import json
+import logging
+import os
+import queue
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional
+
+from app.gen_smart_contract.checkpointer import checkpointer, run_config
+from app.gen_smart_contract.instrumentation import RunStats, finish_run
+from app.gen_smart_contract.run_context import RunContext, run_context
+from app.gen_smart_contract.user_clients import user_llm_clients
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+FINISHED = (SUCCEEDED, FAILED)
+
+
+class JobNotFound(Exception):
+    """Raised when a job ID is unknown or its job has expired."""
+
+
+class JobFollowTimeout(Exception):
+    """Raised when a followed job has not finished within the stream timeout."""
+
+
+class MemoryJobStore:
+    """
+    Jobs and their event logs in process memory, for local runs. Jobs are lost
+    when the process exits.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._events: Dict[str, List[str]] = {}
+        self._queue: "queue.Queue[str]" = queue.Queue()
+
+    def create(self, job: Dict[str, Any]):
+        with self._lock:
+            self._expire()
+            self._jobs[job["id"]] = dict(job, error=None)
+            self._events[job["id"]] = []
+        self._queue.put(job["id"])
+
+    def claim(self, timeout: float) -> Optional[Dict[str, Any]]:
+        try:
+            job_id = self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != QUEUED:
+                return None
+            job.update(status=RUNNING, updated_at=time.time())
+            return dict(job)
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None) -> bool:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job["status"] != RUNNING:
+                return False
+            job.update(status=status, error=error, updated_at=time.time())
+            return True
+
+    def touch(self, job_id: str):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job["status"] == RUNNING:
+                job["updated_at"] = time.time()
+
+    def fail_expired(self, cutoff: float, error: str, event: str) -> List[str]:
+        with self._lock:
+            expired = [k for k, job in self._jobs.items() if job["status"] == RUNNING and job["updated_at"] < cutoff]
+            for job_id in expired:
+                self._events[job_id].append(event)
+                self._jobs[job_id].update(status=FAILED, error=error, updated_at=time.time())
+        return expired
+
+    def append(self, job_id: str, event: str):
+        with self._lock:
+            self._events[job_id].append(event)
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job, event_count=len(self._events[job_id])) if job is not None else None
+
+    def events(self, job_id: str, offset: int) -> List[str]:
+        with self._lock:
+            return self._events.get(job_id, [])[offset:]
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        for job_id in [k for k, job in self._jobs.items() if job["status"] in FINISHED and job["updated_at"] < cutoff]:
+            del self._jobs[job_id]
+            del self._events[job_id]
+
+
+class SQLiteJobStore:
+    """
+    Jobs and their event logs in a local SQLite file, so that queued jobs and
+    finished logs survive a restart and are shared by the processes of one host.
+    """
+
+    def __init__(self, path: str, ttl: float):
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None, timeout=30)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS jobs ("
+            "id TEXT PRIMARY KEY, kind TEXT NOT NULL, status TEXT NOT NULL, payload TEXT NOT NULL, "
+            "error TEXT, created_at REAL NOT NULL, updated_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS jobs_status ON jobs (status, created_at)")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS job_events ("
+            "job_id TEXT NOT NULL, position INTEGER NOT NULL, event TEXT NOT NULL, PRIMARY KEY (job_id, position))"
+        )
+
+    def create(self, job: Dict[str, Any]):
+        with self._lock:
+            self._expire()
+            self._connection.execute(
+                "INSERT INTO jobs (id, kind, status, payload, error, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (job["id"], job["kind"], job["status"], json.dumps(job["payload"]), None,
+                 job["created_at"], job["updated_at"]),
+            )
+
+    def claim(self, timeout: float) -> Optional[Dict[str, Any]]:
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._lock:
+                row = self._connection.execute(
+                    "UPDATE jobs SET status = ?, updated_at = ? WHERE id = "
+                    "(SELECT id FROM jobs WHERE status = ? ORDER BY created_at LIMIT 1) "
+                    "RETURNING id, kind, status, payload, error, created_at, updated_at",
+                    (RUNNING, time.time(), QUEUED),
+                ).fetchone()
+            if row is not None:
+                return self._job(row)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(min(Config.JOB_POLL_INTERVAL_SECONDS, max(deadline - time.monotonic(), 0)))
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None) -> bool:
+        with self._lock:
+            cursor = self._connection.execute(
+                "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE id = ? AND status = ?",
+                (status, error, time.time(), job_id, RUNNING),
+            )
+        return cursor.rowcount > 0
+
+    def touch(self, job_id: str):
+        with self._lock:
+            self._connection.execute(
+                "UPDATE jobs SET updated_at = ? WHERE id = ? AND status = ?", (time.time(), job_id, RUNNING)
+            )
+
+    def fail_expired(self, cutoff: float, error: str, event: str) -> List[str]:
+        with self._lock:
+            # One transaction, so that a job is failed by one process only and its log ends with the error
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                rows = self._connection.execute(
+                    "UPDATE jobs SET status = ?, error = ?, updated_at = ? WHERE status = ? AND updated_at < ? "
+                    "RETURNING id",
+                    (FAILED, error, time.time(), RUNNING, cutoff),
+                ).fetchall()
+                for (job_id,) in rows:
+                    self._connection.execute(
+                        "INSERT INTO job_events (job_id, position, event) VALUES "
+                        "(?, (SELECT COUNT(*) FROM job_events WHERE job_id = ?), ?)",
+                        (job_id, job_id, event),
+                    )
+                self._connection.execute("COMMIT")
+            except Exception:
+                self._connection.execute("ROLLBACK")
+                raise
+        return [row[0] for row in rows]
+
+    def append(self, job_id: str, event: str):
+        with self._lock:
+            self._connection.execute(
+                "INSERT INTO job_events (job_id, position, event) VALUES "
+                "(?, (SELECT COUNT(*) FROM job_events WHERE job_id = ?), ?)",
+                (job_id, job_id, event),
+            )
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT id, kind, status, payload, error, created_at, updated_at FROM jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+            if row is None:
+                return None
+            count = self._connection.execute(
+                "SELECT COUNT(*) FROM job_events WHERE job_id = ?", (job_id,)
+            ).fetchone()[0]
+        return dict(self._job(row), event_count=count)
+
+    def events(self, job_id: str, offset: int) -> List[str]:
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT event FROM job_events WHERE job_id = ? AND position >= ? ORDER BY position", (job_id, offset)
+            ).fetchall()
+        return [row[0] for row in rows]
+
+    @staticmethod
+    def _job(row) -> Dict[str, Any]:
+        keys = ("id", "kind", "status", "payload", "error", "created_at", "updated_at")
+        job = dict(zip(keys, row))
+        job["payload"] = json.loads(job["payload"])
+        return job
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        self._connection.execute(
+            "DELETE FROM job_events WHERE job_id IN (SELECT id FROM jobs WHERE status IN (?, ?) AND updated_at < ?)",
+            (*FINISHED, cutoff),
+        )
+        self._connection.execute("DELETE FROM jobs WHERE status IN (?, ?) AND updated_at < ?", (*FINISHED, cutoff))
+
+
+class RedisJobStore:
+    """
+    Jobs and their event logs in Redis, shared by every web and worker process.
+    Job keys expire `ttl` seconds after their last update.
+
+    A claimed job is moved from the queue to the processing list of this store
+    until it is marked as running, so that a job claimed by a process that dies
+    before then is requeued rather than lost. Each store records when it last
+    claimed, and the processing lists of stores silent for longer than the lease
+    are requeued by fail_expired.
+    """
+
+    def __init__(self, url: str, ttl: float, prefix: str = "jobs:"):
+        import redis
+
+        self.ttl = int(ttl)
+        self.prefix = prefix
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._client = redis.Redis.from_url(url, decode_responses=True)
+
+    def _key(self, job_id: str, suffix: str = "") -> str:
+        return f"{self.prefix}{job_id}{suffix}"
+
+    def create(self, job: Dict[str, Any]):
+        pipeline = self._client.pipeline()
+        pipeline.hset(self._key(job["id"]), mapping={**job, "payload": json.dumps(job["payload"]), "error": ""})
+        pipeline.expire(self._key(job["id"]), self.ttl)
+        pipeline.lpush(f"{self.prefix}queue", job["id"])
+        pipeline.execute()
+
+    def claim(self, timeout: float) -> Optional[Dict[str, Any]]:
+        processing = f"{self.prefix}processing:{self.worker_id}"
+        self._client.zadd(f"{self.prefix}workers", {self.worker_id: time.time()})
+        job_id = self._client.blmove(f"{self.prefix}queue", processing, max(int(timeout), 1), "RIGHT", "LEFT")
+        if job_id is None:
+            return None
+        if not self._client.exists(self._key(job_id)):
+            self._client.lrem(processing, 1, job_id)
+            return None
+
+        now = time.time()
+        pipeline = self._client.pipeline()
+        pipeline.hset(self._key(job_id), mapping={"status": RUNNING, "updated_at": now})
+        pipeline.expire(self._key(job_id), self.ttl)
+        # Running jobs are kept in a sorted set by their last update, to find the abandoned ones
+        pipeline.zadd(f"{self.prefix}running", {job_id: now})
+        pipeline.lrem(processing, 1, job_id)
+        pipeline.execute()
+        return self.get(job_id)
+
+    def finish(self, job_id: str, status: str, error: Optional[str] = None) -> bool:
+        # Only the process that removes the job from the running set finishes it
+        if not self._client.zrem(f"{self.prefix}running", job_id):
+            return False
+        pipeline = self._client.pipeline()
+        pipeline.hset(self._key(job_id), mapping={"status": status, "error": error or "", "updated_at": time.time()})
+        pipeline.expire(self._key(job_id), self.ttl)
+        pipeline.execute()
+        return True
+
+    def touch(self, job_id: str):
+        now = time.time()
+        if self._client.zadd(f"{self.prefix}running", {job_id: now}, xx=True, ch=True):
+            self._client.hset(self._key(job_id), "updated_at", now)
+
+    def fail_expired(self, cutoff: float, error: str, event: str) -> List[str]:
+        # Requeue the jobs claimed by stores that stopped before marking them as running
+        for worker_id in self._client.zrangebyscore(f"{self.prefix}workers", "-inf", f"({cutoff}"):
+            processing = f"{self.prefix}processing:{worker_id}"
+            while self._client.lmove(processing, f"{self.prefix}queue", "LEFT", "RIGHT") is not None:
+                pass
+            self._client.zrem(f"{self.prefix}workers", worker_id)
+
+        expired = []
+        for job_id in self._client.zrangebyscore(f"{self.prefix}running", "-inf", f"({cutoff}"):
+            # Only the process that removes the job from the set fails it
+            if not self._client.zrem(f"{self.prefix}running", job_id):
+                continue
+            pipeline = self._client.pipeline()
+            pipeline.rpush(self._key(job_id, ":events"), event)
+            pipeline.expire(self._key(job_id, ":events"), self.ttl)
+            pipeline.hset(self._key(job_id), mapping={"status": FAILED, "error": error, "updated_at": time.time()})
+            pipeline.expire(self._key(job_id), self.ttl)
+            pipeline.execute()
+            expired.append(job_id)
+        return expired
+
+    def append(self, job_id: str, event: str):
+        pipeline = self._client.pipeline()
+        pipeline.rpush(self._key(job_id, ":events"), event)
+        pipeline.expire(self._key(job_id, ":events"), self.ttl)
+        pipeline.execute()
+
+    def get(self, job_id: str) -> Optional[Dict[str, Any]]:
+        job = self._client.hgetall(self._key(job_id))
+        if not job:
+            return None
+        job["payload"] = json.loads(job["payload"])
+        job["error"] = job["error"] or None
+        job["created_at"] = float(job["created_at"])
+        job["updated_at"] = float(job["updated_at"])
+        job["event_count"] = self._client.llen(self._key(job_id, ":events"))
+        return job
+
+    def events(self, job_id: str, offset: int) -> List[str]:
+        return self._client.lrange(self._key(job_id, ":events"), offset, -1)
+
+
+def build_job_store():
+    """
+    Build the store configured by JOB_BACKEND: "memory", "sqlite" or "redis".
+    """
+    if Config.JOB_BACKEND == "redis":
+        return RedisJobStore(Config.REDIS_URL, Config.JOB_TTL_SECONDS)
+    if Config.JOB_BACKEND == "sqlite":
+        return SQLiteJobStore(Config.JOB_SQLITE_PATH, Config.JOB_TTL_SECONDS)
+    return MemoryJobStore(Config.JOB_TTL_SECONDS)
+
+
+def serialize_event(key: str, value: Any) -> str:
+    # Convert the Pydantic model instance to a dictionary before serialization
+    if hasattr(value, "dict"):
+        value = value.dict()
+    return json.dumps({key: value})
+
+
+class JobQueue:
+    """
+    Runs generation workflows as background jobs.
+
+    A job's node events are appended to its log as they happen, so that clients
+    can poll the job or resume its stream from any offset after a disconnect
+    without paying for the LLM calls again. Jobs are executed by worker threads,
+    started in the web process on first use or in a separate `flask job-worker`
+    process.
+    """
+
+    def __init__(self, store, graphs: Dict[str, Any]):
+        self.store = store
+        self.graphs = graphs
+        self._workers: List[threading.Thread] = []
+        self._workers_lock = threading.Lock()
+
+    def submit(self, kind: str, inputs: Dict[str, Any], context: RunContext) -> Dict[str, Any]:
+        """
+        Queue a workflow run.
+
+        Args:
+            kind (str): The workflow to run, "generate" or "update"
+            inputs (dict): The initial graph state
+            context (RunContext): The per-run options
+
+        Returns:
+            dict: The queued job
+        """
+        now = time.time()
+        job = {
+            "id": uuid.uuid4().hex,
+            "kind": kind,
+            "status": QUEUED,
+            "payload": {
+                "inputs": inputs,
+                "cache_bypass": context.cache_bypass,
+                # The worker calls the models with the user's key, stored encrypted like in the users table
+                "llm_key": context.llm_clients.sealed() if context.llm_clients is not None else None,
+            },
+            "created_at": now,
+            "updated_at": now,
+        }
+        self.store.create(job)
+        self.start_workers(Config.JOB_WORKERS)
+        return self.get(job["id"])
+
+    def get(self, job_id: str) -> Dict[str, Any]:
+        job = self.store.get(job_id)
+        if job is None:
+            raise JobNotFound(f"Job {job_id} not found")
+        job.pop("payload", None)
+        return job
+
+    def events(self, job_id: str, offset: int = 0) -> List[str]:
+        """
+        Args:
+            job_id (str): The job ID
+            offset (int): The number of events the client already has
+
+        Returns:
+            list: The serialized node events from the offset on
+        """
+        return self.store.events(job_id, offset)
+
+    def follow(self, job_id: str, offset: int = 0, timeout: Optional[float] = None):
+        """
+        Yield the serialized events of a job from the offset on, waiting for new
+        ones until the job has finished.
+
+        Raises:
+            JobFollowTimeout: If the job has not finished after `timeout` seconds,
+                JOB_STREAM_TIMEOUT_SECONDS by default
+        """
+        deadline = time.monotonic() + (timeout if timeout is not None else Config.JOB_STREAM_TIMEOUT_SECONDS)
+        while True:
+            job = self.get(job_id)
+            events = self.store.events(job_id, offset)
+            yield from events
+            offset += len(events)
+            if job["status"] in FINISHED and offset >= job["event_count"]:
+                return
+            if time.monotonic() >= deadline:
+                raise JobFollowTimeout(f"Job {job_id} is still {job['status']}, reconnect with offset={offset}")
+            time.sleep(Config.JOB_POLL_INTERVAL_SECONDS)
+
+    def start_workers(self, count: int):
+        with self._workers_lock:
+            while len(self._workers) < count:
+                worker = threading.Thread(target=self.work, name=f"job-worker-{len(self._workers)}", daemon=True)
+                worker.start()
+                self._workers.append(worker)
+
+    def serve(self, count: int):
+        """
+        Run `count` workers in the foreground, for a dedicated worker process.
+        """
+        self.start_workers(count)
+        for worker in self._workers:
+            worker.join()
+
+    def work(self):
+        """
+        Run queued jobs until the process exits.
+        """
+        while True:
+            try:
+                self.fail_abandoned()
+                job = self.store.claim(timeout=5)
+                if job is not None:
+                    self.run(job)
+            except Exception as e:
+                logger.error(f"Job worker error: {e}")
+                time.sleep(1)
+
+    def fail_abandoned(self):
+        """
+        Fail the running jobs whose worker stopped renewing their lease for
+        JOB_LEASE_SECONDS, such as after a crash. Their checkpoints are kept, so
+        that their runs can be resumed.
+        """
+        error = "The worker running the job stopped"
+        event = json.dumps({"error": f"Error generating smart contract: {error}"})
+        for job_id in self.store.fail_expired(time.time() - Config.JOB_LEASE_SECONDS, error, event):
+            logger.warning(f"Job {job_id} failed, its worker stopped renewing its lease")
+
+    @contextmanager
+    def _lease(self, job_id: str) -> Iterator[None]:
+        """
+        Renew the lease of a job every quarter of JOB_LEASE_SECONDS while it runs,
+        including during long LLM calls and compilations.
+        """
+        stop = threading.Event()
+
+        def renew():
+            while not stop.wait(Config.JOB_LEASE_SECONDS / 4):
+                try:
+                    self.store.touch(job_id)
+                except Exception as e:
+                    logger.warning(f"Could not renew the lease of job {job_id}: {e}")
+
+        heartbeat = threading.Thread(target=renew, name=f"job-lease-{job_id}", daemon=True)
+        heartbeat.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            heartbeat.join()
+
+    def run(self, job: Dict[str, Any]):
+        logger.info(f"Running {job['kind']} job {job['id']}")
+        payload = job["payload"]
+        stats = RunStats()
+
+        try:
+            llm_clients = user_llm_clients.unseal(payload.get("llm_key"))
+            with self._lease(job["id"]), run_context(
+                RunContext(cache_bypass=payload["cache_bypass"], stats=stats, llm_clients=llm_clients)
+            ):
+                # The retry deadline counts from when the job starts, not from when it was queued
+                inputs = dict(payload["inputs"], started_at=time.time())
+                for output in self.graphs[job["kind"]].stream(inputs, run_config(job["id"])):
+                    for key, value in output.items():
+                        self.store.append(job["id"], serialize_event(key, value))
+        except Exception as e:
+            logger.error(f"Job {job['id']} failed: {e}")
+            self.store.append(job["id"], json.dumps({"error": f"Error generating smart contract: {e}"}))
+            self.store.append(job["id"], serialize_event("run_summary", finish_run(stats)))
+            if not self.store.finish(job["id"], FAILED, error=str(e)):
+                logger.warning(f"Job {job['id']} was already failed as abandoned")
+            return
+
+        self.store.append(job["id"], serialize_event("run_summary", finish_run(stats)))
+        # A job failed as abandoned while it ran stays failed, as its clients were already told so
+        if not self.store.finish(job["id"], SUCCEEDED):
+            logger.warning(f"Job {job['id']} finished after it was failed as abandoned")
+            return
+        if checkpointer is not None:
+            checkpointer.delete_thread(job["id"])
+
+
+_job_queue: Optional[JobQueue] = None
+_job_queue_lock = threading.Lock()
+
+
+def get_job_queue() -> JobQueue:
+    """
+    The job queue of this process, created on first use so that importing the
+    module does not open the job store.
+    """
+    global _job_queue
+
+    if _job_queue is None:
+        with _job_queue_lock:
+            if _job_queue is None:
+                from app.gen_smart_contract.update_workflow import update_smart_contract_workflow
+                from app.gen_smart_contract.workflow import smart_contract_generator
+
+                graphs = {"generate": smart_contract_generator, "update": update_smart_contract_workflow}
+                _job_queue = JobQueue(build_job_store(), graphs)
+
+    return _job_queue
@@ -0,0 +1,198 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryCache:
+    """
+    An in-process LRU cache with a TTL.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: str):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+class SQLiteCache:
+    """
+    A persistent cache in a local SQLite file, evicting least recently used rows
+    once it holds more than `max_entries`.
+    """
+
+    def __init__(self, path: str, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS llm_cache ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, expires_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS llm_cache_accessed_at ON llm_cache (accessed_at)")
+
+    def get(self, key: str) -> Optional[str]:
+        now = time.time()
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT value, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if row[1] < now:
+                self._connection.execute("DELETE FROM llm_cache WHERE key = ?", (key,))
+                return None
+            self._connection.execute("UPDATE llm_cache SET accessed_at = ? WHERE key = ?", (now, key))
+            return row[0]
+
+    def set(self, key: str, value: str):
+        now = time.time()
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, value, now + self.ttl, now),
+            )
+            count = self._connection.execute("SELECT COUNT(*) FROM llm_cache").fetchone()[0]
+            if count > self.max_entries:
+                self._connection.execute("DELETE FROM llm_cache WHERE expires_at < ?", (now,))
+                self._connection.execute(
+                    "DELETE FROM llm_cache WHERE key IN "
+                    "(SELECT key FROM llm_cache ORDER BY accessed_at LIMIT ?)",
+                    (max(count - self.max_entries, 0),),
+                )
+
+
+class RedisCache:
+    """
+    A cache shared between processes in Redis. Entries expire after the TTL and
+    eviction is left to the server's maxmemory policy.
+    """
+
+    def __init__(self, url: str, ttl: float, prefix: str = "llm-cache:"):
+        import redis
+
+        self.ttl = ttl
+        self.prefix = prefix
+        self._client = redis.Redis.from_url(url)
+
+    def get(self, key: str) -> Optional[str]:
+        value = self._client.get(self.prefix + key)
+        return value.decode("utf-8") if value is not None else None
+
+    def set(self, key: str, value: str):
+        self._client.set(self.prefix + key, value, ex=int(self.ttl))
+
+
+class LLMCache:
+    """
+    An in-process LRU in front of an optional persistent backend. Failures of the
+    persistent backend are logged and treated as misses, so a cache outage never
+    fails a request.
+    """
+
+    def __init__(self, memory: MemoryCache, backend=None):
+        self.memory = memory
+        self.backend = backend
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        value = self.memory.get(key)
+
+        if value is None and self.backend is not None:
+            try:
+                value = self.backend.get(key)
+            except Exception as e:
+                logger.warning(f"LLM cache backend read failed: {e}")
+            if value is not None:
+                self.memory.set(key, value)
+
+        return json.loads(value) if value is not None else None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        value = json.dumps(value)
+        self.memory.set(key, value)
+
+        if self.backend is not None:
+            try:
+                self.backend.set(key, value)
+            except Exception as e:
+                logger.warning(f"LLM cache backend write failed: {e}")
+
+    def get_shared(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        Read an entry other processes may change, e.g. the status of background
+        documentation, from the persistent backend only (memory without one), so that
+        a stale copy in this process's LRU is never served.
+        """
+        try:
+            value = (self.backend or self.memory).get(key)
+        except Exception as e:
+            logger.warning(f"LLM cache backend read failed: {e}")
+            return None
+        return json.loads(value) if value is not None else None
+
+    def set_shared(self, key: str, value: Dict[str, Any]):
+        try:
+            (self.backend or self.memory).set(key, json.dumps(value))
+        except Exception as e:
+            logger.warning(f"LLM cache backend write failed: {e}")
+
+
+def build_llm_cache() -> Optional[LLMCache]:
+    """
+    Build the cache configured by LLM_CACHE_BACKEND: "memory", "sqlite", "redis" or "none".
+
+    Returns:
+        LLMCache: The cache, or None if caching is disabled
+    """
+    backend_name = Config.LLM_CACHE_BACKEND
+    ttl = Config.LLM_CACHE_TTL_SECONDS
+
+    if backend_name == "none":
+        return None
+
+    memory = MemoryCache(Config.LLM_CACHE_MEMORY_ENTRIES, ttl)
+
+    backend = None
+    try:
+        if backend_name == "sqlite":
+            backend = SQLiteCache(Config.LLM_CACHE_SQLITE_PATH, Config.LLM_CACHE_MAX_ENTRIES, ttl)
+        elif backend_name == "redis":
+            backend = RedisCache(Config.REDIS_URL, ttl)
+    except Exception as e:
+        logger.warning(f"LLM cache backend {backend_name} unavailable, using memory only: {e}")
+
+    return LLMCache(memory, backend)
+
+
+llm_cache = build_llm_cache()
@@ -0,0 +1,148 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator, Optional
+
+from langchain_core.messages import BaseMessage
+from langchain_openai import ChatOpenAI
+from openai.resources.chat import AsyncCompletions
+
+from config import Config
+
+
+def model_settings(chain: str) -> Dict[str, Any]:
+    """
+    The model settings of a chain: its LLM_MODELS entry over the "default" one.
+
+    Args:
+        chain (str): The chain name, such as "classify" or "code_gen"
+
+    Returns:
+        dict: The model, and optionally max_tokens, timeout, deadline, retries, hedge, fallback and base_url
+    """
+    return {**Config.LLM_MODELS.get("default", {}), **Config.LLM_MODELS.get(chain, {})}
+
+
+def chat_model(settings: Dict[str, Any], temperature: float = 0.0, model: Optional[str] = None) -> ChatOpenAI:
+    """
+    Build the chat model for a chain's settings.
+
+    Args:
+        settings (dict): The chain's model settings
+        temperature (float): The sampling temperature
+        model (str, optional): Another model to use with the same settings, such as the fallback
+
+    Returns:
+        ChatOpenAI: The chat model
+    """
+    llm = ChatOpenAI(
+        model=model or settings["model"],
+        temperature=temperature,
+        max_tokens=settings.get("max_tokens"),
+        timeout=settings.get("timeout"),
+        base_url=settings.get("base_url") or Config.LLM_BASE_URL,
+        # Retries are made by the chain's LLMCallPolicy
+        max_retries=0,
+        # Streamed responses, such as those of token streams and cancellable calls, report their token usage too
+        stream_usage=True,
+    )
+    llm.client = recording_usage(llm.client)
+    llm.async_client = recording_usage(llm.async_client)
+    return llm
+
+
+# The usage of the streamed responses of the current call, filled by the recording clients
+_stream_usage: ContextVar[Optional[Dict[str, Any]]] = ContextVar("stream_usage", default=None)
+
+
+@contextmanager
+def recorded_stream_usage() -> Iterator[Dict[str, Any]]:
+    """
+    Collect the usage the API reports at the end of the responses streamed inside
+    the block, including the prompt token details such as the cached tokens.
+    langchain-openai keeps only the token counts of a streamed usage chunk.
+    """
+    usage: Dict[str, Any] = {}
+    token = _stream_usage.set(usage)
+    try:
+        yield usage
+    finally:
+        _stream_usage.reset(token)
+
+
+def with_stream_usage(response: Any, usage: Dict[str, Any]) -> Any:
+    """
+    Put the recorded usage of a streamed response into the response_metadata of its
+    message, the raw one of a structured output, where it is when not streamed.
+    """
+    message = response.get("raw") if isinstance(response, dict) else response
+    if usage and isinstance(message, BaseMessage):
+        message.response_metadata.setdefault("token_usage", usage)
+    return response
+
+
+class _RecordingStream:
+    """
+    A streamed chat completion that records its usage chunk.
+    """
+
+    def __init__(self, stream, usage: Dict[str, Any]):
+        self._stream = stream
+        self._usage = usage
+
+    def _record(self, chunk):
+        if getattr(chunk, "usage", None) is not None:
+            self._usage.update(chunk.usage.model_dump(exclude_none=True))
+
+    def __iter__(self):
+        for chunk in self._stream:
+            self._record(chunk)
+            yield chunk
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            self._record(chunk)
+            yield chunk
+
+    def __enter__(self):
+        self._stream.__enter__()
+        return self
+
+    def __exit__(self, *exc_info):
+        return self._stream.__exit__(*exc_info)
+
+    async def __aenter__(self):
+        await self._stream.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return await self._stream.__aexit__(*exc_info)
+
+
+class _RecordingCompletions:
+    def __init__(self, completions):
+        self._completions = completions
+
+    def __getattr__(self, name: str):
+        return getattr(self._completions, name)
+
+    def create(self, **kwargs):
+        response = self._completions.create(**kwargs)
+        usage = _stream_usage.get()
+        return _RecordingStream(response, usage) if kwargs.get("stream") and usage is not None else response
+
+
+class _AsyncRecordingCompletions(_RecordingCompletions):
+    async def create(self, **kwargs):
+        response = await self._completions.create(**kwargs)
+        usage = _stream_usage.get()
+        return _RecordingStream(response, usage) if kwargs.get("stream") and usage is not None else response
+
+
+def recording_usage(completions):
+    """
+    Wrap the chat completions of an OpenAI client so that the usage of its streamed
+    responses is recorded inside recorded_stream_usage.
+    """
+    if isinstance(completions, AsyncCompletions):
+        return _AsyncRecordingCompletions(completions)
+    return _RecordingCompletions(completions)
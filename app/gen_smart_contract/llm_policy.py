@@ -0,0 +1,466 @@
+import asyncio
+import contextvars
+import logging
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import openai
+from tenacity import (
+    AsyncRetrying,
+    Retrying,
+    retry_if_exception_type,
+    stop_after_attempt,
+    wait_random_exponential,
+)
+
+from app.gen_smart_contract.cancellation import CancelToken
+from app.gen_smart_contract.llm_models import recorded_stream_usage, with_stream_usage
+from app.gen_smart_contract.metrics import metrics
+from app.gen_smart_contract.run_context import current_run_context
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Errors another attempt may not have: connection failures and timeouts, rate limits and server errors
+RETRYABLE_ERRORS = (openai.APIConnectionError, openai.RateLimitError, openai.InternalServerError)
+
+# Builds the config of an attempt from whether it streams tokens to the client and its cancel token
+ConfigFactory = Callable[[bool, Optional[CancelToken]], Optional[Dict[str, Any]]]
+
+_executor = ThreadPoolExecutor(max_workers=Config.LLM_CALL_WORKERS, thread_name_prefix="llm-call")
+
+
+def _call(runnable, inputs: Dict[str, Any], config: Optional[Dict[str, Any]]) -> Any:
+    """
+    Call a runnable once. With a config, whose callbacks forward or cancel on the
+    model's chunks, the response is streamed and its chunks added up.
+    """
+    if config is None:
+        return runnable.invoke(inputs)
+
+    response = None
+    with recorded_stream_usage() as usage:
+        for chunk in runnable.stream(inputs, config=config):
+            response = chunk if response is None else response + chunk
+    return with_stream_usage(response, usage)
+
+
+async def _acall(runnable, inputs: Dict[str, Any], config: Optional[Dict[str, Any]]) -> Any:
+    if config is None:
+        return await runnable.ainvoke(inputs)
+
+    response = None
+    with recorded_stream_usage() as usage:
+        async for chunk in runnable.astream(inputs, config=config):
+            response = chunk if response is None else response + chunk
+    return with_stream_usage(response, usage)
+
+
+class CircuitOpen(Exception):
+    """
+    Raised instead of calling a model whose recent attempts failed, until its
+    circuit breaker lets a trial call through.
+    """
+
+    def __init__(self, endpoint: str, retry_in: float):
+        super().__init__(f"Calls to {endpoint} are failing, they resume in {retry_in:.0f}s")
+        self.endpoint = endpoint
+        self.retry_in = retry_in
+
+
+class LLMDeadlineExceeded(Exception):
+    """Raised when an LLM call, with its retries and hedges, has not answered by its deadline."""
+
+
+class LLMQueueTimeout(LLMDeadlineExceeded):
+    """
+    Raised when no worker of the call pool started an LLM call within its deadline.
+    The endpoint was never called, so its circuit breaker does not count it.
+    """
+
+
+class _Deadline:
+    """
+    The deadline of a call and its retries. Its clock starts when the first attempt
+    starts running, not while it waits for a worker of the pool.
+    """
+
+    def __init__(self, seconds: Optional[float]):
+        self.seconds = seconds
+        self.at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    def start(self) -> float:
+        """
+        Returns:
+            float: The time the attempt starts running
+        """
+        now = time.monotonic()
+        with self._lock:
+            if self.seconds and self.at is None:
+                self.at = now + self.seconds
+        return now
+
+    def exceeded(self) -> bool:
+        return self.at is not None and time.monotonic() >= self.at
+
+    def before_retry(self, retry_state) -> bool:
+        """
+        A tenacity stop condition: whether the wait before the next retry ends after the deadline.
+        """
+        return self.at is not None and time.monotonic() + retry_state.upcoming_sleep >= self.at
+
+
+class CircuitBreaker:
+    """
+    Fails the calls to an endpoint fast once `failure_threshold` attempts in a row
+    have failed with a retryable error or missed their deadline. After
+    `reset_seconds` one trial call is let through: if it succeeds the circuit
+    closes, if it fails the circuit opens again. A threshold of 0 disables it.
+
+    The metrics of the breaker are labelled with `label`, by default its endpoint.
+    """
+
+    def __init__(self, endpoint: str, failure_threshold: int, reset_seconds: float, label: Optional[str] = None):
+        self.endpoint = endpoint
+        self.label = label or endpoint
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self._lock = threading.Lock()
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial = False
+
+    @property
+    def is_open(self) -> bool:
+        with self._lock:
+            return self._opened_at is not None
+
+    def before_call(self):
+        """
+        Raises:
+            CircuitOpen: If the circuit is open, or half-open with its trial call in flight
+        """
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            if self._opened_at is None:
+                return
+            retry_in = self._opened_at + self.reset_seconds - time.monotonic()
+            if retry_in <= 0 and not self._trial:
+                self._trial = True
+                return
+        metrics.incr("llm_circuit_rejections", endpoint=self.label)
+        raise CircuitOpen(self.endpoint, max(retry_in, 0))
+
+    def record_success(self):
+        with self._lock:
+            closed = self._opened_at is not None
+            self._failures = 0
+            self._opened_at = None
+            self._trial = False
+        if closed:
+            logger.info(f"Circuit for {self.endpoint} closed")
+            metrics.set_gauge("llm_circuit_open", 0, endpoint=self.label)
+
+    def record_failure(self):
+        if not self.failure_threshold:
+            return
+        with self._lock:
+            self._failures += 1
+            trial, self._trial = self._trial, False
+            if not trial and (self._opened_at is not None or self._failures < self.failure_threshold):
+                return
+            self._opened_at = time.monotonic()
+        logger.warning(f"Circuit for {self.endpoint} opened after {self._failures} failed attempts")
+        metrics.incr("llm_circuit_opened", endpoint=self.label)
+        metrics.set_gauge("llm_circuit_open", 1, endpoint=self.label)
+
+    def release(self):
+        """
+        End an attempt that tells nothing about the endpoint, such as a cancelled one.
+        """
+        with self._lock:
+            self._trial = False
+
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+
+def circuit_breaker(endpoint: str) -> CircuitBreaker:
+    """
+    The circuit breaker shared by every call to an endpoint.
+    """
+    with _breakers_lock:
+        breaker = _breakers.get(endpoint)
+        if breaker is None:
+            breaker = _breakers[endpoint] = CircuitBreaker(
+                endpoint, Config.LLM_BREAKER_FAILURES, Config.LLM_BREAKER_RESET_SECONDS
+            )
+        return breaker
+
+
+class LLMCallPolicy:
+    """
+    How the calls of a chain to one model are made.
+
+    Each call must answer within the `deadline` seconds of the chain's model
+    settings. An attempt that fails with a retryable error is retried up to
+    `retries` times, after a random exponential wait, as long as the wait ends
+    before the deadline. With hedging, an attempt that has not answered after the
+    LLM_HEDGE_QUANTILE of the recent attempts of the chain on the model gets a
+    duplicate, and whichever answers first wins. The duplicate does not stream its
+    tokens. Every attempt goes through the circuit breaker of the model's endpoint,
+    or of the user's key when the run calls the model with it.
+    """
+
+    def __init__(self, chain: str, model: str, settings: Dict[str, Any]):
+        self.chain = chain
+        self.model = model
+        self.deadline = settings.get("deadline")
+        self.retries = int(settings.get("retries", Config.LLM_RETRIES))
+        self.hedging = bool(settings.get("hedge", Config.LLM_HEDGING_ENABLED))
+        base_url = settings.get("base_url") or Config.LLM_BASE_URL
+        self.breaker = circuit_breaker(f"{model}@{base_url}" if base_url else model)
+
+    def circuit(self) -> CircuitBreaker:
+        """
+        The circuit breaker of the current run's calls.
+        """
+        clients = current_run_context().llm_clients
+        return self.breaker if clients is None else clients.circuit_breaker(self.breaker.endpoint)
+
+    def hedge_delay(self) -> Optional[float]:
+        """
+        Seconds after which an attempt gets a duplicate, None while there are too few
+        recent attempts to tell or hedging is off.
+        """
+        if not self.hedging:
+            return None
+        return metrics.quantile("llm_attempt_seconds", Config.LLM_HEDGE_QUANTILE, Config.LLM_HEDGE_MIN_SAMPLES,
+                                chain=self.chain, model=self.model)
+
+    def _retrying(self, retrying_class, deadline: _Deadline):
+        stop = stop_after_attempt(self.retries + 1)
+        if self.deadline:
+            # Do not wait for a retry that would start after the deadline
+            stop = stop | deadline.before_retry
+        return retrying_class(
+            stop=stop,
+            wait=wait_random_exponential(multiplier=Config.LLM_RETRY_BACKOFF_SECONDS,
+                                         max=Config.LLM_RETRY_MAX_WAIT_SECONDS),
+            retry=retry_if_exception_type(RETRYABLE_ERRORS),
+            before_sleep=self._before_retry,
+            reraise=True,
+        )
+
+    def _before_retry(self, retry_state):
+        error = retry_state.outcome.exception()
+        logger.warning(f"The {self.chain} call to {self.model} failed, retrying in "
+                       f"{retry_state.next_action.sleep:.1f}s: {error}")
+        metrics.incr("llm_retries", chain=self.chain, model=self.model, error=type(error).__name__)
+
+    def _timeout(self, started: float, hedge_after: Optional[float], hedged: bool,
+                 deadline_at: Optional[float]) -> Optional[float]:
+        now = time.monotonic()
+        timeouts = [deadline_at - now] if deadline_at is not None else []
+        if hedge_after is not None and not hedged:
+            timeouts.append(started + hedge_after - now)
+        return max(min(timeouts), 0) if timeouts else None
+
+    def _finish(self, started: float, hedged_won: bool):
+        # When the duplicate wins, the first attempt took at least this long
+        metrics.observe("llm_attempt_seconds", time.monotonic() - started, chain=self.chain, model=self.model)
+        if hedged_won:
+            metrics.incr("llm_hedge_wins", chain=self.chain, model=self.model)
+
+    def _deadline_exceeded(self) -> LLMDeadlineExceeded:
+        metrics.incr("llm_deadline_exceeded", chain=self.chain, model=self.model)
+        return LLMDeadlineExceeded(f"The {self.chain} call to {self.model} did not answer within {self.deadline:g}s")
+
+    def _queue_timeout(self) -> LLMQueueTimeout:
+        metrics.incr("llm_queue_timeouts", chain=self.chain, model=self.model)
+        return LLMQueueTimeout(f"The {self.chain} call to {self.model} waited {self.deadline:g}s for a free worker")
+
+    def _guarded(self, attempt: Callable[[], Any]) -> Any:
+        breaker = self.circuit()
+        breaker.before_call()
+        try:
+            response = attempt()
+        except LLMQueueTimeout:
+            breaker.release()
+            raise
+        except RETRYABLE_ERRORS + (LLMDeadlineExceeded,):
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record_success()
+        return response
+
+    async def _aguarded(self, attempt: Callable[[], Any]) -> Any:
+        breaker = self.circuit()
+        breaker.before_call()
+        try:
+            response = await attempt()
+        except RETRYABLE_ERRORS + (LLMDeadlineExceeded,):
+            breaker.record_failure()
+            raise
+        except BaseException:
+            breaker.release()
+            raise
+        breaker.record_success()
+        return response
+
+    def invoke(self, runnable, inputs: Dict[str, Any], make_config: ConfigFactory,
+               cancel_token: Optional[CancelToken] = None) -> Tuple[Any, bool]:
+        """
+        Call a runnable under the policy.
+
+        Args:
+            runnable: The prompt and model to call
+            inputs (dict): The prompt inputs
+            make_config (callable): Builds the config of each attempt
+            cancel_token (CancelToken, optional): Cancels the call, e.g. when the client disconnects
+
+        Returns:
+            tuple: The response, and whether it came from an attempt that streamed its tokens
+
+        Raises:
+            CircuitOpen: If the model's endpoint is failing
+            LLMDeadlineExceeded: If no attempt answered within the deadline
+            LLMQueueTimeout: If the call waited for a worker of the pool for as long as its deadline
+        """
+        deadline = _Deadline(self.deadline)
+
+        def attempt():
+            if cancel_token is not None:
+                cancel_token.raise_if_cancelled()
+            return self._guarded(lambda: self._race(runnable, inputs, make_config, cancel_token, deadline))
+
+        return self._retrying(Retrying, deadline)(attempt)
+
+    async def ainvoke(self, runnable, inputs: Dict[str, Any], make_config: ConfigFactory) -> Tuple[Any, bool]:
+        """
+        The asyncio counterpart of invoke, cancelled with the task that awaits it.
+        """
+        deadline = _Deadline(self.deadline)
+
+        async def attempt():
+            return await self._aguarded(lambda: self._arace(runnable, inputs, make_config, deadline))
+
+        return await self._retrying(AsyncRetrying, deadline)(attempt)
+
+    def _race(self, runnable, inputs: Dict[str, Any], make_config: ConfigFactory,
+              cancel_token: Optional[CancelToken], deadline: _Deadline) -> Tuple[Any, bool]:
+        hedge_after = self.hedge_delay()
+        if hedge_after is None and not deadline.seconds:
+            started = deadline.start()
+            response = _call(runnable, inputs, make_config(True, cancel_token))
+            self._finish(started, False)
+            return response, True
+
+        # Each attempt runs in the pool with its own token, so that the one that loses the race can be aborted
+        attempts: List[Tuple[Future, CancelToken]] = []
+        unlinks = []
+        # Set to the time the first attempt starts running, which starts the hedge and deadline clocks
+        running = Future()
+
+        def run(config):
+            started = deadline.start()
+            if not running.done():
+                running.set_result(started)
+            return _call(runnable, inputs, config)
+
+        def start(stream: bool):
+            token = CancelToken()
+            if cancel_token is not None:
+                unlinks.append(cancel_token.on_cancel(token.cancel))
+            config = make_config(stream, token)
+            attempts.append((_executor.submit(contextvars.copy_context().run, run, config), token))
+
+        # Wakes the wait below when the run is cancelled
+        cancelled = Future()
+        if cancel_token is not None:
+            unlinks.append(cancel_token.on_cancel(lambda: cancelled.done() or cancelled.set_result(None)))
+
+        queued_at = time.monotonic()
+        start(True)
+        try:
+            while True:
+                if cancel_token is not None:
+                    cancel_token.raise_if_cancelled()
+
+                futures = [future for future, _ in attempts]
+                for i, future in enumerate(futures):
+                    if future.done() and future.exception() is None:
+                        self._finish(running.result(), i > 0)
+                        return future.result(), i == 0
+                if all(future.done() for future in futures):
+                    return futures[0].result(), True
+
+                if not running.done():
+                    # The pool is busy: wait for a worker until the deadline, which a retry's earlier attempt started,
+                    # without blaming the endpoint
+                    timeout = None
+                    if deadline.seconds:
+                        timeout = (deadline.at or queued_at + deadline.seconds) - time.monotonic()
+                    if timeout is not None and timeout <= 0:
+                        raise self._queue_timeout()
+                    wait(futures + [running, cancelled], timeout=timeout, return_when=FIRST_COMPLETED)
+                    continue
+
+                started = running.result()
+                if deadline.exceeded():
+                    raise self._deadline_exceeded()
+                if hedge_after is not None and len(attempts) == 1 and time.monotonic() >= started + hedge_after:
+                    metrics.incr("llm_hedges", chain=self.chain, model=self.model)
+                    start(False)
+
+                timeout = self._timeout(started, hedge_after, len(attempts) > 1, deadline.at)
+                pending = [future for future, _ in attempts if not future.done()]
+                wait(pending + [cancelled], timeout=timeout, return_when=FIRST_COMPLETED)
+        finally:
+            for future, token in attempts:
+                if not future.done():
+                    # Drops an attempt still waiting for a worker, and aborts a running one
+                    future.cancel()
+                    token.cancel()
+            for unlink in unlinks:
+                unlink()
+
+    async def _arace(self, runnable, inputs: Dict[str, Any], make_config: ConfigFactory,
+                     deadline: _Deadline) -> Tuple[Any, bool]:
+        started = deadline.start()
+        hedge_after = self.hedge_delay()
+        if hedge_after is None and not deadline.seconds:
+            response = await _acall(runnable, inputs, make_config(True, None))
+            self._finish(started, False)
+            return response, True
+
+        tasks = [asyncio.ensure_future(_acall(runnable, inputs, make_config(True, None)))]
+        try:
+            while True:
+                for i, task in enumerate(tasks):
+                    if task.done() and task.exception() is None:
+                        self._finish(started, i > 0)
+                        return task.result(), i == 0
+                if all(task.done() for task in tasks):
+                    return tasks[0].result(), True
+
+                if deadline.exceeded():
+                    raise self._deadline_exceeded()
+                if hedge_after is not None and len(tasks) == 1 and time.monotonic() >= started + hedge_after:
+                    metrics.incr("llm_hedges", chain=self.chain, model=self.model)
+                    tasks.append(asyncio.ensure_future(_acall(runnable, inputs, make_config(False, None))))
+
+                timeout = self._timeout(started, hedge_after, len(tasks) > 1, deadline.at)
+                await asyncio.wait([t for t in tasks if not t.done()], timeout=timeout, return_when=FIRST_COMPLETED)
+        finally:
+            for task in tasks:
+                if not task.done():
+                    task.cancel()
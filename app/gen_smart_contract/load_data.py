@@ -1,16 +1,18 @@
 from bs4 import BeautifulSoup as Soup
 from langchain_community.document_loaders.recursive_url_loader import RecursiveUrlLoader
 
+DOCS_VERSION = "0.8.26"
+
 # Define the URLs to scrape
 urls = [
-    "https://docs.soliditylang.org/en/v0.8.26/introduction-to-smart-contracts.html#blockchain-basics",
-    "https://docs.soliditylang.org/en/v0.8.26/solidity-by-example.html",
-    "https://docs.soliditylang.org/en/v0.8.26/layout-of-source-files.html",
-    "https://docs.soliditylang.org/en/v0.8.26/structure-of-a-contract.html",
-    "https://docs.soliditylang.org/en/v0.8.26/contracts.html",
-    "https://docs.soliditylang.org/en/v0.8.26/security-considerations.html",
-    "https://docs.soliditylang.org/en/v0.8.26/style-guide.html",
-    "https://docs.soliditylang.org/en/v0.8.26/common-patterns.html"
+    f"https://docs.soliditylang.org/en/v{DOCS_VERSION}/introduction-to-smart-contracts.html#blockchain-basics",
+    f"https://docs.soliditylang.org/en/v{DOCS_VERSION}/solidity-by-example.html",
+    f"https://docs.soliditylang.org/en/v{DOCS_VERSION}/layout-of-source-files.html",
+    f"https://docs.soliditylang.org/en/v{DOCS_VERSION}/structure-of-a-contract.html",
+    f"https://docs.soliditylang.org/en/v{DOCS_VERSION}/contracts.html",
+    f"https://docs.soliditylang.org/en/v{DOCS_VERSION}/security-considerations.html",
+    f"https://docs.soliditylang.org/en/v{DOCS_VERSION}/style-guide.html",
+    f"https://docs.soliditylang.org/en/v{DOCS_VERSION}/common-patterns.html"
 ]
 
 
@@ -43,12 +45,13 @@ def load_multiple_urls(urls):
     return docs
 
 
-# Load documents from all URLs
-docs = load_multiple_urls(urls)
+def load_concatenated_content(urls):
+    # Load documents from all URLs
+    docs = load_multiple_urls(urls)
 
-# Sort the list based on the URLs and get the text
-d_sorted = sorted(docs, key=lambda x: x.metadata["source"])
-d_reversed = list(reversed(d_sorted))
-concatenated_content = "\n\n\n --- \n\n\n".join(
-    [doc.page_content for doc in d_reversed]
-)
\ No newline at end of file
+    # Sort the list based on the URLs and get the text
+    d_sorted = sorted(docs, key=lambda x: x.metadata["source"])
+    d_reversed = list(reversed(d_sorted))
+    return "\n\n\n --- \n\n\n".join(
+        [doc.page_content for doc in d_reversed]
+    )
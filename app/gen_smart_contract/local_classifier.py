@@ -0,0 +1,387 @@
+import json
+import logging
+import os
+import re
+import threading
+import time
+import zlib
+from collections import Counter, defaultdict
+from typing import Any, Dict, Iterable, List, Optional
+
+import numpy as np
+
+from app.gen_smart_contract.docs_index import tokenize
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Number of hashed feature buckets
+FEATURE_DIM = 2 ** 18
+
+# Length of the character n-grams, which tolerate spelling variants such as "erc-20" and "erc20"
+CHAR_NGRAM = 4
+
+# Seconds between two prunings of the classification log by one process
+LOG_PRUNE_INTERVAL = 24 * 60 * 60
+
+# Words that name no feature, so a prompt may use them without falling back to the LLM
+STOP_WORDS = frozenset(
+    "a an and any are as at be by can contract create for from have i in is it its make me my need of on or "
+    "our please should simple smart solidity that the this to using want we where which will with write".split()
+)
+
+
+def _hash(feature: str) -> int:
+    # crc32 rather than hash(), which is salted per process and would not survive a reload
+    return zlib.crc32(feature.encode("utf-8")) % FEATURE_DIM
+
+
+def hashed_features(text: str) -> Dict[int, float]:
+    """
+    Hash the word unigrams, word bigrams and character n-grams of a text into
+    sublinear term frequencies.
+
+    Args:
+        text (str): The text to featurize
+
+    Returns:
+        dict: The feature bucket of every term and its weight
+    """
+    words = tokenize(text)
+    joined = " ".join(words)
+    terms = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+    terms += [f"#{joined[i:i + CHAR_NGRAM]}" for i in range(len(joined) - CHAR_NGRAM + 1)]
+
+    counts: Dict[int, int] = defaultdict(int)
+    for term in terms:
+        counts[_hash(term)] += 1
+    return {bucket: 1.0 + np.log(count) for bucket, count in counts.items()}
+
+
+def label_key(contract_type: str) -> str:
+    """
+    Normalize a contract type so that "ERC-20 Token" and "erc20 token" vote together.
+    """
+    return re.sub(r"[^a-z0-9]", "", contract_type.lower())
+
+
+class LocalClassifier:
+    """
+    A nearest-neighbour classifier of contract descriptions over TF-IDF weighted,
+    hashed n-gram features, trained on the answers of the classify LLM chain.
+
+    The training vectors are stored as a CSR matrix of L2-normalized rows, so a
+    prediction is one sparse dot product per stored description. The contract
+    type is the similarity-weighted vote of the nearest neighbours.
+
+    The descriptions themselves are not kept, only their hashed features and
+    contract type. The requirements of a type are those that at least
+    `min_support` descriptions of the type share, so that a prediction never hands
+    one user the requirements only another user asked for. The words of a type are
+    those of its name and shared requirements, and those used by at least
+    `min_support` of its descriptions. A prompt with other words names features
+    the shared requirements may miss, and is left to the LLM.
+    """
+
+    def __init__(self, idf: np.ndarray, indptr: np.ndarray, indices: np.ndarray, data: np.ndarray,
+                 labels: np.ndarray, types: Dict[str, Dict[str, Any]]):
+        self.idf = idf
+        self.indptr = indptr
+        self.indices = indices
+        self.data = data
+        self.labels = labels
+        self.types = types
+
+    @classmethod
+    def train(cls, samples: List[Dict[str, Any]], min_support: int = 3) -> "LocalClassifier":
+        """
+        Args:
+            samples (list): Dicts with a prompt, contract_type and requirements
+            min_support (int): The number of descriptions of a type that must share a requirement
+
+        Returns:
+            LocalClassifier: The trained classifier
+        """
+        features = [hashed_features(s["prompt"]) for s in samples]
+
+        doc_freqs = np.zeros(FEATURE_DIM, dtype=np.float64)
+        for f in features:
+            doc_freqs[list(f)] += 1
+        idf = np.log((1 + len(samples)) / (1 + doc_freqs)) + 1
+
+        indptr = np.zeros(len(samples) + 1, dtype=np.int64)
+        indices, data = [], []
+        for i, f in enumerate(features):
+            buckets = np.fromiter(f.keys(), dtype=np.int64, count=len(f))
+            weights = np.fromiter(f.values(), dtype=np.float64, count=len(f)) * idf[buckets]
+            norm = np.linalg.norm(weights)
+            indices.append(buckets)
+            data.append(weights / norm if norm else weights)
+            indptr[i + 1] = indptr[i] + len(f)
+
+        return cls(
+            idf.astype(np.float32),
+            indptr,
+            np.concatenate(indices).astype(np.int32) if indices else np.zeros(0, dtype=np.int32),
+            np.concatenate(data).astype(np.float32) if data else np.zeros(0, dtype=np.float32),
+            np.array([label_key(s["contract_type"]) for s in samples]),
+            _shared_types(samples, min_support),
+        )
+
+    def save(self, path: str):
+        np.savez_compressed(path, idf=self.idf, indptr=self.indptr, indices=self.indices, data=self.data,
+                            labels=self.labels, types=np.array(json.dumps(self.types)))
+
+    @classmethod
+    def load(cls, path: str) -> "LocalClassifier":
+        arrays = np.load(path)
+        types = json.loads(str(arrays["types"])) if "types" in arrays else None
+        if types is None or any("words" not in t for t in types.values()):
+            raise ValueError(f"{path} was trained by an earlier version, retrain it")
+        return cls(arrays["idf"], arrays["indptr"], arrays["indices"], arrays["data"], arrays["labels"], types)
+
+    def similarities(self, prompt: str) -> np.ndarray:
+        query = np.zeros(FEATURE_DIM, dtype=np.float32)
+        for bucket, weight in hashed_features(prompt).items():
+            query[bucket] = weight * self.idf[bucket]
+        norm = np.linalg.norm(query)
+        if not norm or not len(self.labels):
+            return np.zeros(len(self.labels), dtype=np.float32)
+        query /= norm
+
+        products = self.data * query[self.indices]
+        sums = np.concatenate(([0.0], np.cumsum(products, dtype=np.float64)))
+        return (sums[self.indptr[1:]] - sums[self.indptr[:-1]]).astype(np.float32)
+
+    def predict(self, prompt: str, neighbours: int = 5) -> Optional[Dict[str, Any]]:
+        """
+        Args:
+            prompt (str): The contract description
+            neighbours (int): The number of nearest descriptions that vote
+
+        Returns:
+            dict: The contract_type, requirements, confidence and the words of the prompt outside
+                those of the type, None without training data. The confidence is the share of the
+                vote won, scaled by the similarity of the closest description of the winning type,
+                so a high value needs a near duplicate.
+        """
+        if not len(self.labels):
+            return None
+
+        similarities = self.similarities(prompt)
+        nearest = np.argsort(-similarities, kind="stable")[:neighbours]
+        weights = np.clip(similarities[nearest], 0, None)
+        if weights.sum() <= 0:
+            return None
+
+        votes: Dict[str, float] = defaultdict(float)
+        for index, weight in zip(nearest, weights):
+            votes[self.labels[index]] += float(weight)
+        winner = max(votes, key=votes.get)
+        best = next(int(i) for i in nearest if self.labels[i] == winner)
+
+        known = set(self.types[winner]["words"])
+        return {
+            "contract_type": self.types[winner]["contract_type"],
+            "requirements": list(self.types[winner]["requirements"]),
+            "confidence": round(votes[winner] / float(weights.sum()) * float(similarities[best]), 4),
+            "unknown_words": sorted({w for w in tokenize(prompt) if w not in known and w not in STOP_WORDS}),
+        }
+
+
+def _shared_types(samples: List[Dict[str, Any]], min_support: int) -> Dict[str, Dict[str, Any]]:
+    """
+    The most common name of each contract type, the requirements that at least
+    `min_support` of its descriptions share, the most common first, and its words.
+    """
+    names: Dict[str, Counter] = defaultdict(Counter)
+    requirements: Dict[str, Counter] = defaultdict(Counter)
+    words: Dict[str, Counter] = defaultdict(Counter)
+    spellings: Dict[str, str] = {}
+    for sample in samples:
+        label = label_key(sample["contract_type"])
+        names[label][sample["contract_type"]] += 1
+        words[label].update(set(tokenize(sample["prompt"])))
+        for requirement in {" ".join(r.split()): None for r in sample["requirements"]}:
+            key = requirement.lower()
+            spellings.setdefault(key, requirement)
+            requirements[label][key] += 1
+
+    types = {}
+    for label, counts in names.items():
+        shared = [spellings[key] for key, count in requirements[label].most_common() if count >= min_support]
+        known = {word for word, count in words[label].items() if count >= min_support}
+        for text in [*counts, *shared]:
+            known.update(tokenize(text))
+        types[label] = {"contract_type": counts.most_common(1)[0][0], "requirements": shared,
+                        "words": sorted(known)}
+    return types
+
+
+def read_samples(path: str, max_age: Optional[float] = None) -> List[Dict[str, Any]]:
+    """
+    Read logged classify runs, keeping the latest answer for each description, and
+    with `max_age` only those logged in the last `max_age` seconds.
+    """
+    cutoff = time.time() - max_age if max_age else None
+    samples: Dict[str, Dict[str, Any]] = {}
+    if not os.path.exists(path):
+        return []
+
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try:
+                sample = json.loads(line)
+            except ValueError:
+                continue
+            if cutoff is not None and (sample.get("logged_at") or 0) < cutoff:
+                continue
+            if sample.get("prompt") and sample.get("contract_type"):
+                samples[sample["prompt"].strip()] = sample
+    return list(samples.values())
+
+
+def train_from_log(log_path: str, model_path: str) -> LocalClassifier:
+    """
+    Train a classifier on the seed descriptions and the logged classify runs of the last
+    CLASSIFIER_LOG_TTL_SECONDS, dropping the older ones from the log, and write it to `model_path`.
+    """
+    prune_log(log_path, Config.CLASSIFIER_LOG_TTL_SECONDS)
+    samples = read_samples(Config.CLASSIFIER_SEED_PATH) + read_samples(log_path, Config.CLASSIFIER_LOG_TTL_SECONDS)
+    # A logged answer replaces the seed answer for the same description
+    samples = list({sample["prompt"].strip(): sample for sample in samples}.values())
+    classifier = LocalClassifier.train(samples, Config.CLASSIFIER_MIN_SUPPORT)
+    os.makedirs(os.path.dirname(model_path) or ".", exist_ok=True)
+    # np.savez appends .npz to paths without it, so write to a temporary name that already has it
+    temporary = f"{model_path}.{os.getpid()}.tmp.npz"
+    classifier.save(temporary)
+    os.replace(temporary, model_path)
+    return classifier
+
+
+_log_lock = threading.Lock()
+_log_pruned_at = 0.0
+
+
+def prune_log(path: str, max_age: float) -> int:
+    """
+    Drop the classifications logged more than `max_age` seconds ago.
+
+    Returns:
+        int: The number of records dropped
+    """
+    cutoff = time.time() - max_age
+    with _log_lock:
+        try:
+            with open(path, encoding="utf-8") as f:
+                lines = f.readlines()
+        except FileNotFoundError:
+            return 0
+
+        kept = []
+        for line in lines:
+            try:
+                if (json.loads(line).get("logged_at") or 0) >= cutoff:
+                    kept.append(line)
+            except ValueError:
+                continue
+        if len(kept) == len(lines):
+            return 0
+
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "w", encoding="utf-8") as f:
+            f.writelines(kept)
+        os.replace(temporary, path)
+        return len(lines) - len(kept)
+
+
+def log_classification(prompt: str, contract_type: str, requirements: Iterable[str], latency: float):
+    """
+    Append an LLM classification to the training log of the local classifier, if
+    CLASSIFIER_LOG_ENABLED opts in to keeping the prompts, and drop those older than
+    CLASSIFIER_LOG_TTL_SECONDS about once a day.
+    """
+    global _log_pruned_at
+
+    if not Config.CLASSIFIER_LOG_ENABLED:
+        return
+
+    record = json.dumps({
+        "prompt": prompt,
+        "contract_type": contract_type,
+        "requirements": list(requirements),
+        "latency_seconds": round(latency, 4),
+        "logged_at": time.time(),
+    })
+    try:
+        with _log_lock:
+            os.makedirs(os.path.dirname(Config.CLASSIFIER_LOG_PATH) or ".", exist_ok=True)
+            with open(Config.CLASSIFIER_LOG_PATH, "a", encoding="utf-8") as f:
+                f.write(record + "\n")
+
+        if time.time() - _log_pruned_at >= LOG_PRUNE_INTERVAL:
+            _log_pruned_at = time.time()
+            prune_log(Config.CLASSIFIER_LOG_PATH, Config.CLASSIFIER_LOG_TTL_SECONDS)
+    except OSError as e:
+        logger.warning(f"Could not log the classification: {e}")
+
+
+_classifier: Optional[LocalClassifier] = None
+_classifier_mtime: Optional[float] = None
+_classifier_lock = threading.Lock()
+
+
+def get_local_classifier() -> Optional[LocalClassifier]:
+    """
+    The trained classifier at CLASSIFIER_MODEL_PATH, reloaded when it is retrained.
+    Until it is trained, one trained on the seed descriptions at CLASSIFIER_SEED_PATH,
+    or None if it is disabled.
+    """
+    global _classifier, _classifier_mtime
+
+    if not Config.CLASSIFIER_ENABLED:
+        return None
+
+    try:
+        mtime = os.stat(Config.CLASSIFIER_MODEL_PATH).st_mtime
+    except OSError:
+        mtime = 0.0
+
+    if mtime != _classifier_mtime:
+        with _classifier_lock:
+            if mtime != _classifier_mtime:
+                try:
+                    if mtime:
+                        _classifier = LocalClassifier.load(Config.CLASSIFIER_MODEL_PATH)
+                    else:
+                        _classifier = LocalClassifier.train(read_samples(Config.CLASSIFIER_SEED_PATH),
+                                                            Config.CLASSIFIER_MIN_SUPPORT)
+                except Exception as e:
+                    logger.warning(f"Could not load the local classifier: {e}")
+                    _classifier = None
+                _classifier_mtime = mtime
+
+    return _classifier
+
+
+def classify_locally(prompt: str) -> Optional[Dict[str, Any]]:
+    """
+    Classify a description without the LLM if the local classifier is confident enough.
+
+    Returns:
+        dict: The contract_type, requirements and confidence, or None to fall back to the LLM
+    """
+    classifier = get_local_classifier()
+    if classifier is None:
+        return None
+
+    prediction = classifier.predict(prompt, Config.CLASSIFIER_NEIGHBOURS)
+    if prediction is None or prediction["confidence"] < Config.CLASSIFIER_CONFIDENCE_THRESHOLD:
+        return None
+    # Too few descriptions of the type agree on any requirement
+    if not prediction["requirements"]:
+        return None
+    # The prompt asks for something the shared requirements may not cover, such as a name or a feature
+    if prediction["unknown_words"]:
+        return None
+    return prediction
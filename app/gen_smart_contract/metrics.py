@@ -0,0 +1,108 @@
+import threading
+from collections import deque
+from typing import Any, Dict, Optional
+
+import numpy as np
+
+# Upper bounds of the histogram buckets, in seconds
+DEFAULT_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+# Number of recent observations kept per histogram for quantile estimates
+RESERVOIR_SIZE = 1024
+
+
+def _key(name: str, labels: Dict[str, Any]) -> str:
+    if not labels:
+        return name
+    return name + "{" + ",".join(f"{k}={v}" for k, v in sorted(labels.items())) + "}"
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.bucket_counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=RESERVOIR_SIZE)
+
+    def observe(self, value: float):
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.bucket_counts[i] += 1
+                break
+        else:
+            self.bucket_counts[-1] += 1
+
+    def quantile(self, q: float) -> float:
+        if not self.recent:
+            return 0.0
+        return float(np.quantile(np.fromiter(self.recent, dtype=np.float64), q))
+
+    def snapshot(self) -> Dict[str, Any]:
+        labels = [str(b) for b in self.buckets] + ["+Inf"]
+        return {
+            "count": self.count,
+            "sum": round(self.sum, 6),
+            "buckets": dict(zip(labels, np.cumsum(self.bucket_counts).tolist())),
+            "p50": round(self.quantile(0.5), 6),
+            "p95": round(self.quantile(0.95), 6),
+            "p99": round(self.quantile(0.99), 6),
+        }
+
+
+class Metrics:
+    """
+    A thread-safe, in-process registry of counters, gauges and histograms
+    exposed by the /api/ai/metrics endpoint.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters: Dict[str, float] = {}
+        self._gauges: Dict[str, float] = {}
+        self._histograms: Dict[str, Histogram] = {}
+
+    def incr(self, name: str, value: float = 1, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    def set_gauge(self, name: str, value: float, **labels):
+        with self._lock:
+            self._gauges[_key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels):
+        key = _key(name, labels)
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def quantile(self, name: str, q: float, min_count: int = 1, **labels) -> Optional[float]:
+        """
+        The q-quantile of a histogram's recent observations, None until it has `min_count` of them.
+        """
+        with self._lock:
+            histogram = self._histograms.get(_key(name, labels))
+            if histogram is None or len(histogram.recent) < max(min_count, 1):
+                return None
+            return histogram.quantile(q)
+
+    def counter(self, name: str, **labels) -> float:
+        with self._lock:
+            return self._counters.get(_key(name, labels), 0)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+                "histograms": {k: h.snapshot() for k, h in self._histograms.items()},
+            }
+
+
+metrics = Metrics()
@@ -1,4 +1,10 @@
+import asyncio
+import time
+
 from app.gen_smart_contract.common import classify_contract_chain
+from app.gen_smart_contract.local_classifier import classify_locally, log_classification
+from app.gen_smart_contract.metrics import metrics
+from app.gen_smart_contract.preflight import check_prompt
 from app.gen_smart_contract.state import GraphState
 
 
@@ -18,10 +24,65 @@ def classify(state: GraphState):
     # State
     prompt = state["prompt"]
 
+    local = _classify_locally(prompt)
+    if local:
+        return local
+
+    check_prompt("classify", classify_contract_chain, {"prompt": prompt})
+
+    started = time.perf_counter()
     classify_contract = classify_contract_chain.invoke(
         {"prompt": prompt}
     )
 
+    return _classified(prompt, classify_contract, time.perf_counter() - started)
+
+
+async def aclassify(state: GraphState):
+    """
+    Classify smart contract, asynchronously
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): New key added to state, generation
+    """
+
+    print("---CLASSIFYING SMART CONTRACT---")
+
+    # The first lookup loads the classifier from disk, and the result is appended to the log file
+    local = await asyncio.to_thread(_classify_locally, state["prompt"])
+    if local:
+        return local
+
+    check_prompt("classify", classify_contract_chain, {"prompt": state["prompt"]})
+
+    started = time.perf_counter()
+    classify_contract = await classify_contract_chain.ainvoke(
+        {"prompt": state["prompt"]}
+    )
+
+    return await asyncio.to_thread(_classified, state["prompt"], classify_contract, time.perf_counter() - started)
+
+
+def _classify_locally(prompt: str):
+    # A lookup over the stored vectors takes milliseconds once the classifier is loaded
+    prediction = classify_locally(prompt)
+    if prediction is None:
+        metrics.incr("classify_local_misses")
+        return None
+
+    metrics.incr("classify_local_hits")
+    print(f"---CLASSIFIED LOCALLY (confidence {prediction['confidence']})---")
+    return {
+        "contract_type": prediction["contract_type"],
+        "contract_requirements": prediction["requirements"],
+    }
+
+
+def _classified(prompt: str, classify_contract, latency: float):
+    log_classification(prompt, classify_contract.contract_type, classify_contract.requirements, latency)
     return {
         "contract_type": classify_contract.contract_type,
         "contract_requirements": classify_contract.requirements,
@@ -1,6 +1,12 @@
-import solcx
-from solcx import compile_source, install_solc
+from dataclasses import asdict
+
+from app.gen_smart_contract.cancellation import RunCancelled
+from app.gen_smart_contract.compile_pool import CompileCancelled, CompileQueueFull
+from app.gen_smart_contract.compiler import CompileResult, acompile_contract, compile_contract
+from app.gen_smart_contract.diagnostics import Diagnostic, format_for_prompt, retry_message
+from app.gen_smart_contract.retry_policy import retry_policy
 from app.gen_smart_contract.state import GraphState
+from config import Config
 
 
 def code_check(state: GraphState):
@@ -16,51 +22,82 @@ def code_check(state: GraphState):
 
     print("---CHECKING CODE---")
 
-    # State
-    compiler_version = state["compiler_version"]
-    contract = state["contract"]
-    error_message = state["error_message"]
+    if state.get("compile_result"):
+        return _checked(state, CompileResult(**state["compile_result"]))
 
     # Compile Solidity code
     try:
-        install_solc(compiler_version)
+        result = compile_contract(state["contract"], state["compiler_version"],
+                                  queue_wait=Config.COMPILE_NODE_QUEUE_WAIT_SECONDS)
+    except (CompileQueueFull, CompileCancelled, RunCancelled):
+        # Not a problem with the generated code, so do not spend a retry on it
+        raise
+    except Exception as e:
+        result = e
 
-        compile_source(contract, solc_version=compiler_version)
+    return _checked(state, result)
 
-        print("---COMPILED SOLIDITY OUTPUT---")
-        print("---NO CODE TEST FAILURES---")
-        error = "no"
-        errors = ""
 
-    except solcx.exceptions.SolcError as e:
-        print("---CODE TEST FAILURES---")
-        error = "yes"
-        errors = f"SolcError: {e}"
+async def acode_check(state: GraphState):
+    """
+    Check code, asynchronously
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): New key added to state, error, and error details if any
+    """
+
+    print("---CHECKING CODE---")
+
+    if state.get("compile_result"):
+        return _checked(state, CompileResult(**state["compile_result"]))
+
+    try:
+        result = await acompile_contract(state["contract"], state["compiler_version"],
+                                         queue_wait=Config.COMPILE_NODE_QUEUE_WAIT_SECONDS)
+    except (CompileQueueFull, CompileCancelled, RunCancelled):
+        raise
     except Exception as e:
+        result = e
+
+    return _checked(state, result)
+
+
+def _checked(state: GraphState, result):
+    contract = state["contract"]
+    error_message = state["error_message"]
+
+    if isinstance(result, Exception):
         print("---GENERAL ERROR DURING COMPILATION---")
         error = "yes"
-        errors = f"Exception: {e}"
+        diagnostics = [asdict(Diagnostic(severity="error", message=str(result)))]
+        errors = format_for_prompt(diagnostics)
+        artifacts = {}
+    else:
+        if result.success:
+            print("---COMPILED SOLIDITY OUTPUT---")
+            print("---NO CODE TEST FAILURES---")
+            error = "no"
+        else:
+            print("---CODE TEST FAILURES---")
+            error = "yes"
+        diagnostics = result.diagnostics
+        _, artifacts = result.main_contract(contract) or (None, {})
+        errors = result.errors
 
     if error == "yes":
-        error_message = (
-            "\n ----- \n"
-            "\n The following compilation errors were detected in your Solidity code: \n"
-            "\n ----- \n"
-            f"{contract}\n"
-            "\n ----- \n"
-            f"{errors}\n"
-            "\n ----- \n"
-            "To resolve these issues, consider the following steps:\n"
-            "1. GO THROUGH THE DOCUMENTATION OF SOLIDITY THAT HAS BEEN PROVIDED"
-            "2. **Review the Solidity syntax and structure:** Ensure that your contract adheres to the correct Solidity syntax and structure. Common issues include missing semicolons, unmatched braces, and incorrect function definitions.\n"
-            "3. **Check the compiler version:** Ensure that you are using the correct version of the Solidity compiler as specified in your code. Different versions may have different syntax and features.\n"
-            "4. **Consult the Solidity documentation:** Look up the specific error codes and messages in the Solidity documentation. This can provide more context and examples of how to fix the issues.\n"
-            "5. **Test incrementally:** Make small, incremental changes to your contract and recompile often. This can help you identify the exact changes that introduce errors.\n"
-            "6. **Seek help from the community:** If you're stuck, consider reaching out to the Solidity community for help. Forums like Stack Exchange, GitHub, and the Solidity Gitter can be valuable resources.\n\n"
-            "Once the errors are fixed, re-generate your code and try again."
-        )
+        # Only the compact diagnostics go back to the model, not the whole contract
+        error_message = retry_message(errors)
 
     return {
         "error": error,
         "error_message": error_message,
+        "diagnostics": diagnostics,
+        # Returned with the check so that clients do not need to compile the contract again
+        "abi": artifacts.get("abi"),
+        "bytecode": artifacts.get("bin"),
+        # Whether another round may be spent on the contract, and how much of the budget is used
+        **retry_policy.check(state, contract, error, diagnostics),
     }
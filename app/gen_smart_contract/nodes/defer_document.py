@@ -0,0 +1,45 @@
+from typing import Dict, Any
+
+from app.gen_smart_contract.documentation_service import contract_hash, schedule_documentation
+from app.gen_smart_contract.semantic_cache import remember_result
+from app.gen_smart_contract.state import GraphState
+from config import Config
+
+
+def defer_document(state: GraphState) -> Dict[str, Any]:
+    """
+    Finish without documentation, optionally starting it in the background so that
+    the documentation endpoint can serve it later
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): New key added to state, contract_hash
+    """
+
+    print("---DEFERRING CODE DOCUMENTATION---")
+
+    # State
+    contract = state["contract"]
+    compiler_version = state["compiler_version"]
+    contract_type = state["contract_type"]
+    requirements = state["contract_requirements"]
+    iterations = state["iterations"]
+
+    # A run that stopped retrying with compiler errors is not worth documenting
+    if Config.DOCUMENTATION_BACKGROUND and state["error"] == "no":
+        key = schedule_documentation(contract)
+    else:
+        key = contract_hash(contract)
+
+    remember_result(state)
+
+    return {
+        "contract": contract,
+        "contract_type": contract_type,
+        "contract_requirements": requirements,
+        "contract_hash": key,
+        "compiler_version": compiler_version,
+        "iterations": iterations
+    }
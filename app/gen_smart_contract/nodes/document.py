@@ -1,6 +1,9 @@
+import asyncio
 from typing import Dict, Any
 
 from app.gen_smart_contract.common import documentation_gen_chain
+from app.gen_smart_contract.preflight import check_prompt
+from app.gen_smart_contract.semantic_cache import remember_result
 from app.gen_smart_contract.state import GraphState
 
 
@@ -17,22 +20,43 @@ def document(state: GraphState) -> Dict[str, Any]:
 
     print("---GENERATING CODE DOCUMENTATION---")
 
-    # State
-    contract = state["contract"]
-    compiler_version = state["compiler_version"]
-    contract_type = state["contract_type"]
-    requirements = state["contract_requirements"]
-    iterations = state["iterations"]
-
+    check_prompt("document", documentation_gen_chain, {"contract": state["contract"]})
     documentation = documentation_gen_chain.invoke({
-        "contract": contract
+        "contract": state["contract"]
     })
+    remember_result(state, documentation.documentation)
+
+    return _documented(state, documentation)
+
+
+async def adocument(state: GraphState) -> Dict[str, Any]:
+    """
+    Generate the documentation, asynchronously
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): New key added to state, documentation
+    """
+
+    print("---GENERATING CODE DOCUMENTATION---")
+
+    check_prompt("document", documentation_gen_chain, {"contract": state["contract"]})
+    documentation = await documentation_gen_chain.ainvoke({
+        "contract": state["contract"]
+    })
+    await asyncio.to_thread(remember_result, state, documentation.documentation)
+
+    return _documented(state, documentation)
+
 
+def _documented(state: GraphState, documentation) -> Dict[str, Any]:
     return {
-        "contract": contract,
-        "contract_type": contract_type,
-        "contract_requirements": requirements,
+        "contract": state["contract"],
+        "contract_type": state["contract_type"],
+        "contract_requirements": state["contract_requirements"],
         "documentation": documentation.documentation,
-        "compiler_version": compiler_version,
-        "iterations": iterations
+        "compiler_version": state["compiler_version"],
+        "iterations": state["iterations"]
     }
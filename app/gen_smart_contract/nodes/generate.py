@@ -1,7 +1,19 @@
+import asyncio
+from dataclasses import asdict
+
 from app.gen_smart_contract.common import code_gen_chain
-from app.gen_smart_contract.load_data import concatenated_content
+from app.gen_smart_contract.diagnostics import format_for_prompt, retry_message
+from app.gen_smart_contract.docs_index import retrieve_context
+from app.gen_smart_contract.preflight import fit_prompt
+from app.gen_smart_contract.retry_policy import call_tokens
+from app.gen_smart_contract.speculative import candidate_count, generate_candidates
 from app.gen_smart_contract.state import GraphState
 
+WARM_START = (
+    "\n\nThis contract was generated for a similar request. Reuse what fits and change what this request "
+    "needs:\n{contract}"
+)
+
 
 def generate(state: GraphState):
     """
@@ -16,29 +28,83 @@ def generate(state: GraphState):
 
     print("---GENERATING CODE SOLUTION---")
 
+    inputs, trimmed, candidates = _prepare(state)
+
+    # Solution
+    if candidates > 1:
+        print(f"---GENERATING {candidates} CANDIDATE SOLUTIONS---")
+        code_solution, result, generations = generate_candidates(inputs, candidates)
+    else:
+        code_solution, result, generations = code_gen_chain.invoke(inputs), None, 1
+
+    return _generated(state, inputs, trimmed, code_solution, result, candidates, generations)
+
+
+async def agenerate(state: GraphState):
+    """
+    Generate a code solution, asynchronously
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): New key added to state, generation
+    """
+
+    print("---GENERATING CODE SOLUTION---")
+
+    # The first retrieval loads the documentation index from disk
+    inputs, trimmed, candidates = await asyncio.to_thread(_prepare, state)
+
+    # Solution
+    if candidates > 1:
+        print(f"---GENERATING {candidates} CANDIDATE SOLUTIONS---")
+        code_solution, result, generations = await asyncio.to_thread(generate_candidates, inputs, candidates)
+    else:
+        code_solution, result, generations = await code_gen_chain.ainvoke(inputs), None, 1
+
+    return _generated(state, inputs, trimmed, code_solution, result, candidates, generations)
+
+
+def _prepare(state: GraphState):
     # State
     requirements = state["contract_requirements"]
-    contract_type = state["contract_type"]
     prompt = state["prompt"]
     error = state["error"]
     error_message = state["error_message"]
-    iterations = state["iterations"]
 
+    # Pick the documentation sections relevant to this request and its compiler errors
+    context = retrieve_context(prompt, "\n".join(requirements), error_message if error == "yes" else "")
+
+    # A contract generated for a similar prompt, served by the semantic cache, to adapt rather than start over
+    if state.get("warm_start_contract"):
+        prompt += WARM_START.format(contract=state["warm_start_contract"])
+
+    diagnostics = None
     if error == "yes":
         print("---REGENERATING CODE SOLUTION---")
-        prompt += error_message
+        diagnostics = state.get("diagnostics") or []
 
-    # Solution
-    code_solution = code_gen_chain.invoke(
-        {"context": concatenated_content, "prompt": prompt, "requirements": requirements}
-    )
+    def build(context: str, errors: int):
+        retry = retry_message(format_for_prompt(diagnostics, errors)) if diagnostics is not None else ""
+        return {"context": context, "prompt": prompt + retry, "requirements": requirements}
+
+    inputs, trimmed = fit_prompt("generate", code_gen_chain, build, context, diagnostics)
+    return inputs, trimmed, candidate_count(state.get("generations") or 0)
 
-    iterations += 1
 
+def _generated(state: GraphState, inputs, trimmed, code_solution, result, candidates: int, generations: int):
     return {
+        "prompt_trimmed": trimmed,
         "contract": code_solution.contract,
         "compiler_version": code_solution.solVersion,
-        "contract_type": contract_type,
-        "contract_requirements": requirements,
-        "iterations": iterations,
+        # The speculative candidates are compiled as they arrive, so that check_code does not compile the winner again
+        "compile_result": asdict(result) if result is not None else None,
+        "contract_type": state["contract_type"],
+        "contract_requirements": state["contract_requirements"],
+        "iterations": state["iterations"] + 1,
+        "generations": (state.get("generations") or 0) + generations,
+        # Every candidate's prompt is billed, including those cancelled before they finished
+        "tokens_used": (state.get("tokens_used") or 0) + call_tokens(code_gen_chain, inputs, code_solution.contract,
+                                                                       candidates),
     }
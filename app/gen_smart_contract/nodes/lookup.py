@@ -0,0 +1,69 @@
+import asyncio
+from typing import Any, Dict
+
+from app.gen_smart_contract.run_context import current_run_context
+from app.gen_smart_contract.semantic_cache import HIT, MISS, WARM, find_result
+from app.gen_smart_contract.state import GraphState
+
+
+def lookup(state: GraphState) -> Dict[str, Any]:
+    """
+    Look up the result of an earlier run with a similar prompt
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): New key added to state, cache_status, and the cached result on a hit
+    """
+
+    print("---LOOKING UP SIMILAR CONTRACTS---")
+
+    # Bypassing the LLM cache also bypasses this one, the run's result then refreshes it
+    if current_run_context().cache_bypass:
+        return {"cache_status": MISS}
+
+    return _looked_up(*find_result(state["prompt"]))
+
+
+async def alookup(state: GraphState) -> Dict[str, Any]:
+    """
+    Look up the result of an earlier run with a similar prompt, asynchronously
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): New key added to state, cache_status, and the cached result on a hit
+    """
+
+    print("---LOOKING UP SIMILAR CONTRACTS---")
+
+    if current_run_context().cache_bypass:
+        return {"cache_status": MISS}
+
+    # The embedder may call an API
+    return _looked_up(*await asyncio.to_thread(find_result, state["prompt"]))
+
+
+def _looked_up(status: str, similarity: float, result) -> Dict[str, Any]:
+    if status == HIT:
+        print(f"---ANSWERED FROM CACHE (similarity {similarity:.3f})---")
+        return {
+            **result,
+            "cache_status": status,
+            "cache_similarity": round(similarity, 4),
+            "error": "no",
+            "iterations": 0,
+        }
+
+    if status == WARM:
+        # Only the contract is reused, the new prompt is still classified for its own type and requirements
+        print(f"---WARM START FROM CACHE (similarity {similarity:.3f})---")
+        return {
+            "cache_status": status,
+            "cache_similarity": round(similarity, 4),
+            "warm_start_contract": result["contract"],
+        }
+
+    return {"cache_status": status}
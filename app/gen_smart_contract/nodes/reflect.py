@@ -1,6 +1,23 @@
-from app.gen_smart_contract.common import code_update_chain
-from app.gen_smart_contract.load_data import concatenated_content
+import asyncio
+import json
+import logging
+
+from app.gen_smart_contract.common import code_functions_chain, code_update_chain
+from app.gen_smart_contract.contract_patch import PatchError, apply_patches
+from app.gen_smart_contract.diagnostics import format_for_prompt, retry_message
+from app.gen_smart_contract.docs_index import retrieve_context
+from app.gen_smart_contract.metrics import metrics
+from app.gen_smart_contract.preflight import fit_prompt
+from app.gen_smart_contract.retry_policy import call_tokens
 from app.gen_smart_contract.state import GraphState
+from app.gen_smart_contract.tokens import count_tokens
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+FULL = "full"
+FUNCTIONS = "functions"
+AUTO = "auto"
 
 
 def reflect(state: GraphState):
@@ -16,21 +33,151 @@ def reflect(state: GraphState):
 
     print("---UPDATING CODE SOLUTION---")
 
+    if _update_mode(state) == FUNCTIONS:
+        inputs, trimmed = _prepare_functions(state)
+        patches = code_functions_chain.invoke(inputs)
+        try:
+            return _patched(state, inputs, trimmed, patches)
+        except PatchError as e:
+            state = _fall_back(state, inputs, patches, e)
+
+    inputs, trimmed = _prepare(state)
+    updated_code = code_update_chain.invoke(inputs)
+
+    return _updated(state, inputs, trimmed, updated_code)
+
+
+async def areflect(state: GraphState):
+    """
+    Reflect on errors, asynchronously
+
+    Args:
+        state (dict): The current graph state
+
+    Returns:
+        state (dict): New key added to state, generation
+    """
+
+    print("---UPDATING CODE SOLUTION---")
+
+    # The first retrieval loads the documentation index from disk
+    if _update_mode(state) == FUNCTIONS:
+        inputs, trimmed = await asyncio.to_thread(_prepare_functions, state)
+        patches = await code_functions_chain.ainvoke(inputs)
+        try:
+            return _patched(state, inputs, trimmed, patches)
+        except PatchError as e:
+            state = _fall_back(state, inputs, patches, e)
+
+    inputs, trimmed = await asyncio.to_thread(_prepare, state)
+    updated_code = await code_update_chain.ainvoke(inputs)
+
+    return _updated(state, inputs, trimmed, updated_code)
+
+
+def _update_mode(state: GraphState) -> str:
+    mode = state.get("update_mode") or Config.UPDATE_MODE
+    if mode != AUTO:
+        return mode
+    # Rewriting a short contract costs little more than patching it, and avoids a failed splice
+    return FUNCTIONS if count_tokens(state["existing_contract"]) >= Config.UPDATE_FUNCTIONS_MIN_TOKENS else FULL
+
+
+def _prepare(state: GraphState):
     # State
     existing_contract = state["existing_contract"]
     prompt = state["prompt"]
     error = state["error"]
     error_message = state["error_message"]
 
+    # Pick the documentation sections relevant to the feedback and its compiler errors
+    context = retrieve_context(prompt, error_message if error == "yes" else "")
+
+    diagnostics = None
     if error == "yes":
         print("---REGENERATING CODE SOLUTION---")
-        prompt += error_message
+        diagnostics = state.get("diagnostics") or []
+        if state.get("contract"):
+            # The diagnostics point into the contract that failed to compile, so fix that one
+            existing_contract = state["contract"]
+            prompt += "\n ----- \nThis feedback has already been applied to the contract above."
+
+    def build(context: str, errors: int):
+        retry = retry_message(format_for_prompt(diagnostics, errors)) if diagnostics is not None else ""
+        return {"context": context, "prompt": prompt + retry, "existing_contract": existing_contract}
+
+    return fit_prompt("reflect", code_update_chain, build, context, diagnostics)
+
+
+def _prepare_functions(state: GraphState):
+    prompt = state["prompt"]
+    error = state.get("error")
+    diagnostics = (state.get("diagnostics") or []) if error == "yes" else None
+
+    context = retrieve_context(prompt, format_for_prompt(diagnostics) if diagnostics is not None else "")
+
+    if diagnostics is not None and state.get("contract"):
+        # Patch the contract that failed to compile rather than redo the feedback on the original
+        print("---PATCHING CODE SOLUTION---")
+
+        def build(context: str, errors: int):
+            return {
+                "context": context,
+                "prompt": (
+                    f"{prompt}\n ----- \n"
+                    "This feedback has already been applied to the contract above, but it fails to compile with "
+                    f"these errors:\n\n{format_for_prompt(diagnostics, errors)}\n"
+                    "\n ----- \n"
+                    "Return only the functions that fix these errors."
+                ),
+                "existing_contract": state["contract"],
+            }
+
+        return fit_prompt("reflect", code_functions_chain, build, context, diagnostics)
+
+    def build(context: str, errors: int):
+        return {"context": context, "prompt": prompt, "existing_contract": state["existing_contract"]}
+
+    return fit_prompt("reflect", code_functions_chain, build, context)
+
+
+def _patched(state: GraphState, inputs, trimmed, patches):
+    contract = apply_patches(inputs["existing_contract"], patches.functions)
+    metrics.incr("update_rounds", mode=FUNCTIONS)
+    print(f"---SPLICED {len(patches.functions)} FUNCTION PATCHES---")
+
+    return {
+        "prompt_trimmed": trimmed,
+        "contract": contract,
+        "compiler_version": patches.solVersion,
+        "patches": [
+            {"action": patch.action, "function_name": patch.function_name, "description": patch.description}
+            for patch in patches.functions
+        ],
+        "iterations": (state.get("iterations") or 0) + 1,
+        "tokens_used": (state.get("tokens_used") or 0) + _patch_tokens(inputs, patches),
+    }
+
+
+def _fall_back(state: GraphState, inputs, patches, error: PatchError) -> GraphState:
+    logger.warning(f"Could not splice the function patches, rewriting the whole contract: {error}")
+    metrics.incr("update_patch_failures")
+
+    # The patch call still counts against the retry budget
+    return {**state, "tokens_used": (state.get("tokens_used") or 0) + _patch_tokens(inputs, patches)}
+
+
+def _patch_tokens(inputs, patches) -> int:
+    return call_tokens(code_functions_chain, inputs, json.dumps([patch.dict() for patch in patches.functions]))
 
-    updated_code = code_update_chain.invoke(
-        {"context": concatenated_content, "prompt": prompt, "existing_contract": existing_contract}
-    )
 
+def _updated(state: GraphState, inputs, trimmed, updated_code):
+    metrics.incr("update_rounds", mode=FULL)
     return {
+        "prompt_trimmed": trimmed,
         "contract": updated_code.contract,
         "compiler_version": updated_code.solVersion,
+        "patches": None,
+        "iterations": (state.get("iterations") or 0) + 1,
+        "tokens_used": (state.get("tokens_used") or 0) + call_tokens(code_update_chain, inputs, updated_code.contract),
     }
@@ -0,0 +1,142 @@
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from app.gen_smart_contract.common import (
+    classify_contract_chain,
+    code_functions_chain,
+    code_gen_chain,
+    code_update_chain,
+    documentation_gen_chain,
+)
+from app.gen_smart_contract.diagnostics import prompt_error_count
+from app.gen_smart_contract.docs_index import SECTION_SEPARATOR
+from app.gen_smart_contract.metrics import metrics
+from app.gen_smart_contract.tokens import count_tokens
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+class PromptTooLarge(Exception):
+    """
+    Raised when a prompt exceeds the token budget of its node even with every
+    part that can be trimmed cut.
+    """
+
+    def __init__(self, node: str, tokens: int, budget: int):
+        super().__init__(
+            f"The {node} prompt needs {tokens} tokens, more than its budget of {budget}. "
+            "Shorten the description or the contract."
+        )
+        self.node = node
+        self.tokens = tokens
+        self.budget = budget
+
+
+def prompt_budget(node: str) -> int:
+    """
+    The prompt token budget of a node, 0 if it has none.
+    """
+    return int(Config.PROMPT_TOKEN_BUDGETS.get(node) or 0)
+
+
+def fit_prompt(node: str, chain, build: Callable[[str, int], Dict[str, Any]], context: str = "",
+               diagnostics: Optional[List[dict]] = None) -> Tuple[Dict[str, Any], Optional[Dict[str, int]]]:
+    """
+    Build the inputs of a chain call within the prompt token budget of its node.
+    While the rendered prompt is over budget, the lower-priority parts are cut:
+    first the documentation sections, from the least relevant, then the compiler
+    errors, from the last reported, keeping the first.
+
+    Args:
+        node (str): The node making the call, whose budget applies
+        chain (StructuredChain): The chain the inputs are for
+        build (callable): Builds the inputs from a documentation context and the number of compiler errors to include
+        context (str): The documentation context, its sections in order of priority
+        diagnostics (list): The compiler diagnostics the prompt reports, if it retries a contract
+
+    Returns:
+        tuple: The inputs, and what was cut from them, None if nothing was
+
+    Raises:
+        PromptTooLarge: If the prompt is over budget with all documentation and all but one error cut
+    """
+    sections = context.split(SECTION_SEPARATOR) if context else []
+    errors = prompt_error_count(diagnostics or [])
+
+    inputs = build(context, errors)
+    budget = prompt_budget(node)
+    if not budget:
+        return inputs, None
+
+    tokens = initial_tokens = chain.prompt_tokens(inputs)
+    kept_sections, kept_errors = len(sections), errors
+
+    while tokens > budget and kept_sections > 0:
+        # Cut enough of the least relevant sections to cover the excess, then measure again
+        excess = tokens - budget
+        while excess > 0 and kept_sections > 0:
+            kept_sections -= 1
+            excess -= count_tokens(sections[kept_sections])
+        inputs = build(SECTION_SEPARATOR.join(sections[:kept_sections]), kept_errors)
+        tokens = chain.prompt_tokens(inputs)
+
+    while tokens > budget and kept_errors > 1:
+        kept_errors -= 1
+        inputs = build(SECTION_SEPARATOR.join(sections[:kept_sections]), kept_errors)
+        tokens = chain.prompt_tokens(inputs)
+
+    if tokens > budget:
+        metrics.incr("prompt_rejected", node=node)
+        raise PromptTooLarge(node, tokens, budget)
+
+    if tokens == initial_tokens:
+        return inputs, None
+
+    trimmed = {
+        "budget": budget,
+        "prompt_tokens": initial_tokens,
+        "trimmed_tokens": initial_tokens - tokens,
+        "docs_sections": len(sections) - kept_sections,
+        "errors": errors - kept_errors,
+    }
+    logger.warning(f"Trimmed the {node} prompt to fit its budget: {trimmed}")
+    metrics.incr("prompt_trims", node=node)
+    metrics.incr("prompt_trimmed_tokens", trimmed["trimmed_tokens"], node=node)
+    return inputs, trimmed
+
+
+def check_prompt(node: str, chain, inputs: Dict[str, Any]):
+    """
+    Check a prompt without parts that can be trimmed against the budget of its node.
+
+    Raises:
+        PromptTooLarge: If the prompt is over budget
+    """
+    fit_prompt(node, chain, lambda context, errors: inputs)
+
+
+def check_request(prompt: str, existing_contract: Optional[str] = None):
+    """
+    Check that the description and contract of a request, which are never trimmed,
+    fit the budgets of the nodes that will send them, so that a request that cannot
+    succeed is rejected before any LLM call.
+
+    Args:
+        prompt (str): The description of a generation or the feedback of an update
+        existing_contract (str): The contract to update, None for a generation
+
+    Raises:
+        PromptTooLarge: If a prompt of the run is over budget without any documentation
+    """
+    if existing_contract is None:
+        check_prompt("classify", classify_contract_chain, {"prompt": prompt})
+        check_prompt("generate", code_gen_chain, {"context": "", "prompt": prompt, "requirements": []})
+        return
+
+    inputs = {"context": "", "prompt": prompt, "existing_contract": existing_contract}
+    # The run rewrites the contract or patches its functions, the smaller prompt must fit
+    chain = min((code_update_chain, code_functions_chain), key=lambda c: c.prompt_tokens(inputs))
+    check_prompt("reflect", chain, inputs)
+    # The updated contract will be about as long as the existing one
+    check_prompt("document", documentation_gen_chain, {"contract": existing_contract})
@@ -1,25 +1,14 @@
 from langchain_core.prompts import ChatPromptTemplate
 
+# The instructions and the documentation come first and the request last, so that the prompts of different
+# requests share a byte-identical prefix that the provider can serve from its prompt cache
 code_gen_prompt = ChatPromptTemplate.from_messages(
     [
         (
             "system",
-            """You are an expert in Solidity smart contracts. \n Based on the following requirements, generate a detailed and fully functional smart contract. \n
+            """You are an expert in Solidity smart contracts. \n Based on the requirements and user prompt at the end, generate a detailed and fully functional smart contract. \n
 
-Here is a full set of Solidity documentation:  
-    \n ------- \n
-    {context}  
-    \n ------- \n
-
-    Requirements: {requirements}
-
-    \n ------- \n
-
-    User prompt: {prompt}
-    
-    \n ------- \n
-
-    Now, generate a smart contract based on the provided requirements. The code should include:
+    The code should include:
     - SPDX-License-Identifier and pragma statements.
     - Necessary imports.
     - Contract definition and state variables.
@@ -39,6 +28,27 @@ Here is a full set of Solidity documentation:
     }} 
 
     """,
-        )
+        ),
+        (
+            "system",
+            """Here is the relevant Solidity documentation:  
+    \n ------- \n
+    {context}  
+    \n ------- \n
+    """,
+        ),
+        (
+            "human",
+            """Requirements: {requirements}
+
+    \n ------- \n
+
+    User prompt: {prompt}
+    
+    \n ------- \n
+
+    Now, generate a smart contract based on the provided requirements.
+    """,
+        ),
     ]
 )
@@ -1,26 +1,13 @@
 from langchain_core.prompts import ChatPromptTemplate
 
+# Laid out like code_gen_prompt: instructions, documentation, then the contract and feedback of the request
 update_contract_prompt = ChatPromptTemplate.from_messages(
     [
         (
             "system",
-            """You are an expert in Solidity smart contracts. \n Based on the following context, existing code, and user feedback, update the smart contract accordingly.  \n
+            """You are an expert in Solidity smart contracts. \n Based on the documentation, existing code, and user feedback that follow, update the smart contract accordingly.  \n
 
-Here is a full set of Solidity documentation:  
-    \n ------- \n
-    {context}  
-    \n ------- \n
-
-    Existing Contract
-    \n ------- \n
-    {existing_contract}
-    \n ------- \n
-    
-    \n ------- \n
-    User Feedback: {prompt}
-    \n ------- \n
-
-    Now, generate a smart contract based on the provided requirements. The code should include:
+    The updated code should include:
     - SPDX-License-Identifier and pragma statements.
     - Necessary imports.
     - Contract definition and state variables.
@@ -33,6 +20,28 @@ Here is a full set of Solidity documentation:
     - Avoid current security vulnerabilities as stated in the documentation.
 
     """,
-        )
+        ),
+        (
+            "system",
+            """Here is the relevant Solidity documentation:  
+    \n ------- \n
+    {context}  
+    \n ------- \n
+    """,
+        ),
+        (
+            "human",
+            """Existing Contract
+    \n ------- \n
+    {existing_contract}
+    \n ------- \n
+    
+    \n ------- \n
+    User Feedback: {prompt}
+    \n ------- \n
+
+    Now, generate a smart contract based on the provided feedback.
+    """,
+        ),
     ]
 )
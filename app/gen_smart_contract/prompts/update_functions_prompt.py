@@ -0,0 +1,41 @@
+from langchain_core.prompts import ChatPromptTemplate
+
+# Laid out like code_gen_prompt: instructions, documentation, then the contract and feedback of the request
+update_functions_prompt = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """You are an expert in Solidity smart contracts. \n Based on the documentation, existing code, and user feedback that follow, update the smart contract accordingly.  \n
+
+    Do not return the whole contract. Return only the functions that have to change, as patches that are spliced into the existing contract:
+    - "replace": the full new code of an existing function, with its comments. Name it by its signature, such as "transfer(address,uint256)", if it is overloaded.
+    - "add": the full code of a new function. State variables, events, errors and modifiers the change needs are added the same way, one per patch.
+    - "delete": an existing function to remove, with empty code.
+    - The same actions apply to the constructor, modifiers, events and state variables, named by their name.
+    - Leave every other part of the contract out of the response; it stays as it is.
+    - Avoid current security vulnerabilities as stated in the documentation.
+
+    """,
+        ),
+        (
+            "system",
+            """Here is the relevant Solidity documentation:  
+    \n ------- \n
+    {context}  
+    \n ------- \n
+    """,
+        ),
+        (
+            "human",
+            """Existing Contract
+    \n ------- \n
+    {existing_contract}
+    \n ------- \n
+    
+    \n ------- \n
+    User Feedback: {prompt}
+    \n ------- \n
+    """,
+        ),
+    ]
+)
@@ -0,0 +1,146 @@
+import hashlib
+import json
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional
+
+from app.gen_smart_contract.metrics import metrics
+from app.gen_smart_contract.state import GraphState
+from app.gen_smart_contract.tokens import count_tokens
+from config import Config
+
+MAX_ITERATIONS = "max_iterations"
+DEADLINE = "deadline"
+TOKEN_BUDGET = "token_budget"
+GENERATION_BUDGET = "generation_budget"
+REPEATED_DIAGNOSTICS = "repeated_diagnostics"
+REPEATED_CONTRACT = "repeated_contract"
+
+
+def _signature(value: Any) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def diagnostics_signature(diagnostics: List[dict]) -> str:
+    """
+    Identify a set of compiler errors independently of where they are reported, so
+    that the same errors at shifted lines still count as a repeated failure.
+    """
+    errors = sorted(
+        (d.get("type") or "", d.get("code") or "", d["message"]) for d in diagnostics if d["severity"] == "error"
+    )
+    return _signature(errors)
+
+
+def contract_signature(contract: str) -> str:
+    return _signature(contract.strip())
+
+
+def call_tokens(chain, inputs: Dict[str, Any], output: str, calls: int = 1) -> int:
+    """
+    Estimate the tokens of `calls` chain invocations with the same inputs, one of
+    which answered with `output`.
+    """
+    return calls * chain.prompt_tokens(inputs) + count_tokens(output)
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """
+    Decides when the generate and update workflows stop retrying a contract that
+    does not compile.
+
+    A run stops after `max_iterations` generation rounds, once `deadline_seconds`
+    have passed since it started or `token_budget` tokens have been spent in the
+    retry loop, once `max_generations` code generation calls counting every
+    finished speculative candidate were made, or as soon as a round changes nothing: the
+    model returned the previous contract again, or the compiler reported the same
+    errors twice in a row. A budget of 0 is unlimited.
+    """
+
+    max_iterations: int
+    deadline_seconds: float
+    token_budget: int
+    max_generations: int = 0
+
+    @classmethod
+    def from_config(cls) -> "RetryPolicy":
+        return cls(
+            max_iterations=Config.RETRY_MAX_ITERATIONS,
+            deadline_seconds=Config.RETRY_DEADLINE_SECONDS,
+            token_budget=Config.RETRY_TOKEN_BUDGET,
+            max_generations=Config.SPECULATIVE_MAX_GENERATIONS,
+        )
+
+    def stop_reason(self, state: GraphState, repeated: Optional[str] = None) -> Optional[str]:
+        """
+        Args:
+            state (dict): The graph state after a generation round
+            repeated (str): REPEATED_CONTRACT or REPEATED_DIAGNOSTICS if the round changed nothing
+
+        Returns:
+            str: Why the run must not retry again, None while it may
+        """
+        if repeated:
+            return repeated
+        if self.max_iterations and (state.get("iterations") or 0) >= self.max_iterations:
+            return MAX_ITERATIONS
+        if self.deadline_seconds and self.elapsed(state) >= self.deadline_seconds:
+            return DEADLINE
+        if self.token_budget and (state.get("tokens_used") or 0) >= self.token_budget:
+            return TOKEN_BUDGET
+        if self.max_generations and (state.get("generations") or 0) >= self.max_generations:
+            return GENERATION_BUDGET
+        return None
+
+    @staticmethod
+    def elapsed(state: GraphState) -> float:
+        started_at = state.get("started_at")
+        return time.time() - started_at if started_at else 0.0
+
+    def check(self, state: GraphState, contract: str, error: str, diagnostics: List[dict]) -> Dict[str, Any]:
+        """
+        Record the outcome of a compilation and work out how much of the budget the
+        run has used.
+
+        Args:
+            state (dict): The graph state before the compilation
+            contract (str): The compiled contract
+            error (str): "yes" if it failed to compile
+            diagnostics (list): The compiler diagnostics
+
+        Returns:
+            state (dict): The new signatures and the retry_budget report
+        """
+        contract_sig = contract_signature(contract)
+        diagnostics_sig = diagnostics_signature(diagnostics) if error == "yes" else None
+
+        repeated = None
+        if error == "yes" and state.get("error") == "yes":
+            if contract_sig == state.get("contract_signature"):
+                repeated = REPEATED_CONTRACT
+            elif diagnostics_sig == state.get("diagnostics_signature"):
+                repeated = REPEATED_DIAGNOSTICS
+
+        stop_reason = self.stop_reason(state, repeated) if error == "yes" else None
+        if stop_reason:
+            metrics.incr("retry_budget_exhausted", reason=stop_reason)
+
+        return {
+            "contract_signature": contract_sig,
+            "diagnostics_signature": diagnostics_sig,
+            "retry_budget": {
+                "iterations": state.get("iterations") or 0,
+                "max_iterations": self.max_iterations,
+                "elapsed_seconds": round(self.elapsed(state), 3),
+                "deadline_seconds": self.deadline_seconds,
+                "tokens_used": state.get("tokens_used") or 0,
+                "token_budget": self.token_budget,
+                "generations": state.get("generations") or 0,
+                "max_generations": self.max_generations,
+                "stop_reason": stop_reason,
+            },
+        }
+
+
+retry_policy = RetryPolicy.from_config()
@@ -0,0 +1,50 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import dataclass
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, Optional
+
+from app.gen_smart_contract.cancellation import CancelToken
+
+if TYPE_CHECKING:
+    from app.gen_smart_contract.instrumentation import RunStats
+    from app.gen_smart_contract.user_clients import UserLLMClients
+
+
+@dataclass
+class RunContext:
+    """
+    Per-request options that apply to every chain invocation of a workflow run.
+
+    Attributes:
+        cache_bypass: Skip cached LLM responses and refresh them with new ones.
+        token_sink: Receives the token deltas of streamed chain outputs, if the client asked for them.
+        cancel_token: Cancels the LLM calls and compilations of the run, e.g. when its client disconnects.
+        stats: Collects the time, tokens and cost of the run's nodes and LLM calls for its run_summary.
+        llm_clients: The clients of the user's own OpenAI API key, None to call the models with the app's key.
+    """
+
+    cache_bypass: bool = False
+    token_sink: Optional[Callable[[Dict[str, Any]], None]] = None
+    cancel_token: Optional[CancelToken] = None
+    stats: Optional["RunStats"] = None
+    llm_clients: Optional["UserLLMClients"] = None
+
+
+_current: ContextVar[RunContext] = ContextVar("run_context", default=RunContext())
+
+
+def current_run_context() -> RunContext:
+    return _current.get()
+
+
+@contextmanager
+def run_context(context: RunContext) -> Iterator[RunContext]:
+    """
+    Make the given context current for the duration of the block. LangGraph copies
+    the context into the threads that run the workflow nodes, so the nodes see it too.
+    """
+    token = _current.set(context)
+    try:
+        yield context
+    finally:
+        _current.reset(token)
@@ -19,3 +19,10 @@ class functionModel(BaseModel):
     function_name: str = Field(description="Name of the function")
     code: str = Field(description="Full code of the function")
     description: str = Field(description="Description of the function")
+    action: str = Field(default="replace", description='"replace", "add" or "delete"')
+    contract_name: str = Field(default="", description="Contract declaring the function, if the file has several")
+
+
+class updateFunctionsModel(BaseModel):
+    functions: list[functionModel] = Field(description="Only the functions that were changed, added or deleted")
+    solVersion: str = Field(description="Solidity Compiler Version")
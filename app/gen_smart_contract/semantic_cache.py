@@ -0,0 +1,296 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the threads of one process share the index safely
+    fcntl = None
+
+from app.gen_smart_contract.embeddings import Embedder, build_embedder
+from app.gen_smart_contract.metrics import metrics
+from app.gen_smart_contract.state import GraphState
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+# Outcomes of a lookup, kept in the cache_status of the run state
+HIT = "hit"
+WARM = "warm"
+MISS = "miss"
+
+# The state keys of a finished generation that are cached
+RESULT_KEYS = ("contract", "compiler_version", "contract_type", "contract_requirements", "documentation", "abi",
+               "bytecode")
+
+# Seconds between saves of the entries used by lookups, so that a lookup does not rewrite the index
+TOUCH_FLUSH_SECONDS = 60
+
+
+def prompt_key(prompt: str) -> str:
+    """
+    Identifies a prompt regardless of case, whitespace and final punctuation, without keeping its text.
+    """
+    normalized = " ".join(prompt.lower().split()).rstrip(".!?")
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
+class SemanticCache:
+    """
+    Caches the results of finished generation runs under the embedding of their
+    prompt, so that a new prompt can be answered by the result of the same prompt,
+    or start from that of the most similar earlier one.
+
+    The embeddings are the rows of one NumPy matrix, so a lookup is a single
+    matrix-vector product. The prompts themselves are only kept as a hash of their
+    normalized text. Entries expire after `ttl` seconds and the least recently used
+    ones are evicted beyond `max_entries`. The index is saved to `path` after every
+    change, under a lock file shared by the processes using it, and reloaded when
+    another process changed it. The times lookups used entries are saved with the
+    next change, or by a lookup at most every TOUCH_FLUSH_SECONDS.
+    """
+
+    def __init__(self, embedder: Embedder, path: Optional[str], max_entries: int, ttl: float):
+        self.embedder = embedder
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._vectors: Optional[np.ndarray] = None
+        self._entries: List[Dict[str, Any]] = []
+        self._mtime: Optional[float] = None
+        # When lookups last used entries, by prompt key, not saved yet
+        self._touched: Dict[str, float] = {}
+        self._flushed_at = time.monotonic()
+
+    def lookup(self, prompt: str, min_similarity: float = 0.0) -> Optional[Tuple[float, bool, Dict[str, Any]]]:
+        """
+        Find the cached result of the same prompt, or else of the most similar one.
+
+        Args:
+            prompt (str): The prompt of the new run
+            min_similarity (float): The similarity below which a result is not used, and so not marked as used
+
+        Returns:
+            tuple: The similarity of the cached prompt, whether it is the same prompt, and its result, None if
+                the cache is empty
+        """
+        key = prompt_key(prompt)
+        query = self.embedder.embed([prompt])[0]
+
+        with self._lock:
+            self._refresh()
+            self._expire()
+            if not self._entries:
+                return None
+
+            similarities = self._vectors @ query
+            same = [i for i, entry in enumerate(self._entries) if entry["key"] == key]
+            best = same[0] if same else int(np.argmax(similarities))
+            similarity, used = float(similarities[best]), self._entries[best]
+            result = dict(used["result"])
+
+            if same or similarity >= min_similarity:
+                self._touched[used["key"]] = time.time()
+            flush = bool(self._touched) and time.monotonic() - self._flushed_at >= TOUCH_FLUSH_SECONDS
+
+        if flush:
+            self.flush()
+        return similarity, bool(same), result
+
+    def put(self, prompt: str, result: Dict[str, Any]):
+        key = prompt_key(prompt)
+        vector = self.embedder.embed([prompt])[0]
+        now = time.time()
+        entry = {"key": key, "result": result, "created_at": now, "last_used_at": now}
+
+        with self._locked():
+            self._refresh()
+            self._expire()
+            self._apply_touches()
+
+            same = [i for i, e in enumerate(self._entries) if e["key"] == key]
+            if same:
+                self._vectors[same[0]] = vector
+                self._entries[same[0]] = entry
+            else:
+                self._vectors = vector[None, :] if self._vectors is None else np.vstack([self._vectors, vector])
+                self._entries.append(entry)
+
+            if len(self._entries) > self.max_entries:
+                recent = np.argsort([-e["last_used_at"] for e in self._entries], kind="stable")[:self.max_entries]
+                self._keep(np.sort(recent))
+
+            self._save()
+
+    def clear(self):
+        with self._locked():
+            self._vectors, self._entries = None, []
+            self._save()
+
+    def flush(self):
+        """
+        Save when lookups used entries, so that every process evicts by the same recency.
+        """
+        with self._locked():
+            self._refresh()
+            if self._apply_touches():
+                self._save()
+            self._flushed_at = time.monotonic()
+
+    def _apply_touches(self) -> bool:
+        touched, self._touched = self._touched, {}
+        changed = False
+        for entry in self._entries:
+            used_at = touched.get(entry["key"])
+            if used_at is not None and used_at > entry["last_used_at"]:
+                entry["last_used_at"] = used_at
+                changed = True
+        return changed
+
+    @contextmanager
+    def _locked(self) -> Iterator[None]:
+        """
+        Hold the lock of this process and, with a path, the lock file of the index, so
+        that processes changing it at the same time do not drop each other's changes.
+        """
+        with self._lock:
+            if not self.path or fcntl is None:
+                yield
+                return
+
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(f"{self.path}.lock", "a") as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def __len__(self) -> int:
+        with self._lock:
+            self._refresh()
+            return len(self._entries)
+
+    def _keep(self, rows):
+        self._entries = [self._entries[i] for i in rows]
+        self._vectors = self._vectors[rows] if len(rows) else None
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        if any(e["created_at"] < cutoff for e in self._entries):
+            self._keep(np.array([i for i, e in enumerate(self._entries) if e["created_at"] >= cutoff], dtype=int))
+
+    def _refresh(self):
+        if not self.path:
+            return
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            return
+        if mtime == self._mtime:
+            return
+
+        self._mtime = mtime
+        try:
+            arrays = np.load(self.path)
+            if str(arrays["embedder"]) != self.embedder.name:
+                logger.info(f"Ignoring the semantic cache at {self.path}, built by another embedder")
+                return
+            entries = json.loads(str(arrays["entries"]))
+            for entry in entries:
+                # Indexes saved before prompts were hashed keep their text
+                if "key" not in entry:
+                    entry["key"] = prompt_key(entry.pop("prompt", ""))
+            self._vectors = arrays["vectors"] if entries else None
+            self._entries = entries
+        except Exception as e:
+            logger.warning(f"Could not load the semantic cache: {e}")
+
+    def _save(self):
+        if not self.path:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            # np.savez appends .npz to paths without it, so write to a temporary name that already has it
+            temporary = f"{self.path}.{os.getpid()}.tmp.npz"
+            np.savez_compressed(
+                temporary,
+                embedder=np.array(self.embedder.name),
+                vectors=self._vectors if self._vectors is not None else np.zeros((0, 0), dtype=np.float32),
+                entries=np.array(json.dumps(self._entries)),
+            )
+            os.replace(temporary, self.path)
+            self._mtime = os.stat(self.path).st_mtime
+        except OSError as e:
+            logger.warning(f"Could not save the semantic cache: {e}")
+
+
+def build_semantic_cache() -> Optional[SemanticCache]:
+    """
+    Build the cache of generation results, or None unless SEMANTIC_CACHE_ENABLED is on.
+    """
+    if not Config.SEMANTIC_CACHE_ENABLED:
+        return None
+
+    try:
+        embedder = build_embedder(Config.SEMANTIC_CACHE_EMBEDDER)
+    except Exception as e:
+        logger.warning(f"Semantic cache disabled, embedder {Config.SEMANTIC_CACHE_EMBEDDER} unavailable: {e}")
+        return None
+
+    return SemanticCache(embedder, Config.SEMANTIC_CACHE_PATH, Config.SEMANTIC_CACHE_MAX_ENTRIES,
+                         Config.SEMANTIC_CACHE_TTL_SECONDS)
+
+
+semantic_cache = build_semantic_cache()
+
+
+def find_result(prompt: str) -> Tuple[str, float, Optional[Dict[str, Any]]]:
+    """
+    Look up the cached result for a prompt.
+
+    Only the same prompt, up to case, whitespace and final punctuation, is answered with the cached
+    result. Similar prompts can differ in what matters, such as which party holds a
+    role, so their results only warm-start the generation.
+
+    Returns:
+        tuple: HIT, WARM or MISS, the similarity, and the cached result unless it is a MISS
+    """
+    match = semantic_cache.lookup(prompt, Config.SEMANTIC_CACHE_WARM_THRESHOLD) if semantic_cache is not None else None
+    if match is None:
+        status, similarity, result = MISS, 0.0, None
+    else:
+        similarity, same, result = match
+        if same:
+            status = HIT
+        elif similarity >= Config.SEMANTIC_CACHE_WARM_THRESHOLD:
+            status = WARM
+        else:
+            status, result = MISS, None
+
+    metrics.incr("semantic_cache_lookups", result=status)
+    return status, similarity, result
+
+
+def remember_result(state: GraphState, documentation: Optional[str] = None):
+    """
+    Cache the result of a generation run that compiled. Runs that were answered from
+    the cache, or that did not look it up, such as updates, are not stored.
+    """
+    if semantic_cache is None or state.get("cache_status") not in (MISS, WARM) or state.get("error") != "no":
+        return
+
+    result = {key: state.get(key) for key in RESULT_KEYS}
+    result["documentation"] = documentation
+    try:
+        semantic_cache.put(state["prompt"], result)
+    except Exception as e:
+        logger.warning(f"Could not cache the generation result: {e}")
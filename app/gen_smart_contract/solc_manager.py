@@ -0,0 +1,245 @@
+import logging
+import re
+import shutil
+import stat
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, List, Optional
+
+import solcx
+from solcx.install import get_executable
+from packaging.version import InvalidVersion, Version
+
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+_PRAGMA_PATTERN = re.compile(r"pragma\s+solidity\s+([^;]+);")
+_CONSTRAINT_PATTERN = re.compile(r"(\^|~|>=|<=|>|<|=)?\s*v?(\d+(?:\.(?:\d+|x|\*)){0,2})")
+
+
+class SolcVersionUnavailable(Exception):
+    """Raised when no installed solc binary satisfies the requested version."""
+
+
+def parse_version(value: str) -> Optional[Version]:
+    """
+    Parse an exact solc version such as "0.8.26" or "v0.8.26".
+
+    Returns:
+        Version: The parsed version, or None if the value is not an exact version
+    """
+    value = value.strip().lstrip("v")
+    if not re.fullmatch(r"\d+\.\d+\.\d+", value):
+        return None
+    try:
+        return Version(value)
+    except InvalidVersion:
+        return None
+
+
+def _constraint_matches(version: Version, operator: str, target: str) -> bool:
+    parts = target.split(".")
+    wildcard = len(parts) < 3 or any(p in ("x", "*") for p in parts)
+    numbers = [int(p) for p in parts if p not in ("x", "*")]
+    major, minor, patch = (numbers + [0, 0, 0])[:3]
+    base = (major, minor, patch)
+    current = (version.major, version.minor, version.micro)
+
+    if operator == "^":
+        if major > 0:
+            upper = (major + 1, 0, 0)
+        elif minor > 0 or len(numbers) < 3:
+            upper = (0, minor + 1, 0)
+        else:
+            upper = (0, 0, patch + 1)
+        return base <= current < upper
+    if operator == "~":
+        return base <= current < (major, minor + 1, 0)
+    if operator == ">=":
+        return current >= base
+    if operator == "<=":
+        return current <= base
+    if operator == ">":
+        return current > base
+    if operator == "<":
+        return current < base
+
+    # A bare or "=" version; partial versions such as 0.8 or 0.8.x match any patch
+    if wildcard:
+        return current[:len(numbers)] == tuple(numbers)
+    return current == base
+
+
+def satisfies(version: Version, spec: str) -> bool:
+    """
+    Check a version against a Solidity pragma range, e.g. "^0.8.0" or ">=0.8.0 <0.9.0".
+
+    Args:
+        version (Version): The version to check
+        spec (str): The pragma range
+
+    Returns:
+        bool: True if the version is inside the range
+    """
+    for alternative in spec.split("||"):
+        constraints = _CONSTRAINT_PATTERN.findall(alternative)
+        if constraints and all(_constraint_matches(version, op, target) for op, target in constraints):
+            return True
+    return False
+
+
+def source_pragma(source: str) -> Optional[str]:
+    match = _PRAGMA_PATTERN.search(source or "")
+    return match.group(1).strip() if match else None
+
+
+class SolcManager:
+    """
+    An in-memory registry of the installed solc binaries.
+
+    The install folder is scanned once; afterwards versions and pragma ranges are
+    resolved against the registry without touching the filesystem or the network.
+    Compilers are downloaded only by prefetch(), which is meant to run at deploy
+    time. The first scan copies the configured versions from SOLC_MIRROR_DIR, a
+    local directory, so that hosts with a read-only app directory can ship them.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._binaries: Optional[Dict[Version, Path]] = None
+
+    @property
+    def installed(self) -> List[Version]:
+        return sorted(self._registry(), reverse=True)
+
+    def _registry(self) -> Dict[Version, Path]:
+        if self._binaries is None:
+            with self._lock:
+                if self._binaries is None:
+                    self._binaries = self._scan()
+        return self._binaries
+
+    def _scan(self) -> Dict[Version, Path]:
+        if Config.SOLC_MIRROR_DIR:
+            try:
+                self._import_from_mirror(Config.SOLC_VERSIONS, Config.SOLC_MIRROR_DIR)
+            except OSError as e:
+                logger.error(f"Copying solc from {Config.SOLC_MIRROR_DIR} failed: {e}")
+
+        binaries = {}
+        for version in solcx.get_installed_solc_versions():
+            try:
+                binaries[version] = get_executable(version)
+            except solcx.exceptions.SolcNotInstalled:
+                continue
+
+        logger.info(f"Installed solc versions: {', '.join(str(v) for v in sorted(binaries)) or 'none'}")
+        return binaries
+
+    def reload(self):
+        with self._lock:
+            self._binaries = self._scan()
+
+    def _import_from_mirror(self, versions: Iterable[str], mirror_dir: str) -> List[Version]:
+        install_folder = solcx.get_solcx_install_folder()
+        install_folder.mkdir(parents=True, exist_ok=True)
+
+        imported = []
+        for value in versions:
+            version = parse_version(value)
+            if version is None:
+                continue
+
+            target = install_folder / f"solc-v{version}"
+            source = Path(mirror_dir) / f"solc-v{version}"
+            if target.exists() or not source.exists():
+                continue
+
+            shutil.copy2(source, target)
+            target.chmod(target.stat().st_mode | stat.S_IEXEC)
+            imported.append(version)
+
+        return imported
+
+    def prefetch(self, versions: Iterable[str], mirror_dir: Optional[str] = None) -> List[Version]:
+        """
+        Install the given solc versions, copying them from a local mirror directory
+        when available and downloading them otherwise.
+
+        Args:
+            versions (list): The exact solc versions to install
+            mirror_dir (str, optional): A directory holding solc-v<version> binaries
+
+        Returns:
+            list: The versions that are installed afterwards
+        """
+        versions = list(versions)
+        if mirror_dir:
+            self._import_from_mirror(versions, mirror_dir)
+
+        self._install(versions)
+        self.reload()
+        return self.installed
+
+    @staticmethod
+    def _install(versions: Iterable[str]):
+        installed = set(solcx.get_installed_solc_versions())
+        for value in versions:
+            version = parse_version(value)
+            if version is None:
+                raise SolcVersionUnavailable(f"{value} is not an exact solc version")
+            if version not in installed:
+                logger.info(f"Installing solc {version}")
+                solcx.install_solc(version)
+
+    def resolve(self, requested: Optional[str], source: Optional[str] = None) -> Version:
+        """
+        Resolve a requested version or pragma range to an installed solc version.
+
+        The requested value is tried as an exact version and then as a range. If
+        neither is installed, the pragma of the source decides, and as a last resort
+        the newest installed version of the same minor release is used when
+        SOLC_VERSION_FALLBACK is enabled.
+
+        Args:
+            requested (str): The solc version or pragma range, e.g. "0.8.26" or "^0.8.0"
+            source (str, optional): The Solidity source, used for its pragma
+
+        Returns:
+            Version: The installed version to compile with
+
+        Raises:
+            SolcVersionUnavailable: If no installed version is suitable
+        """
+        installed = self.installed
+        requested = (requested or "").strip()
+
+        exact = parse_version(requested) if requested else None
+        if exact is not None and exact in self._registry():
+            return exact
+
+        specs = [s for s in (requested if exact is None else None, source_pragma(source)) if s]
+        for spec in specs:
+            for version in installed:
+                if satisfies(version, spec):
+                    return version
+
+        if Config.SOLC_VERSION_FALLBACK and exact is not None:
+            for version in installed:
+                if (version.major, version.minor) == (exact.major, exact.minor):
+                    return version
+
+        raise SolcVersionUnavailable(
+            f"No installed solc version satisfies '{requested or source_pragma(source)}'. "
+            f"Installed versions: {', '.join(str(v) for v in installed) or 'none'}"
+        )
+
+    def executable(self, version: Version) -> Path:
+        try:
+            return self._registry()[version]
+        except KeyError:
+            raise SolcVersionUnavailable(f"solc {version} is not installed")
+
+
+solc_manager = SolcManager()
@@ -0,0 +1,152 @@
+import contextvars
+import dataclasses
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from app.gen_smart_contract.cancellation import CancelToken
+from app.gen_smart_contract.common import code_gen_candidate_chain, code_gen_chain
+from app.gen_smart_contract.compile_pool import CompileJob
+from app.gen_smart_contract.compiler import CompileResult, compile_contract
+from app.gen_smart_contract.metrics import metrics
+from app.gen_smart_contract.run_context import current_run_context, run_context
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def candidate_count(generations: int) -> int:
+    """
+    How many candidates the next generation round may ask for, keeping the run
+    within SPECULATIVE_MAX_GENERATIONS code generation calls (0 is unlimited). The
+    retry policy stops a run that used them all, so a round always has at least one.
+
+    Args:
+        generations (int): The code generation calls already made in this run
+
+    Returns:
+        int: The number of candidates to generate
+    """
+    if not Config.SPECULATIVE_MAX_GENERATIONS:
+        return max(1, Config.SPECULATIVE_CANDIDATES)
+    remaining = Config.SPECULATIVE_MAX_GENERATIONS - generations
+    return max(1, min(Config.SPECULATIVE_CANDIDATES, remaining))
+
+
+def candidate_temperatures(count: int) -> List[float]:
+    """
+    Spread the candidates from temperature 0, the cached deterministic answer,
+    up to SPECULATIVE_MAX_TEMPERATURE.
+    """
+    return [round(float(t), 2) for t in np.linspace(0, Config.SPECULATIVE_MAX_TEMPERATURE, count)]
+
+
+def _rank(candidate: Tuple[int, Any, Optional[CompileResult]]):
+    index, _, result = candidate
+    if result is None:
+        return 1, 0, index
+    errors = sum(1 for d in result.diagnostics if d["severity"] == "error")
+    return 0, errors, index
+
+
+def generate_candidates(inputs: Dict[str, Any], count: int) -> Tuple[Any, Optional[CompileResult], int]:
+    """
+    Generate `count` candidate contracts concurrently and compile each one as soon
+    as it arrives. The first candidate that compiles wins, and the LLM calls and
+    compilations of the others are cancelled. If none compiles, the candidate with the fewest
+    compiler errors is returned so that the retry loop can work on it.
+
+    Args:
+        inputs (dict): The code generation prompt inputs
+        count (int): The number of candidates
+
+    Returns:
+        tuple: The winning generateContractModel, its CompileResult, which is None
+            if the candidate could not be compiled here, and the number of code
+            generation calls that finished before the others were cancelled
+
+    Raises:
+        Exception: The error of the last candidate if every code generation call failed
+    """
+    done = threading.Event()
+    lock = threading.Lock()
+    jobs: List[CompileJob] = []
+    generated = 0
+    # Each candidate has its own token, so that the losers' calls can be aborted without cancelling the run
+    run_token = current_run_context().cancel_token
+    tokens = [CancelToken() for _ in range(count)]
+    unlinks = [run_token.on_cancel(token.cancel) for token in tokens] if run_token is not None else []
+
+    def track(job: CompileJob):
+        with lock:
+            jobs.append(job)
+        if done.is_set():
+            job.cancel()
+
+    def run(index: int, temperature: float):
+        nonlocal generated
+        chain = code_gen_chain if temperature == 0 else code_gen_candidate_chain(temperature)
+        context = dataclasses.replace(current_run_context(), cancel_token=tokens[index])
+        # Only the first candidate streams its tokens, so that the client sees a single contract
+        if index > 0:
+            context = dataclasses.replace(context, token_sink=None)
+        with run_context(context):
+            solution = chain.invoke(inputs)
+        with lock:
+            generated += 1
+        if done.is_set():
+            return index, solution, None
+
+        try:
+            result = compile_contract(solution.contract, solution.solVersion,
+                                      queue_wait=Config.COMPILE_NODE_QUEUE_WAIT_SECONDS, on_submit=track)
+        except Exception as e:
+            # Left to check_code, which reports it like any other compile failure
+            if not done.is_set():
+                logger.info(f"Candidate {index} could not be compiled: {e}")
+            result = None
+        return index, solution, result
+
+    metrics.incr("speculative_candidates", count)
+    executor = ThreadPoolExecutor(max_workers=count, thread_name_prefix="candidate")
+    futures = [
+        executor.submit(contextvars.copy_context().run, run, index, temperature)
+        for index, temperature in enumerate(candidate_temperatures(count))
+    ]
+
+    finished = []
+    failure = None
+    try:
+        for future in as_completed(futures):
+            try:
+                candidate = future.result()
+            except Exception as e:
+                logger.warning(f"Candidate generation failed: {e}")
+                failure = e
+                continue
+
+            index, solution, result = candidate
+            if result is not None and result.success:
+                metrics.incr("speculative_wins", candidate=index)
+                return solution, result, generated
+            finished.append(candidate)
+    finally:
+        done.set()
+        for token in tokens:
+            token.cancel()
+        for unlink in unlinks:
+            unlink()
+        with lock:
+            for job in jobs:
+                job.cancel()
+        # Do not wait for the losing LLM calls to abort, their results are discarded
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    if not finished:
+        raise failure
+
+    _, solution, result = min(finished, key=_rank)
+    return solution, result, generated
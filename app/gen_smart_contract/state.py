@@ -1,4 +1,4 @@
-from typing import List, TypedDict
+from typing import List, Optional, TypedDict
 
 
 class GraphState(TypedDict):
@@ -8,24 +8,63 @@ class GraphState(TypedDict):
     Attributes:
         error: Binary flag for control flow to indicate whether a test error was tripped.
         error_message: A detailed message describing the nature of the error if one occurred.
+        diagnostics: The structured compiler errors and warnings of the last compilation.
         prompt: The input or query that led to the current state of the graph.
+        iterations: The number of generation rounds so far.
+        started_at: The Unix time the run started, for the retry deadline.
+        tokens_used: The estimated prompt and completion tokens of the generation rounds so far.
+        contract_signature: Identifies the last compiled contract, to detect a round that returned it again.
+        diagnostics_signature: Identifies the last compiler errors, to detect a round that did not change them.
+        retry_budget: How much of the retry budget the run has used, and why it stopped retrying if it did.
+        prompt_trimmed: What the last generation round cut from its prompt to fit the token budget, if anything.
+        generations: The number of code generation calls so far, counting every finished speculative candidate.
         contract_type: Specifies the type of contract being referenced or generated.
         contract_requirements: A list of requirements or conditions that the contract must fulfill.
         documentation: The documentation or descriptive information related to the contract.
+        documentation_mode: "inline" to document the contract in the workflow, "deferred" to finish without it.
+        contract_hash: The key the deferred documentation of the contract can be fetched by.
         contract: The actual contract content or code.
         compiler_version: The version of the compiler used to compile the contract.
+        compile_result: The compile result of the contract, if the generation round already compiled it.
         existing_contract: The content or code of an existing contract, if applicable.
+        update_mode: "functions" to update the contract with function patches, "full" to rewrite it, or "auto".
+        patches: The function patches spliced into the contract by the last update round, if it used them.
+        cache_status: "hit", "warm" or "miss", how the semantic cache served the prompt of a generation run.
+        cache_similarity: The similarity of the prompt to the closest cached one.
+        warm_start_contract: The cached contract of a similar prompt that generation starts from.
+        abi: The ABI of the contract from its last successful compilation.
+        bytecode: The deployment bytecode of the contract from its last successful compilation.
     """
 
     error: str
     error_message: str
+    diagnostics: List[dict]
 
     prompt: str
     iterations: int
+    started_at: float
+    tokens_used: int
+    contract_signature: str
+    diagnostics_signature: Optional[str]
+    retry_budget: dict
+    prompt_trimmed: Optional[dict]
+    generations: int
     contract_type: str
     contract_requirements: List[str]
     documentation: str
+    documentation_mode: str
+    contract_hash: str
     contract: str
     compiler_version: str
+    compile_result: Optional[dict]
 
     existing_contract: str
+    update_mode: str
+    patches: Optional[List[dict]]
+
+    cache_status: str
+    cache_similarity: float
+    warm_start_contract: str
+
+    abi: List[dict]
+    bytecode: str
@@ -0,0 +1,254 @@
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+import weakref
+from typing import Any, Dict, Optional, Sequence, Tuple, Type
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.prompts import ChatPromptTemplate
+from langchain_core.pydantic_v1 import BaseModel
+
+from app.gen_smart_contract.cancellation import CancellationHandler, CancelToken
+from app.gen_smart_contract.instrumentation import cached_prompt_tokens, record_cache_hit, record_llm_call
+from app.gen_smart_contract.llm_cache import llm_cache
+from app.gen_smart_contract.llm_models import model_settings
+from app.gen_smart_contract.llm_policy import RETRYABLE_ERRORS, CircuitOpen, LLMCallPolicy
+from app.gen_smart_contract.metrics import metrics
+from app.gen_smart_contract.run_context import current_run_context
+from app.gen_smart_contract.token_stream import TokenStreamHandler, emit_cached
+from app.gen_smart_contract.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+
+class StructuredChain:
+    """
+    A prompt piped into a chat model with structured output, with its responses
+    cached on the model settings, the prompt template and the rendered inputs.
+
+    The chains run with temperature 0, so identical inputs give reusable outputs.
+    When the run context has a token sink, the `stream_fields` of the output are
+    forwarded to it while the model writes them.
+
+    Every invocation records its wall time, tokens and estimated cost, taking the
+    token usage from the response and counting the tokens when it has none. The
+    prompt tokens the provider served from its prompt cache are recorded too.
+
+    The calls follow the LLMCallPolicy of the chain's model `settings`, by default
+    those of LLM_MODELS for its name: deadline, retries, hedging and circuit
+    breaker. With a `fallback_llm`, a call the model fails with a retryable error,
+    such as a timeout, rate limit or server error, or that its open circuit
+    rejects, is made again on the fallback model. Answers of the fallback are not
+    cached, since the cache key is that of the model.
+
+    When the run context has a user's LLM clients, the models are called with the
+    user's own API key instead of the app's.
+
+    Only deterministic chains should be `cacheable`: a chain sampling at a non-zero
+    temperature neither reads nor writes the LLM cache.
+    """
+
+    def __init__(self, name: str, prompt: ChatPromptTemplate, llm: BaseChatModel, output_model: Type[BaseModel],
+                 stream_fields: Sequence[str] = (), fallback_llm: Optional[BaseChatModel] = None,
+                 settings: Optional[Dict[str, Any]] = None, cacheable: bool = True):
+        self.name = name
+        self.cacheable = cacheable
+        self.prompt = prompt
+        self.llm = llm
+        self.output_model = output_model
+        self.stream_fields = tuple(stream_fields)
+        self.fallback_llm = fallback_llm
+        self.model = _model_name(llm)
+        self.runnable = self._structured(llm)
+        self.fallback_model = _model_name(fallback_llm) if fallback_llm is not None else None
+        self.fallback = self._structured(fallback_llm) if fallback_llm is not None else None
+        # The runnables bound to each user's clients, dropped with the clients
+        self._user_runnables = weakref.WeakKeyDictionary()
+        self._user_runnables_lock = threading.Lock()
+
+        settings = model_settings(name) if settings is None else settings
+        self.policy = LLMCallPolicy(name, self.model, settings)
+        self.fallback_policy = LLMCallPolicy(name, self.fallback_model, settings) if fallback_llm is not None else None
+
+        fingerprint = json.dumps(
+            {"llm": llm._identifying_params, "prompt": prompt.pretty_repr(), "output": output_model.schema()},
+            sort_keys=True,
+            default=str,
+        )
+        self._fingerprint = hashlib.sha256(fingerprint.encode("utf-8")).hexdigest()
+
+    def _structured(self, llm: BaseChatModel):
+        # The raw message comes with the parsed output for its token usage
+        return self.prompt | llm.with_structured_output(self.output_model, include_raw=True)
+
+    def _runnables(self) -> Tuple[Any, Any]:
+        """
+        The runnables of the model and the fallback for the current run, bound to the
+        user's clients if it has them.
+        """
+        clients = current_run_context().llm_clients
+        if clients is None:
+            return self.runnable, self.fallback
+
+        with self._user_runnables_lock:
+            runnables = self._user_runnables.get(clients)
+            if runnables is None:
+                runnables = self._user_runnables[clients] = (
+                    self._structured(clients.bind(self.llm)),
+                    self._structured(clients.bind(self.fallback_llm)) if self.fallback_llm is not None else None,
+                )
+            return runnables
+
+    def cache_key(self, inputs: Dict[str, Any]) -> str:
+        rendered = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha256(f"{self._fingerprint}\0{rendered}".encode("utf-8")).hexdigest()
+
+    def prompt_tokens(self, inputs: Dict[str, Any]) -> int:
+        """
+        Count the tokens of the prompt messages rendered with these inputs.
+        """
+        return sum(count_tokens(message.content) for message in self.prompt.format_messages(**inputs))
+
+    def _lookup(self, inputs: Dict[str, Any]) -> Optional[BaseModel]:
+        if llm_cache is None or not self.cacheable or current_run_context().cache_bypass:
+            return None
+
+        cached = llm_cache.get(self.cache_key(inputs))
+        if cached is None:
+            metrics.incr("llm_cache_misses", chain=self.name)
+            return None
+
+        metrics.incr("llm_cache_hits", chain=self.name)
+        return self.output_model(**cached)
+
+    def _store(self, inputs: Dict[str, Any], result: Optional[BaseModel]):
+        if llm_cache is not None and self.cacheable and result is not None:
+            llm_cache.set(self.cache_key(inputs), result.dict())
+
+    def _cached(self, inputs: Dict[str, Any], sink) -> Optional[BaseModel]:
+        started = time.perf_counter()
+        return self._hit(self._lookup(inputs), sink, started)
+
+    async def _acached(self, inputs: Dict[str, Any], sink) -> Optional[BaseModel]:
+        # The cache reads a file or Redis, so the lookup runs in a thread and the sink is fed from the loop
+        started = time.perf_counter()
+        return self._hit(await asyncio.to_thread(self._lookup, inputs), sink, started)
+
+    def _hit(self, cached: Optional[BaseModel], sink, started: float) -> Optional[BaseModel]:
+        if cached is not None:
+            record_cache_hit(self.name, time.perf_counter() - started)
+            if sink is not None:
+                emit_cached(self.name, self.stream_fields, cached, sink)
+        return cached
+
+    def _parsed(self, inputs: Dict[str, Any], model: str, response: Dict[str, Any], seconds: float) -> BaseModel:
+        """
+        Record the call and return its parsed output, raising the parsing error if it had one.
+        """
+        result = response["parsed"]
+        usage = getattr(response["raw"], "usage_metadata", None)
+        if usage:
+            prompt_tokens, completion_tokens = usage["input_tokens"], usage["output_tokens"]
+        else:
+            prompt_tokens = self.prompt_tokens(inputs)
+            completion_tokens = count_tokens(json.dumps(result.dict())) if result is not None else 0
+        record_llm_call(self.name, model, seconds, prompt_tokens, completion_tokens,
+                        cached_prompt_tokens(response["raw"]))
+
+        if response.get("parsing_error") is not None:
+            raise response["parsing_error"]
+        if result is None:
+            raise ValueError(f"The {self.name} chain returned no {self.output_model.__name__}")
+        return result
+
+    def _failed_over(self, error: Exception) -> bool:
+        if self.fallback is None or not isinstance(error, RETRYABLE_ERRORS + (CircuitOpen,)):
+            return False
+        logger.warning(f"The {self.name} chain failed on {self.model}, retrying on {self.fallback_model}: {error}")
+        metrics.incr("llm_fallbacks", chain=self.name, model=self.model)
+        return True
+
+    def _call(self, inputs: Dict[str, Any], sink, cancel_token: Optional[CancelToken]) -> Tuple[str, Any, bool]:
+        """
+        Returns:
+            tuple: The model that answered, its response, and whether the response streamed its tokens to the sink
+        """
+        def make_config(stream: bool, token: Optional[CancelToken]):
+            return self._config(sink if stream else None, token)
+
+        runnable, fallback = self._runnables()
+        try:
+            return (self.model, *self.policy.invoke(runnable, inputs, make_config, cancel_token))
+        except Exception as e:
+            if not self._failed_over(e):
+                raise
+        return (self.fallback_model, *self.fallback_policy.invoke(fallback, inputs, make_config, cancel_token))
+
+    async def _acall(self, inputs: Dict[str, Any], sink) -> Tuple[str, Any, bool]:
+        def make_config(stream: bool, token: Optional[CancelToken]):
+            return self._config(sink if stream else None, token)
+
+        runnable, fallback = self._runnables()
+        try:
+            return (self.model, *await self.policy.ainvoke(runnable, inputs, make_config))
+        except Exception as e:
+            if not self._failed_over(e):
+                raise
+        return (self.fallback_model, *await self.fallback_policy.ainvoke(fallback, inputs, make_config))
+
+    def _config(self, sink, cancel_token: Optional[CancelToken] = None) -> Optional[Dict[str, Any]]:
+        callbacks = []
+        if sink:
+            callbacks.append(TokenStreamHandler(self.name, self.stream_fields, sink))
+        if cancel_token is not None:
+            callbacks.append(CancellationHandler(cancel_token))
+        return {"callbacks": callbacks} if callbacks else None
+
+    def invoke(self, inputs: Dict[str, Any]) -> BaseModel:
+        context = current_run_context()
+        sink = context.token_sink if self.stream_fields else None
+
+        cached = self._cached(inputs, sink)
+        if cached is not None:
+            return cached
+
+        if context.cancel_token is not None:
+            context.cancel_token.raise_if_cancelled()
+
+        # A blocking call can only be aborted between streamed chunks
+        started = time.perf_counter()
+        model, response, streamed = self._call(inputs, sink, context.cancel_token)
+        result = self._parsed(inputs, model, response, time.perf_counter() - started)
+        if sink is not None and not streamed:
+            emit_cached(self.name, self.stream_fields, result, sink)
+        if model == self.model:
+            self._store(inputs, result)
+        return result
+
+    async def ainvoke(self, inputs: Dict[str, Any]) -> BaseModel:
+        context = current_run_context()
+        sink = context.token_sink if self.stream_fields else None
+
+        cached = await self._acached(inputs, sink)
+        if cached is not None:
+            return cached
+
+        if context.cancel_token is not None:
+            context.cancel_token.raise_if_cancelled()
+
+        # Cancelling the task aborts the request, so the response does not need to be streamed
+        started = time.perf_counter()
+        model, response, streamed = await self._acall(inputs, sink)
+        result = self._parsed(inputs, model, response, time.perf_counter() - started)
+        if sink is not None and not streamed:
+            emit_cached(self.name, self.stream_fields, result, sink)
+        if model == self.model:
+            await asyncio.to_thread(self._store, inputs, result)
+        return result
+
+
+def _model_name(llm: BaseChatModel) -> str:
+    return getattr(llm, "model_name", None) or getattr(llm, "model", "") or ""
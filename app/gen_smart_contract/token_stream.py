@@ -0,0 +1,226 @@
+import asyncio
+import contextvars
+import dataclasses
+import json
+import queue
+import re
+import threading
+import uuid
+from typing import Any, AsyncIterator, Callable, Dict, Iterator, Optional, Sequence
+from uuid import UUID
+
+from langchain_core.callbacks import BaseCallbackHandler
+from langchain_core.pydantic_v1 import BaseModel
+from langchain_core.runnables import RunnableConfig
+
+from app.gen_smart_contract.run_context import current_run_context, run_context
+
+_ESCAPES = {'"': '"', "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class PartialJsonString:
+    """
+    Incrementally decodes one string field of a JSON object that arrives in
+    chunks, such as the arguments of a streamed tool call.
+    """
+
+    def __init__(self, field: str):
+        self._key = re.compile(r'"%s"\s*:\s*"' % re.escape(field))
+        self._buffer = ""
+        self._position = None
+        self.done = False
+
+    def feed(self, chunk: str) -> str:
+        """
+        Args:
+            chunk (str): The next characters of the JSON document
+
+        Returns:
+            str: The newly decoded characters of the field value, possibly empty
+        """
+        self._buffer += chunk
+        if self.done:
+            return ""
+
+        if self._position is None:
+            match = self._key.search(self._buffer)
+            if match is None:
+                return ""
+            self._position = match.end()
+
+        buffer, i, decoded = self._buffer, self._position, []
+        while i < len(buffer):
+            c = buffer[i]
+            if c == '"':
+                self.done = True
+                i += 1
+                break
+            if c != "\\":
+                end = len(buffer)
+                for stop in ('"', "\\"):
+                    found = buffer.find(stop, i)
+                    if found != -1:
+                        end = min(end, found)
+                decoded.append(buffer[i:end])
+                i = end
+                continue
+
+            # Hold back escape sequences until they are complete
+            if i + 1 >= len(buffer):
+                break
+            if buffer[i + 1] != "u":
+                decoded.append(_ESCAPES.get(buffer[i + 1], buffer[i + 1]))
+                i += 2
+                continue
+            if i + 6 > len(buffer):
+                break
+            if 0xD800 <= int(buffer[i + 2:i + 6], 16) < 0xDC00:
+                # A surrogate pair is decoded together with its low half
+                if i + 12 > len(buffer):
+                    break
+                decoded.append(json.loads(f'"{buffer[i:i + 12]}"'))
+                i += 12
+                continue
+            decoded.append(chr(int(buffer[i + 2:i + 6], 16)))
+            i += 6
+
+        self._position = i
+        return "".join(decoded)
+
+
+class TokenStreamHandler(BaseCallbackHandler):
+    """
+    Forwards the deltas of selected string fields of a structured-output chain to a
+    sink as the model streams its tool call.
+    """
+
+    # Called directly from async runs too, so the sink must be cheap and thread-safe
+    run_inline = True
+
+    def __init__(self, chain: str, fields: Sequence[str], sink: Callable[[Dict[str, Any]], None]):
+        self.chain = chain
+        self.fields = fields
+        self.sink = sink
+        self._parsers: Dict[UUID, Dict[str, PartialJsonString]] = {}
+
+    def on_llm_new_token(self, token: str, *, chunk=None, run_id: UUID, **kwargs: Any):
+        message = getattr(chunk, "message", None)
+        arguments = "".join(c.get("args") or "" for c in getattr(message, "tool_call_chunks", None) or [])
+
+        parsers = self._parsers.setdefault(run_id, {field: PartialJsonString(field) for field in self.fields})
+        for field, parser in parsers.items():
+            delta = parser.feed(arguments or token)
+            if delta:
+                self.sink({"run_id": str(run_id), "chain": self.chain, "field": field, "delta": delta})
+
+    def on_llm_end(self, response, *, run_id: UUID, **kwargs: Any):
+        self._parsers.pop(run_id, None)
+
+
+def emit_cached(chain: str, fields: Sequence[str], result: BaseModel, sink: Callable[[Dict[str, Any]], None]):
+    """
+    Send the fields of a response that was not streamed, such as a cached one, to
+    the sink as a single delta each.
+    """
+    run_id = str(uuid.uuid4())
+    for field in fields:
+        value = getattr(result, field, "")
+        if value:
+            sink({"run_id": run_id, "chain": chain, "field": field, "delta": value})
+
+
+# Yielded by stream_in_background when the workflow has been quiet for a heartbeat interval
+HEARTBEAT = object()
+
+
+def stream_in_background(graph, inputs: Optional[Dict[str, Any]], config: Optional[RunnableConfig] = None,
+                         tokens: bool = False, heartbeat: Optional[float] = None) -> Iterator[Any]:
+    """
+    Stream a workflow's node outputs from a background thread. With `tokens`, they
+    are interleaved with `{"token": ...}` events that carry the generated Solidity
+    and documentation as the model writes it.
+
+    Running the workflow in its own thread lets the caller write to the client
+    while a node is still running: token events as they arrive, and a HEARTBEAT
+    when nothing happened for `heartbeat` seconds, so that a disconnected client is
+    noticed during a long LLM call or compilation rather than after it.
+
+    Args:
+        graph: The compiled workflow
+        inputs (dict): The initial graph state, or None to resume the run of the config
+        config (RunnableConfig): The graph config, naming the run to checkpoint
+        tokens (bool): Whether to stream token events
+        heartbeat (float, optional): Seconds of silence after which HEARTBEAT is yielded
+
+    Returns:
+        Iterator: The node outputs, exactly as `graph.stream` yields them, the token events and heartbeats
+    """
+    events = queue.Queue()
+    finished = object()
+    context = current_run_context()
+    if tokens:
+        context = dataclasses.replace(context, token_sink=lambda event: events.put({"token": event}))
+
+    def run():
+        try:
+            with run_context(context):
+                for output in graph.stream(inputs, config):
+                    events.put(output)
+                    # Do not start the next node of a cancelled run
+                    if context.cancel_token is not None and context.cancel_token.cancelled:
+                        break
+        except Exception as e:
+            events.put(e)
+        finally:
+            events.put(finished)
+
+    threading.Thread(target=contextvars.copy_context().run, args=(run,), daemon=True).start()
+
+    while True:
+        try:
+            event = events.get(timeout=heartbeat)
+        except queue.Empty:
+            yield HEARTBEAT
+            continue
+        if event is finished:
+            return
+        if isinstance(event, Exception):
+            raise event
+        yield event
+
+
+async def astream_with_tokens(graph, inputs: Optional[Dict[str, Any]],
+                              config: Optional[RunnableConfig] = None) -> AsyncIterator[Dict[str, Any]]:
+    """
+    The asyncio counterpart of stream_in_background with `tokens`, running the
+    workflow in a task of the current event loop.
+    """
+    events = asyncio.Queue()
+    finished = object()
+    loop = asyncio.get_running_loop()
+    context = dataclasses.replace(
+        current_run_context(), token_sink=lambda event: loop.call_soon_threadsafe(events.put_nowait, {"token": event})
+    )
+
+    # Everything goes through the loop's callback queue, keeping token events in order with node outputs
+    async def run():
+        try:
+            with run_context(context):
+                async for output in graph.astream(inputs, config):
+                    loop.call_soon(events.put_nowait, output)
+        except Exception as e:
+            loop.call_soon(events.put_nowait, e)
+        finally:
+            loop.call_soon(events.put_nowait, finished)
+
+    task = asyncio.create_task(run())
+    try:
+        while True:
+            event = await events.get()
+            if event is finished:
+                return
+            if isinstance(event, Exception):
+                raise event
+            yield event
+    finally:
+        task.cancel()
@@ -0,0 +1,44 @@
+import logging
+from functools import lru_cache
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MODEL = "gpt-4o-mini"
+
+# Rough characters-per-token ratio used when no tiktoken encoding is available
+APPROX_CHARS_PER_TOKEN = 4
+
+
+@lru_cache(maxsize=None)
+def _encoding(model: str):
+    import tiktoken
+
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        # tiktoken downloads its encodings on first use, which fails without network
+        logger.warning(f"tiktoken encoding for {model} unavailable, approximating token counts: {e}")
+        return None
+
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL) -> int:
+    """
+    Count the tokens of a piece of text for the given model.
+
+    Args:
+        text (str): The text to measure
+        model (str): The model whose tokenizer should be used
+
+    Returns:
+        int: The number of tokens
+    """
+    if not text:
+        return 0
+
+    encoding = _encoding(model)
+    if encoding is None:
+        return -(-len(text) // APPROX_CHARS_PER_TOKEN)
+
+    return len(encoding.encode(text, disallowed_special=()))
@@ -1,17 +1,21 @@
 from langgraph.graph import END, StateGraph, START
 
+from app.gen_smart_contract.checkpointer import checkpointer
 from app.gen_smart_contract.edges.decide_to_finish_update import decide_to_finish_update
-from app.gen_smart_contract.nodes.code_check import code_check
-from app.gen_smart_contract.nodes.document import document
-from app.gen_smart_contract.nodes.reflect import reflect
+from app.gen_smart_contract.instrumentation import timed_node
+from app.gen_smart_contract.nodes.code_check import acode_check, code_check
+from app.gen_smart_contract.nodes.defer_document import defer_document
+from app.gen_smart_contract.nodes.document import adocument, document
+from app.gen_smart_contract.nodes.reflect import areflect, reflect
 from app.gen_smart_contract.state import GraphState
 
 update_workflow = StateGraph(GraphState)
 
-# Define the nodes
-update_workflow.add_node("check_code", code_check)
-update_workflow.add_node("reflect", reflect)
-update_workflow.add_node("document", document)
+# Define the nodes, pairing each sync implementation with its asyncio one where it waits on I/O, and timing them
+update_workflow.add_node("check_code", timed_node("check_code", code_check, acode_check))
+update_workflow.add_node("reflect", timed_node("reflect", reflect, areflect))
+update_workflow.add_node("document", timed_node("document", document, adocument))
+update_workflow.add_node("defer_document", timed_node("defer_document", defer_document))
 
 # Build graph
 update_workflow.add_edge(START, "reflect")
@@ -21,10 +25,12 @@ update_workflow.add_conditional_edges(
     decide_to_finish_update,
     {
         "document": "document",
+        "defer_document": "defer_document",
         "reflect": "reflect",
     },
 )
 
 update_workflow.add_edge("document", END)
+update_workflow.add_edge("defer_document", END)
 
-update_smart_contract_workflow = update_workflow.compile()
+update_smart_contract_workflow = update_workflow.compile(checkpointer=checkpointer)
@@ -0,0 +1,156 @@
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+import httpx
+import openai
+from cryptography.fernet import InvalidToken
+from langchain_core.pydantic_v1 import SecretStr
+from langchain_openai import ChatOpenAI
+
+from app.encryption import decrypt_data, encrypt_data
+from app.gen_smart_contract.llm_models import recording_usage
+from app.gen_smart_contract.llm_policy import CircuitBreaker
+from app.gen_smart_contract.metrics import metrics
+from config import Config
+
+logger = logging.getLogger(__name__)
+
+
+def key_fingerprint(api_key: str) -> str:
+    return hashlib.sha256(api_key.encode("utf-8")).hexdigest()
+
+
+class UserLLMClients:
+    """
+    The OpenAI clients of one user's own API key. The HTTP connection pools live as
+    long as the entry, so the user's calls reuse open keep-alive connections instead
+    of paying for a TLS handshake per request.
+
+    The calls made with the key have their own circuit breakers, so that a user's
+    exhausted quota does not open the circuit of everyone else's calls.
+    """
+
+    def __init__(self, user_id: Any, api_key: str):
+        self.user_id = user_id
+        self.fingerprint = key_fingerprint(api_key)
+        self._api_key = api_key
+        limits = httpx.Limits(
+            max_connections=Config.USER_LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.USER_LLM_MAX_CONNECTIONS,
+            keepalive_expiry=Config.USER_LLM_KEEPALIVE_SECONDS,
+        )
+        self.http_client = openai.DefaultHttpxClient(limits=limits)
+        self.async_http_client = openai.DefaultAsyncHttpxClient(limits=limits)
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._lock = threading.Lock()
+
+    def bind(self, llm: ChatOpenAI) -> ChatOpenAI:
+        """
+        A copy of a chat model that calls the API with this user's key through their
+        connection pools, keeping its model settings.
+        """
+        params = {
+            "api_key": self._api_key,
+            "base_url": llm.openai_api_base,
+            "timeout": llm.request_timeout,
+            "max_retries": llm.max_retries,
+            "default_headers": llm.default_headers,
+            "default_query": llm.default_query,
+        }
+        # Not llm.copy, which leaves out the fields excluded from serialization such as callbacks
+        return type(llm).construct(_fields_set=llm.__fields_set__, **{
+            **llm.__dict__,
+            "openai_api_key": SecretStr(self._api_key),
+            # The app's organization does not apply to the user's key
+            "openai_organization": None,
+            "client": recording_usage(openai.OpenAI(**params, http_client=self.http_client).chat.completions),
+            "async_client": recording_usage(
+                openai.AsyncOpenAI(**params, http_client=self.async_http_client).chat.completions
+            ),
+        })
+
+    def circuit_breaker(self, endpoint: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(endpoint)
+            if breaker is None:
+                breaker = self._breakers[endpoint] = CircuitBreaker(
+                    f"{endpoint} for user {self.user_id}", Config.LLM_BREAKER_FAILURES,
+                    Config.LLM_BREAKER_RESET_SECONDS, label=f"{endpoint} (user keys)"
+                )
+            return breaker
+
+    def sealed(self) -> Dict[str, Any]:
+        """
+        The user and their encrypted key, to run a background job with the key.
+        """
+        return {"user_id": self.user_id, "openai_api_key": encrypt_data(self._api_key)}
+
+
+class UserLLMClientPool:
+    """
+    A bounded LRU of users' LLM clients. An entry is rebuilt when the user's key
+    changes, and dropped when it is evicted; calls still using its clients finish,
+    and its connections close once it is garbage collected.
+    """
+
+    def __init__(self, max_size: int):
+        self.max_size = max_size
+        self._entries: "OrderedDict[Any, UserLLMClients]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: Any, api_key: str) -> UserLLMClients:
+        """
+        The clients of a user's key, built on first use.
+        """
+        with self._lock:
+            clients = self._entries.get(user_id)
+            if clients is not None and clients.fingerprint == key_fingerprint(api_key):
+                self._entries.move_to_end(user_id)
+                metrics.incr("user_llm_client_hits")
+                return clients
+
+            clients = self._entries[user_id] = UserLLMClients(user_id, api_key)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                metrics.incr("user_llm_client_evictions")
+            size = len(self._entries)
+
+        metrics.incr("user_llm_client_builds")
+        metrics.set_gauge("user_llm_clients", size)
+        return clients
+
+    def evict(self, user_id: Any):
+        """
+        Drop a user's clients, e.g. when they change their key.
+        """
+        with self._lock:
+            evicted = self._entries.pop(user_id, None) is not None
+            size = len(self._entries)
+        if evicted:
+            metrics.incr("user_llm_client_evictions")
+            metrics.set_gauge("user_llm_clients", size)
+
+    def unseal(self, sealed: Optional[Dict[str, Any]]) -> Optional[UserLLMClients]:
+        """
+        The clients of a key sealed with UserLLMClients.sealed, None if there is none
+        or it cannot be decrypted, in which case the app's key is used.
+        """
+        if not sealed:
+            return None
+        try:
+            api_key = decrypt_data(sealed["openai_api_key"])
+        except InvalidToken:
+            logger.warning(f"Cannot decrypt the OpenAI API key of user {sealed['user_id']}, using the app's key")
+            return None
+        return self.get(sealed["user_id"], api_key)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._entries)
+
+
+user_llm_clients = UserLLMClientPool(Config.USER_LLM_CLIENTS_MAX)
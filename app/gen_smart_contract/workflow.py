@@ -1,22 +1,43 @@
 from langgraph.graph import END, StateGraph, START
 
+from app.gen_smart_contract.checkpointer import checkpointer
+from app.gen_smart_contract.edges.decide_from_cache import decide_from_cache
 from app.gen_smart_contract.edges.decide_to_finish import decide_to_finish
-from app.gen_smart_contract.nodes.classify import classify
-from app.gen_smart_contract.nodes.code_check import code_check
-from app.gen_smart_contract.nodes.document import document
-from app.gen_smart_contract.nodes.generate import generate
+from app.gen_smart_contract.instrumentation import timed_node
+from app.gen_smart_contract.nodes.classify import aclassify, classify
+from app.gen_smart_contract.nodes.code_check import acode_check, code_check
+from app.gen_smart_contract.nodes.defer_document import defer_document
+from app.gen_smart_contract.nodes.document import adocument, document
+from app.gen_smart_contract.nodes.generate import agenerate, generate
+from app.gen_smart_contract.nodes.lookup import alookup, lookup
+from app.gen_smart_contract.semantic_cache import semantic_cache
 from app.gen_smart_contract.state import GraphState
 
 workflow = StateGraph(GraphState)
 
-# Define the nodes
-workflow.add_node("classify", classify)
-workflow.add_node("generate", generate)
-workflow.add_node("check_code", code_check)
-workflow.add_node("document", document)
+# Define the nodes, pairing each sync implementation with its asyncio one where it waits on I/O, and timing them
+workflow.add_node("classify", timed_node("classify", classify, aclassify))
+workflow.add_node("generate", timed_node("generate", generate, agenerate))
+workflow.add_node("check_code", timed_node("check_code", code_check, acode_check))
+workflow.add_node("document", timed_node("document", document, adocument))
+workflow.add_node("defer_document", timed_node("defer_document", defer_document))
 
-# Build graph
-workflow.add_edge(START, "classify")
+# Build graph, starting with a lookup of similar earlier runs when the semantic cache is enabled
+if semantic_cache is not None:
+    workflow.add_node("lookup", timed_node("lookup", lookup, alookup))
+    workflow.add_edge(START, "lookup")
+    workflow.add_conditional_edges(
+        "lookup",
+        decide_from_cache,
+        {
+            "classify": "classify",
+            "document": "document",
+            "defer_document": "defer_document",
+            END: END,
+        },
+    )
+else:
+    workflow.add_edge(START, "classify")
 workflow.add_edge("classify", "generate")
 workflow.add_edge("generate", "check_code")
 workflow.add_conditional_edges(
@@ -24,9 +45,11 @@ workflow.add_conditional_edges(
     decide_to_finish,
     {
         "document": "document",
+        "defer_document": "defer_document",
         "generate": "generate",
     },
 )
 workflow.add_edge("document", END)
+workflow.add_edge("defer_document", END)
 
-smart_contract_generator = workflow.compile()
+smart_contract_generator = workflow.compile(checkpointer=checkpointer)
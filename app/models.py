@@ -132,3 +132,23 @@ class RevokedTokenModel(db.Model):
         """
         query = cls.query.filter_by(jti=jti).first()
         return bool(query)
+
+
+# defines the LangGraph checkpoints of the smart contract workflows, written by
+# app.gen_smart_contract.checkpointer outside of the Flask app context
+class WorkflowCheckpoint(db.Model):
+    thread_id = db.Column(db.String(64), primary_key=True)
+    checkpoint_id = db.Column(db.String(64), primary_key=True)
+    parent_id = db.Column(db.String(64), nullable=True)
+    checkpoint = db.Column(db.LargeBinary, nullable=False)
+    checkpoint_metadata = db.Column(db.LargeBinary, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class WorkflowCheckpointWrite(db.Model):
+    thread_id = db.Column(db.String(64), primary_key=True)
+    checkpoint_id = db.Column(db.String(64), primary_key=True)
+    task_id = db.Column(db.String(64), primary_key=True)
+    idx = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    channel = db.Column(db.String(255), nullable=False)
+    value = db.Column(db.LargeBinary, nullable=True)
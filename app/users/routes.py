@@ -4,6 +4,7 @@ from werkzeug.exceptions import BadRequest
 
 from app.encryption import encrypt_data, decrypt_data
 from app.errors.handlers import bad_request
+from app.gen_smart_contract.user_clients import user_llm_clients
 from app.models import Users
 from app.schemas import UsersSchema
 from app.users import bp
@@ -101,6 +102,9 @@ def update_user_profile() -> tuple[Response, int] | Response:
     # Commit changes to the database
     db.session.commit()
 
+    # Drop the LLM clients of the previous key, the next run builds them with the new one
+    user_llm_clients.evict(str(user.id))
+
 
     # Decrypt keys for response
     decrypted_metamask_key = decrypt_data(user.metamask_wallet_address)
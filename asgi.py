@@ -0,0 +1,9 @@
+from a2wsgi import WSGIMiddleware
+
+from app import create_app
+from app.ai.async_routes import AsyncAIRoutes
+
+flask_app = create_app()
+
+# The generation streams run on the event loop, everything else in the Flask app on a pool of threads
+app = AsyncAIRoutes(WSGIMiddleware(flask_app, workers=flask_app.config["WSGI_THREADS"]), flask_app=flask_app)
@@ -0,0 +1,73 @@
+"""
+Evaluate the local contract classifier offline on the logged LLM classifications
+with k-fold cross-validation: for each confidence threshold, the share of prompts
+it answers without the LLM, its accuracy on them, the accuracy of the classify
+step overall (LLM answers count as correct) and the LLM latency it saves.
+
+Usage:
+    python -m benchmarks.classifier_eval [--log logs/classify.jsonl] [--folds 5] [--neighbours 5]
+"""
+import argparse
+import time
+
+import numpy as np
+
+from app.gen_smart_contract.local_classifier import LocalClassifier, label_key, read_samples
+from config import Config
+
+THRESHOLDS = (0.5, 0.6, 0.7, 0.8, 0.9, 0.95)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--log", default=Config.CLASSIFIER_LOG_PATH, help="Classification log")
+    parser.add_argument("--folds", type=int, default=5, help="Number of cross-validation folds")
+    parser.add_argument("--neighbours", type=int, default=Config.CLASSIFIER_NEIGHBOURS, help="Voting neighbours")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the fold assignment")
+    args = parser.parse_args()
+
+    samples = read_samples(args.log, Config.CLASSIFIER_LOG_TTL_SECONDS)
+    if len(samples) < args.folds:
+        parser.error(f"{args.log} holds {len(samples)} distinct prompts, fewer than {args.folds} folds")
+
+    folds = np.random.default_rng(args.seed).permutation(len(samples)) % args.folds
+    confidences, correct, latencies = [], [], []
+    for fold in range(args.folds):
+        train = [s for s, f in zip(samples, folds) if f != fold]
+        classifier = LocalClassifier.train(train, Config.CLASSIFIER_MIN_SUPPORT)
+
+        for sample in (s for s, f in zip(samples, folds) if f == fold):
+            start = time.perf_counter()
+            prediction = classifier.predict(sample["prompt"], args.neighbours)
+            latencies.append(time.perf_counter() - start)
+
+            # Without requirements shared by enough prompts, or naming anything else, the prompt goes to the LLM
+            answered = (prediction is not None and bool(prediction["requirements"])
+                        and not prediction["unknown_words"])
+            confidences.append(prediction["confidence"] if answered else 0.0)
+            correct.append(bool(prediction) and label_key(prediction["contract_type"]) == label_key(
+                sample["contract_type"]
+            ))
+
+    confidences, correct = np.array(confidences), np.array(correct)
+    llm_latency = np.array([s.get("latency_seconds") or 0.0 for s in samples])
+    llm_mean = float(llm_latency[llm_latency > 0].mean()) if (llm_latency > 0).any() else 0.0
+    local_mean = float(np.mean(latencies))
+
+    print(f"{len(samples)} prompts, {len(set(label_key(s['contract_type']) for s in samples))} contract types, "
+          f"{args.folds} folds")
+    print(f"Local prediction: {local_mean * 1000:.2f} ms mean, LLM classification: {llm_mean * 1000:.0f} ms mean\n")
+
+    print(f"{'threshold':>9} {'coverage':>9} {'local acc':>9} {'overall':>9} {'saved/run':>10}")
+    for threshold in THRESHOLDS:
+        local = confidences >= threshold
+        coverage = local.mean()
+        accuracy = correct[local].mean() if local.any() else float("nan")
+        overall = (correct & local).sum() / len(correct) + (1 - coverage)
+        saved = coverage * llm_mean - local_mean
+        print(f"{threshold:>9.2f} {coverage:>9.1%} {accuracy:>9.1%} {overall:>9.1%} {saved * 1000:>8.0f}ms"
+              + ("  <- CLASSIFIER_CONFIDENCE_THRESHOLD" if threshold == Config.CLASSIFIER_CONFIDENCE_THRESHOLD else ""))
+
+
+if __name__ == "__main__":
+    main()
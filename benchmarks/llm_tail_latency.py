@@ -0,0 +1,171 @@
+"""
+Measure the latency of LLM calls under the LLMCallPolicy against a fake chat
+model with injected latencies and errors. Most calls answer after about --latency
+seconds, a --slow-rate share of them --slow-factor times slower, and an
+--error-rate share fail with a connection error.
+
+The scenarios:
+  baseline  no retries, deadline or hedging, as the chains called the model before
+  retries   jittered retries of failed attempts within a deadline
+  hedged    retries, and a duplicate of attempts slower than the observed p95
+  outage    every attempt fails: the time each call takes to fail, and the
+            attempts that reach the model, with and without the circuit breaker
+
+Usage:
+    python -m benchmarks.llm_tail_latency [--calls 200] [--concurrency 8] [--latency 0.5] [--slow-rate 0.05]
+        [--slow-factor 10] [--error-rate 0.02]
+"""
+import argparse
+import asyncio
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+import numpy as np
+import openai
+from langchain_core.messages import AIMessage, AIMessageChunk
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langchain_openai import ChatOpenAI
+
+from app.gen_smart_contract.llm_policy import CircuitBreaker, LLMCallPolicy
+from app.gen_smart_contract.prompts.classify_contract_prompt import classify_contract_prompt
+from app.gen_smart_contract.schema import classifyContractModel
+from config import Config
+
+ARGUMENTS = '{"contract_type": "ERC20", "requirements": ["Track the total supply"]}'
+
+
+class FakeChatModel(ChatOpenAI):
+    """
+    Answers every call with a classifyContractModel tool call after an injected
+    latency, or fails it with a connection error.
+    """
+
+    latency: float = 0.5
+    slow_rate: float = 0.0
+    slow_factor: float = 10.0
+    error_rate: float = 0.0
+    seed: int = 0
+
+    def _sample(self) -> float:
+        state = self.__dict__.setdefault("_state", {"rng": random.Random(self.seed), "lock": threading.Lock(),
+                                                    "attempts": 0})
+        with state["lock"]:
+            state["attempts"] += 1
+            rng = state["rng"]
+            failed = rng.random() < self.error_rate
+            latency = self.latency * rng.uniform(0.8, 1.2) * (self.slow_factor if rng.random() < self.slow_rate else 1)
+        if failed:
+            # Connection errors come back quickly
+            time.sleep(self.latency / 10)
+            raise openai.APIConnectionError(request=httpx.Request("POST", "http://fake/v1/chat/completions"))
+        return latency
+
+    @property
+    def attempts(self) -> int:
+        return self.__dict__.get("_state", {}).get("attempts", 0)
+
+    def _message(self, tools) -> AIMessage:
+        return AIMessage(content="", tool_calls=[{"name": tools[0]["function"]["name"], "args": json.loads(ARGUMENTS),
+                                                  "id": "call_fake"}])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._sample())
+        return ChatResult(generations=[ChatGeneration(message=self._message(kwargs["tools"]))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._sample())
+        return ChatResult(generations=[ChatGeneration(message=self._message(kwargs["tools"]))])
+
+    def _stream(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._sample())
+        for chunk in self._chunks(kwargs["tools"]):
+            if run_manager:
+                run_manager.on_llm_new_token("", chunk=chunk)
+            yield chunk
+
+    async def _astream(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._sample())
+        for chunk in self._chunks(kwargs["tools"]):
+            if run_manager:
+                await run_manager.on_llm_new_token("", chunk=chunk)
+            yield chunk
+
+    def _chunks(self, tools):
+        name = tools[0]["function"]["name"]
+        for i in range(0, len(ARGUMENTS), 16):
+            yield ChatGenerationChunk(message=AIMessageChunk(content="", tool_call_chunks=[
+                {"name": name if i == 0 else None, "args": ARGUMENTS[i:i + 16], "id": "call_fake" if i == 0 else None,
+                 "index": 0}
+            ]))
+
+
+def run_scenario(name: str, args, settings: dict, error_rate: float, breaker_failures: int, warmup: int = 0):
+    model = FakeChatModel(model=f"fake-{name}", api_key="fake", latency=args.latency, slow_rate=args.slow_rate,
+                          slow_factor=args.slow_factor, error_rate=error_rate, seed=args.seed)
+    runnable = classify_contract_prompt | model.with_structured_output(classifyContractModel, include_raw=True)
+    policy = LLMCallPolicy(f"bench_{name}", model.model_name, settings)
+    policy.breaker = CircuitBreaker(model.model_name, breaker_failures, Config.LLM_BREAKER_RESET_SECONDS)
+
+    def call(i: int):
+        started = time.perf_counter()
+        try:
+            policy.invoke(runnable, {"prompt": f"Token number {i}"}, lambda stream, token: None)
+            return time.perf_counter() - started, True
+        except Exception:
+            return time.perf_counter() - started, False
+
+    with ThreadPoolExecutor(args.concurrency) as pool:
+        list(pool.map(call, range(warmup)))
+        attempts = model.attempts
+        results = list(pool.map(call, range(args.calls)))
+
+    seconds = np.array([r[0] for r in results])
+    failed = sum(not r[1] for r in results)
+    return {
+        "p50": np.percentile(seconds, 50),
+        "p95": np.percentile(seconds, 95),
+        "p99": np.percentile(seconds, 99),
+        "max": seconds.max(),
+        "failed": failed / len(results),
+        "attempts": (model.attempts - attempts) / len(results),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=200, help="Calls per scenario")
+    parser.add_argument("--concurrency", type=int, default=8, help="Calls in flight at once")
+    parser.add_argument("--latency", type=float, default=0.5, help="Typical seconds per answer")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="Share of slow answers")
+    parser.add_argument("--slow-factor", type=float, default=10.0, help="How many times slower a slow answer is")
+    parser.add_argument("--error-rate", type=float, default=0.02, help="Share of attempts that fail")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the injected latencies and errors")
+    args = parser.parse_args()
+
+    # Scaled to the injected latency, as LLM_RETRY_BACKOFF_SECONDS is to a real model's
+    Config.LLM_RETRY_BACKOFF_SECONDS = args.latency
+    Config.LLM_RETRY_MAX_WAIT_SECONDS = args.latency * 4
+    deadline = args.latency * args.slow_factor * 3
+
+    scenarios = [
+        ("baseline", {"retries": 0, "hedge": False}, args.error_rate, 0, 0),
+        ("retries", {"retries": 2, "hedge": False, "deadline": deadline}, args.error_rate, 0, 0),
+        ("hedged", {"retries": 2, "hedge": True, "deadline": deadline}, args.error_rate, 0,
+         Config.LLM_HEDGE_MIN_SAMPLES),
+        ("outage", {"retries": 2, "hedge": False, "deadline": deadline}, 1.0, 0, 0),
+        ("outage+cb", {"retries": 2, "hedge": False, "deadline": deadline}, 1.0, Config.LLM_BREAKER_FAILURES, 0),
+    ]
+
+    print(f"{'scenario':<10} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8} {'failed':>7} {'attempts/call':>14}")
+    for name, settings, error_rate, breaker_failures, warmup in scenarios:
+        r = run_scenario(name, args, settings, error_rate, breaker_failures, warmup)
+        print(f"{name:<10} {r['p50'] * 1000:>6.0f}ms {r['p95'] * 1000:>6.0f}ms {r['p99'] * 1000:>6.0f}ms "
+              f"{r['max'] * 1000:>6.0f}ms {r['failed']:>7.1%} {r['attempts']:>14.2f}")
+
+
+if __name__ == "__main__":
+    main()
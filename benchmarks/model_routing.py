@@ -0,0 +1,128 @@
+"""
+Measure the latency and output quality of candidate models on the classify,
+code generation and documentation chains, and suggest the LLM_MODELS setting
+that gives each chain the fastest model meeting the quality bar.
+
+Each chain is called with the sample requests on each model, with the LLM cache
+bypassed. Quality is the share of calls whose output passes the chain's check:
+  - classify: the contract type agrees with the reference model's, the last one
+    listed, and there is at least one requirement
+  - code_gen: the contract compiles
+  - documentation: the document has all six required sections
+
+The calls go to the API set up for the app, or to --base-url, any
+OpenAI-compatible server such as a local stand-in.
+
+Usage:
+    python -m benchmarks.model_routing [--models gpt-4o-mini,gpt-4o] [--runs 2] [--min-quality 1.0]
+        [--base-url http://localhost:8000/v1]
+"""
+import argparse
+import json
+import time
+
+import numpy as np
+
+from app.gen_smart_contract.common import classify_contract_chain, code_gen_chain, documentation_gen_chain
+from app.gen_smart_contract.compiler import compile_contract
+from app.gen_smart_contract.docs_index import retrieve_context
+from app.gen_smart_contract.llm_models import chat_model, model_settings
+from app.gen_smart_contract.run_context import RunContext, run_context
+from app.gen_smart_contract.structured_chain import StructuredChain
+from benchmarks.retrieval_tokens import SAMPLE_REQUESTS
+from benchmarks.update_patch_tokens import PAUSE, build_contract
+
+CHAINS = {
+    "classify": classify_contract_chain,
+    "code_gen": code_gen_chain,
+    "documentation": documentation_gen_chain,
+}
+
+DOCUMENT_SECTIONS = ("overview", "purpose", "objectives", "functionalities", "events", "conclusion")
+
+
+def chain_inputs(chain: str) -> list:
+    if chain == "classify":
+        return [{"prompt": prompt} for prompt, _ in SAMPLE_REQUESTS]
+    if chain == "code_gen":
+        return [{"context": retrieve_context(prompt, "\n".join(requirements)), "prompt": prompt,
+                 "requirements": requirements} for prompt, requirements in SAMPLE_REQUESTS]
+    return [{"contract": build_contract(pools, PAUSE)} for pools in (1, 3)]
+
+
+def passes(chain: str, output, reference) -> bool:
+    if chain == "classify":
+        agrees = reference is None or output.contract_type.strip().lower() == reference.contract_type.strip().lower()
+        return agrees and len(output.requirements) > 0
+    if chain == "code_gen":
+        return compile_contract(output.contract, output.solVersion).success
+    document = output.documentation.lower()
+    return all(section in document for section in DOCUMENT_SECTIONS)
+
+
+def measure(chain: str, model: str, base_url, runs: int, references: list) -> dict:
+    settings = model_settings(chain)
+    if base_url:
+        settings["base_url"] = base_url
+    base = CHAINS[chain]
+    candidate = StructuredChain(chain, base.prompt, chat_model(settings, model=model), base.output_model)
+
+    seconds, passed, outputs = [], 0, []
+    for _ in range(runs):
+        for i, inputs in enumerate(chain_inputs(chain)):
+            started = time.perf_counter()
+            try:
+                output = candidate.invoke(inputs)
+            except Exception as e:
+                print(f"  {chain} on {model} failed: {e}")
+                outputs.append(None)
+                continue
+            seconds.append(time.perf_counter() - started)
+            outputs.append(output)
+            reference = references[i] if references else None
+            passed += passes(chain, output, reference)
+
+    calls = len(outputs)
+    return {
+        "p50": float(np.percentile(seconds, 50)) if seconds else float("inf"),
+        "p95": float(np.percentile(seconds, 95)) if seconds else float("inf"),
+        "quality": passed / calls if calls else 0.0,
+        "outputs": outputs,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", default="gpt-4o-mini,gpt-4o",
+                        help="Comma-separated candidate models, the reference model last")
+    parser.add_argument("--chains", default=",".join(CHAINS), help="Comma-separated chains to measure")
+    parser.add_argument("--runs", type=int, default=2, help="Times each sample request is sent")
+    parser.add_argument("--min-quality", type=float, default=1.0, help="Share of calls a model must pass")
+    parser.add_argument("--base-url", default=None, help="An OpenAI-compatible server to send the calls to")
+    args = parser.parse_args()
+
+    models = args.models.split(",")
+    recommended = {}
+
+    print(f"{'chain':<14} {'model':<24} {'p50':>8} {'p95':>8} {'quality':>8}")
+    with run_context(RunContext(cache_bypass=True)):
+        for chain in args.chains.split(","):
+            # The reference model runs first so that the others are compared with its answers
+            results = {models[-1]: measure(chain, models[-1], args.base_url, 1, [])}
+            references = results[models[-1]]["outputs"] if chain == "classify" else []
+            for model in models:
+                results[model] = measure(chain, model, args.base_url, args.runs, references)
+                r = results[model]
+                print(f"{chain:<14} {model:<24} {r['p50']:>7.2f}s {r['p95']:>7.2f}s {r['quality']:>8.0%}")
+
+            eligible = [m for m in models if results[m]["quality"] >= args.min_quality]
+            if eligible:
+                recommended[chain] = {"model": min(eligible, key=lambda m: results[m]["p50"])}
+
+    print()
+    print("Suggested LLM_MODELS entries (merge with the fallbacks and limits you use):")
+    print(json.dumps(recommended))
+
+
+if __name__ == "__main__":
+    main()
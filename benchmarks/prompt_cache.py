@@ -0,0 +1,176 @@
+"""
+Compare how much of the code generation prompt the provider can serve from its
+prompt cache with the previous layout, one system message with the retrieved
+documentation followed by the request and then the instructions, against the
+current one: the instructions, the pinned documentation sections, the retrieved
+ones and the request last. The middle row reorders the prompt without pinning.
+
+By default the benchmark renders the prompts of a series of requests and
+reports, for each layout, the prefix every prompt shares with an earlier one and
+the part of it that OpenAI caches (prefixes of at least 1024 tokens, in 128-token
+steps). With --live it sends the prompts to the API instead, repeating the series,
+and reports the cached tokens the responses come back with and the time to the
+first token.
+
+Usage:
+    python -m benchmarks.prompt_cache [--live] [--rounds 3] [--model gpt-4o-mini]
+"""
+import argparse
+import os
+import time
+
+import numpy as np
+from langchain_core.prompts import ChatPromptTemplate
+
+from app.gen_smart_contract.docs_index import retrieve_context
+from app.gen_smart_contract.prompts.code_gen_prompt import code_gen_prompt
+from app.gen_smart_contract.tokens import count_tokens
+from benchmarks.retrieval_tokens import SAMPLE_REQUESTS
+
+# The system message of code_gen_prompt before the request moved to the end
+PREVIOUS_PROMPT = ChatPromptTemplate.from_messages(
+    [
+        (
+            "system",
+            """You are an expert in Solidity smart contracts. \n Based on the following requirements, generate a detailed and fully functional smart contract. \n
+
+Here is the relevant Solidity documentation:
+    \n ------- \n
+    {context}
+    \n ------- \n
+
+    Requirements: {requirements}
+
+    \n ------- \n
+
+    User prompt: {prompt}
+
+    \n ------- \n
+
+    Now, generate a smart contract based on the provided requirements. The code should include:
+    - SPDX-License-Identifier and pragma statements.
+    - Necessary imports.
+    - Contract definition and state variables.
+    - Constructor function.
+    - Functions to implement the required functionality.
+    - Appropriate access control mechanisms.
+    - Detailed comments explaining each part of the code.
+    - Optimized for gas usage.
+    - No imports from other Solidity files; this will be the only code.
+    - Avoid current security vulnerabilities as stated in the documentation.
+
+    Please provide your response in the following JSON format:
+
+    {{
+        "contract": "<Generated Solidity code>",
+        "solVersion": "<Solidity version used>"
+    }}
+
+    """,
+        )
+    ]
+)
+
+# Name, prompt and pinned documentation budget (None for DOCS_PINNED_TOKEN_BUDGET)
+LAYOUTS = (("previous", PREVIOUS_PROMPT, 0), ("reordered", code_gen_prompt, 0), ("current", code_gen_prompt, None))
+
+# OpenAI caches prompts from this many tokens on, in steps of PREFIX_STEP tokens
+MIN_CACHED_PREFIX = 1024
+PREFIX_STEP = 128
+
+ROLES = {"system": "system", "human": "user", "ai": "assistant"}
+
+
+def render(prompt: ChatPromptTemplate, context: str, request: str, requirements: list) -> list:
+    messages = prompt.format_messages(context=context, prompt=request, requirements=requirements)
+    return [{"role": ROLES[m.type], "content": m.content} for m in messages]
+
+
+def common_prefix(a: str, b: str) -> int:
+    length = min(len(a), len(b))
+    mismatch = np.flatnonzero(np.frombuffer(a[:length].encode("utf-32-le"), dtype=np.uint32)
+                              != np.frombuffer(b[:length].encode("utf-32-le"), dtype=np.uint32))
+    return int(mismatch[0]) if len(mismatch) else length
+
+
+def cacheable(tokens: int) -> int:
+    if tokens < MIN_CACHED_PREFIX:
+        return 0
+    return MIN_CACHED_PREFIX + (tokens - MIN_CACHED_PREFIX) // PREFIX_STEP * PREFIX_STEP
+
+
+def requests_for(pinned_token_budget) -> list:
+    return [
+        (retrieve_context(prompt, "\n".join(requirements), pinned_token_budget=pinned_token_budget), prompt,
+         requirements)
+        for prompt, requirements in SAMPLE_REQUESTS
+    ]
+
+
+def offline():
+    print(f"{'layout':<10} {'prompt tokens':>14} {'shared prefix':>14} {'cacheable':>10} {'hit rate':>9}")
+    for name, prompt, pinned_token_budget in LAYOUTS:
+        # Roles and message boundaries are part of the cached prefix, so compare the serialized messages
+        texts = ["".join(f"<{m['role']}>{m['content']}" for m in render(prompt, *request))
+                 for request in requests_for(pinned_token_budget)]
+
+        total = shared = cached = 0
+        for i, text in enumerate(texts):
+            prefix = max((common_prefix(text, earlier) for earlier in texts[:i]), default=0)
+            prefix_tokens = count_tokens(text[:prefix])
+            total += count_tokens(text)
+            shared += prefix_tokens
+            cached += cacheable(prefix_tokens)
+
+        n = len(texts)
+        print(f"{name:<10} {total / n:>14.0f} {shared / n:>14.0f} {cached / n:>10.0f} {cached / total:>9.1%}")
+
+
+def live(model: str, rounds: int):
+    from openai import OpenAI
+
+    client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+
+    print(f"{'layout':<10} {'calls':>6} {'prompt tokens':>14} {'cached':>8} {'hit rate':>9} "
+          f"{'TTFT p50':>9} {'TTFT mean':>10}")
+    for name, prompt, pinned_token_budget in LAYOUTS:
+        requests = requests_for(pinned_token_budget)
+        prompt_tokens = cached_tokens = 0
+        first_token = []
+        for _ in range(rounds):
+            for request in requests:
+                started = time.perf_counter()
+                stream = client.chat.completions.create(
+                    model=model, messages=render(prompt, *request), max_tokens=16, stream=True,
+                    stream_options={"include_usage": True},
+                )
+                ttft = None
+                for chunk in stream:
+                    if ttft is None and chunk.choices and chunk.choices[0].delta.content:
+                        ttft = time.perf_counter() - started
+                    if chunk.usage:
+                        usage = chunk.usage.model_dump()
+                        prompt_tokens += usage["prompt_tokens"]
+                        cached_tokens += (usage.get("prompt_tokens_details") or {}).get("cached_tokens") or 0
+                first_token.append(ttft if ttft is not None else time.perf_counter() - started)
+
+        print(f"{name:<10} {len(first_token):>6} {prompt_tokens:>14} {cached_tokens:>8} "
+              f"{cached_tokens / prompt_tokens:>9.1%} {np.percentile(first_token, 50) * 1000:>7.0f}ms "
+              f"{np.mean(first_token) * 1000:>8.0f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--live", action="store_true", help="Send the prompts to the OpenAI API")
+    parser.add_argument("--rounds", type=int, default=3, help="Times the requests are sent with --live")
+    parser.add_argument("--model", default="gpt-4o-mini", help="Model used with --live")
+    args = parser.parse_args()
+
+    if args.live:
+        live(args.model, args.rounds)
+    else:
+        offline()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Compare the prompt tokens sent to the code generation chain with the whole
+Solidity docs corpus as context against the retrieved sections.
+
+Usage:
+    python -m benchmarks.retrieval_tokens [--budget 6000] [--top-k 12]
+"""
+import argparse
+import time
+
+from app.gen_smart_contract.docs_index import get_index, retrieve_context
+from app.gen_smart_contract.docs_snapshot import get_docs_content
+from app.gen_smart_contract.prompts.code_gen_prompt import code_gen_prompt
+from app.gen_smart_contract.tokens import count_tokens
+
+SAMPLE_REQUESTS = [
+    ("Create an ERC20 token with mint and burn restricted to the owner",
+     ["Owner can mint tokens", "Holders can burn their own tokens", "Emit Transfer events"]),
+    ("An escrow contract where a buyer deposits ether and an arbiter releases it to the seller",
+     ["Buyer deposits ether", "Arbiter can release or refund", "Prevent reentrancy on withdrawal"]),
+    ("A voting contract where the chairperson gives voters the right to vote and votes can be delegated",
+     ["Chairperson grants voting rights", "Voters can delegate", "Winning proposal can be queried"]),
+    ("Crowdfunding campaign with a goal and deadline, refunds if the goal is not reached",
+     ["Contributors send ether before the deadline", "Owner withdraws if goal met", "Refunds otherwise"]),
+    ("NFT collection with a max supply, public mint price and owner withdrawal",
+     ["ERC721 style ownership", "Max supply enforced", "Mint requires payment", "Owner withdraws funds"]),
+]
+
+
+def prompt_tokens(context: str, prompt: str, requirements: list) -> int:
+    messages = code_gen_prompt.format_messages(context=context, prompt=prompt, requirements=requirements)
+    return sum(count_tokens(m.content) for m in messages)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=int, default=None, help="Context token budget")
+    parser.add_argument("--top-k", type=int, default=None, help="Maximum number of sections")
+    args = parser.parse_args()
+
+    corpus = get_docs_content()
+    start = time.perf_counter()
+    index = get_index()
+    print(f"Index: {len(index.sections)} sections, loaded in {(time.perf_counter() - start) * 1000:.1f} ms\n")
+
+    total_baseline = total_retrieved = 0
+    for prompt, requirements in SAMPLE_REQUESTS:
+        baseline = prompt_tokens(corpus, prompt, requirements)
+
+        start = time.perf_counter()
+        context = retrieve_context(prompt, "\n".join(requirements), token_budget=args.budget, top_k=args.top_k)
+        elapsed = (time.perf_counter() - start) * 1000
+        retrieved = prompt_tokens(context, prompt, requirements)
+
+        total_baseline += baseline
+        total_retrieved += retrieved
+        print(f"{prompt[:60]:<60} {baseline:>8} -> {retrieved:>6} tokens "
+              f"({1 - retrieved / baseline:.1%} saved, retrieval {elapsed:.1f} ms)")
+
+    print(f"\nTotal: {total_baseline} -> {total_retrieved} prompt tokens "
+          f"({1 - total_retrieved / total_baseline:.1%} saved per generate call)")
+
+
+if __name__ == "__main__":
+    main()
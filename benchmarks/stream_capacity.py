@@ -0,0 +1,226 @@
+"""
+Compare how many generation streams one process holds open with the sync WSGI
+app against the asyncio endpoints of asgi.py.
+
+A local stand-in for the OpenAI API answers every chat completion after a fixed
+latency, and both servers run as a single uvicorn process: the sync app through
+uvicorn's WSGI interface (a pool of 10 threads, like a threaded WSGI worker) and
+the async app natively. Each concurrency level opens that many generation
+streams at once and reports how long they took to finish. Contracts are compiled
+with the installed solc, as configured by SOLC_VERSIONS.
+
+Usage:
+    python -m benchmarks.stream_capacity [--concurrency 10,50,200] [--llm-latency 3] [--stream tokens]
+"""
+import argparse
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+import aiohttp
+import numpy as np
+from aiohttp import web
+
+CONTRACT = "// SPDX-License-Identifier: MIT\npragma solidity ^0.8.0;\n\ncontract Token {\n    uint256 public supply;\n}\n"
+
+TOOL_ARGUMENTS = {
+    "classifyContractModel": {"contract_type": "ERC20", "requirements": ["Track the total supply"]},
+    "generateContractModel": {"contract": CONTRACT, "solVersion": "0.8.26"},
+    "documentationGenerateModel": {"documentation": "# Token\n\nStores the total supply."},
+}
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+USAGE = {"prompt_tokens": 100, "completion_tokens": 50, "total_tokens": 150,
+         "prompt_tokens_details": {"cached_tokens": 64}}
+
+
+def fake_openai(latency: float) -> web.Application:
+    async def chat_completions(request: web.Request) -> web.Response:
+        payload = await request.json()
+        await asyncio.sleep(latency)
+
+        name = payload["tools"][0]["function"]["name"]
+        if payload.get("stream"):
+            include_usage = (payload.get("stream_options") or {}).get("include_usage", False)
+            return await stream_tool_call(request, payload["model"], name, include_usage)
+
+        return web.json_response({
+            "id": "chatcmpl-bench",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": payload["model"],
+            "choices": [{
+                "index": 0,
+                "finish_reason": "tool_calls",
+                "message": {
+                    "role": "assistant",
+                    "content": None,
+                    "tool_calls": [{
+                        "id": "call_bench",
+                        "type": "function",
+                        "function": {"name": name, "arguments": json.dumps(TOOL_ARGUMENTS[name])},
+                    }],
+                },
+            }],
+            "usage": USAGE,
+        })
+
+    async def stream_tool_call(request: web.Request, model: str, name: str,
+                               include_usage: bool) -> web.StreamResponse:
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+        await response.prepare(request)
+
+        arguments = json.dumps(TOOL_ARGUMENTS[name])
+        deltas = [{"role": "assistant", "tool_calls": [
+            {"index": 0, "id": "call_bench", "type": "function", "function": {"name": name, "arguments": ""}}
+        ]}]
+        deltas += [{"tool_calls": [{"index": 0, "function": {"arguments": arguments[i:i + 16]}}]}
+                   for i in range(0, len(arguments), 16)]
+
+        for i, delta in enumerate(deltas + [{}]):
+            chunk = {
+                "id": "chatcmpl-bench",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": None if i < len(deltas) else "tool_calls"}],
+            }
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        if include_usage:
+            chunk = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                     "model": model, "choices": [], "usage": USAGE}
+            await response.write(f"data: {json.dumps(chunk)}\n\n".encode())
+        await response.write(b"data: [DONE]\n\n")
+        return response
+
+    app = web.Application()
+    app.router.add_post("/v1/chat/completions", chat_completions)
+    return app
+
+
+def write_docs_snapshot(directory: str):
+    os.environ["DOCS_SNAPSHOT_DIR"] = directory
+    from app.gen_smart_contract.docs_snapshot import write_snapshot
+
+    write_snapshot("¶ Contracts\n\nContracts in Solidity are similar to classes.", "bench", [])
+
+
+async def start_server(target: str, port: int, env: dict) -> subprocess.Popen:
+    command = [sys.executable, "-m", "uvicorn", "--port", str(port), "--log-level", "warning"]
+    command += ["--interface", "wsgi", "wsgi:app"] if target == "sync" else ["asgi:app"]
+    process = subprocess.Popen(command, env=env)
+
+    async with aiohttp.ClientSession() as session:
+        for _ in range(300):
+            try:
+                async with session.get(f"http://127.0.0.1:{port}/api/ai/metrics") as response:
+                    if response.status == 200:
+                        return process
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+
+    process.kill()
+    raise RuntimeError(f"The {target} server did not start")
+
+
+async def open_stream(session: aiohttp.ClientSession, url: str, index: int, stream_mode: str):
+    started = time.perf_counter()
+    first_byte = None
+    last_line = b""
+
+    async with session.post(url, json={"description": f"Token number {index}", "stream": stream_mode}) as response:
+        async for line in response.content:
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            if line.strip():
+                last_line = line
+
+    return first_byte, time.perf_counter() - started, b'"document"' in last_line
+
+
+async def run_level(port: int, concurrency: int, stream_mode: str):
+    url = f"http://127.0.0.1:{port}/api/ai/smart-contract"
+    timeout = aiohttp.ClientTimeout(total=600)
+    connector = aiohttp.TCPConnector(limit=0)
+
+    async with aiohttp.ClientSession(timeout=timeout, connector=connector) as session:
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *(open_stream(session, url, i, stream_mode) for i in range(concurrency)), return_exceptions=True
+        )
+        wall = time.perf_counter() - started
+
+    finished = [r for r in results if not isinstance(r, BaseException) and r[2]]
+    durations = np.array([r[1] for r in finished]) if finished else np.zeros(1)
+    first_bytes = np.array([r[0] for r in finished if r[0] is not None]) if finished else np.zeros(1)
+
+    return {
+        "ok": len(finished),
+        "ttfb_p50": float(np.percentile(first_bytes, 50)),
+        "p50": float(np.percentile(durations, 50)),
+        "p95": float(np.percentile(durations, 95)),
+        "streams_per_second": len(finished) / wall,
+    }
+
+
+async def main_async(args):
+    llm_port = free_port()
+    runner = web.AppRunner(fake_openai(args.llm_latency))
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", llm_port).start()
+
+    docs_dir = tempfile.mkdtemp(prefix="bench-docs-")
+    write_docs_snapshot(docs_dir)
+
+    env = {
+        **os.environ,
+        "OPENAI_API_KEY": "bench",
+        "OPENAI_API_BASE": f"http://127.0.0.1:{llm_port}/v1",
+        "LLM_CACHE_BACKEND": "none",
+        "DOCS_SNAPSHOT_DIR": docs_dir,
+        "DOCS_RETRIEVAL_ENABLED": "false",
+    }
+    levels = [int(c) for c in args.concurrency.split(",")]
+
+    # Three LLM calls when the contract compiles first time
+    print(f"LLM latency {args.llm_latency:g}s, ideal stream duration {3 * args.llm_latency:g}s")
+    print(f"{'server':<7}{'streams':>8}{'ok':>6}{'ttfb p50':>10}{'p50':>8}{'p95':>8}{'streams/s':>11}")
+
+    for target in args.targets.split(","):
+        port = free_port()
+        server = await start_server(target, port, env)
+        try:
+            for concurrency in levels:
+                r = await run_level(port, concurrency, args.stream)
+                print(f"{target:<7}{concurrency:>8}{r['ok']:>6}{r['ttfb_p50']:>9.2f}s{r['p50']:>7.2f}s"
+                      f"{r['p95']:>7.2f}s{r['streams_per_second']:>11.1f}")
+        finally:
+            server.terminate()
+            server.wait()
+
+    await runner.cleanup()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", default="10,50,200", help="Comma-separated numbers of concurrent streams")
+    parser.add_argument("--llm-latency", type=float, default=3.0, help="Seconds per chat completion")
+    parser.add_argument("--targets", default="sync,async", help="Servers to measure: sync, async or both")
+    parser.add_argument("--stream", default="nodes", choices=("nodes", "tokens"), help="The stream mode to request")
+    asyncio.run(main_async(parser.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+"""
+Compare the output tokens of a small edit to a large contract when the update
+workflow has the model rewrite the whole contract against returning function
+patches, and estimate the generation time saved at a given output rate.
+
+The edited contract is produced by splicing the patch, so the benchmark also
+checks that splicing gives the same contract as the full rewrite.
+
+Usage:
+    python -m benchmarks.update_patch_tokens [--functions 40] [--tokens-per-second 60]
+"""
+import argparse
+import json
+import time
+
+from app.gen_smart_contract.contract_patch import apply_patches
+from app.gen_smart_contract.schema import functionModel
+from app.gen_smart_contract.tokens import count_tokens
+
+HEADER = """// SPDX-License-Identifier: MIT
+pragma solidity ^0.8.26;
+
+/// @title Vault
+/// @notice Holds deposits in several pools managed by the owner
+contract Vault {
+    address public owner;
+    bool public paused;
+    mapping(uint256 => mapping(address => uint256)) public balances;
+
+    event Deposited(uint256 indexed pool, address indexed account, uint256 amount);
+    event Withdrawn(uint256 indexed pool, address indexed account, uint256 amount);
+
+    modifier onlyOwner() {
+        require(msg.sender == owner, "Not the owner");
+        _;
+    }
+
+    constructor() {
+        owner = msg.sender;
+    }
+"""
+
+POOL_FUNCTIONS = """
+    /// @notice Deposit ether into pool {i}
+    function deposit{i}() external payable {{
+        require(!paused, "Paused");
+        require(msg.value > 0, "Nothing to deposit");
+        balances[{i}][msg.sender] += msg.value;
+        emit Deposited({i}, msg.sender, msg.value);
+    }}
+
+    /// @notice Withdraw ether from pool {i}
+    function withdraw{i}(uint256 amount) external {{
+        require(balances[{i}][msg.sender] >= amount, "Insufficient balance");
+        balances[{i}][msg.sender] -= amount;
+        (bool sent, ) = msg.sender.call{{value: amount}}("");
+        require(sent, "Transfer failed");
+        emit Withdrawn({i}, msg.sender, amount);
+    }}
+"""
+
+PAUSE = """
+    /// @notice Pause deposits
+    function setPaused(bool value) external onlyOwner {
+        paused = value;
+    }
+"""
+
+EDITED_PAUSE = """/// @notice Pause deposits, and withdrawals while an incident is investigated
+function setPaused(bool value) external onlyOwner {
+    require(paused != value, "Unchanged");
+    paused = value;
+}"""
+
+
+def build_contract(pools: int, pause: str) -> str:
+    return HEADER + "".join(POOL_FUNCTIONS.format(i=i) for i in range(pools)) + pause + "}\n"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--functions", type=int, default=40, help="Number of functions of the contract")
+    parser.add_argument("--tokens-per-second", type=float, default=60, help="Output rate of the model")
+    args = parser.parse_args()
+
+    pools = max(args.functions // 2, 1)
+    contract = build_contract(pools, PAUSE)
+    rewritten = build_contract(pools, "\n    " + EDITED_PAUSE.replace("\n", "\n    ") + "\n")
+
+    patches = [functionModel(function_name="setPaused", code=EDITED_PAUSE, description="Reject no-op changes")]
+    full_response = json.dumps({"contract": rewritten, "solVersion": "0.8.26"})
+    patch_response = json.dumps({"functions": [p.dict() for p in patches], "solVersion": "0.8.26"})
+
+    start = time.perf_counter()
+    spliced = apply_patches(contract, patches)
+    splice_ms = (time.perf_counter() - start) * 1000
+
+    full_tokens, patch_tokens = count_tokens(full_response), count_tokens(patch_response)
+    print(f"Contract: {pools * 2 + 1} functions, {count_tokens(contract)} tokens")
+    print(f"Spliced contract matches the full rewrite: {spliced == rewritten} (splice {splice_ms:.2f} ms)\n")
+    print(f"{'':<16} {'output tokens':>14} {'generation':>11}")
+    for name, tokens in (("full rewrite", full_tokens), ("function patch", patch_tokens)):
+        print(f"{name:<16} {tokens:>14} {tokens / args.tokens_per_second:>10.1f}s")
+    print(f"\n{full_tokens / patch_tokens:.1f}x fewer output tokens with function patches")
+
+
+if __name__ == "__main__":
+    main()
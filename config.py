@@ -1,4 +1,6 @@
+import json
 import os
+import tempfile
 from dotenv import load_dotenv
 
 # Set base directory of the app
@@ -28,3 +30,196 @@ class Config(object):
     LANGCHAIN_TRACING_V2 = os.environ.get("LANGCHAIN_TRACING_V2")
     LANGCHAIN_ENDPOINT = os.environ.get("LANGCHAIN_ENDPOINT")
     LANGCHAIN_API_KEY = os.environ.get("LANGCHAIN_API_KEY")
+
+    # Model of each LLM chain ("classify", "code_gen", "code_update", "code_functions" and "documentation"), over the
+    # "default" entry: "model", "max_tokens", "timeout" of each attempt and "deadline" of the whole call in seconds,
+    # "retries" and "hedge" to override LLM_RETRIES and LLM_HEDGING_ENABLED, "fallback", a model tried when a call
+    # to the first fails, and "base_url" of an OpenAI-compatible server. LLM_MODELS takes a JSON object of the same
+    # shape whose entries replace these. LLM_BASE_URL points every chain without a base_url at a server, such as a
+    # local stand-in
+    LLM_MODELS = {
+        "default": {"model": "gpt-4o-mini", "timeout": 120, "deadline": 240},
+        "classify": {"model": "gpt-4o-mini", "max_tokens": 2048, "timeout": 30, "deadline": 60},
+        "documentation": {"model": "gpt-4o-mini", "max_tokens": 4096, "timeout": 90, "deadline": 180},
+        **json.loads(os.environ.get("LLM_MODELS") or "{}"),
+    }
+    LLM_BASE_URL = os.environ.get("LLM_BASE_URL")
+
+    # LLM attempts failing with a connection error, timeout, rate limit or server error are retried up to
+    # LLM_RETRIES times after a random exponential wait of up to LLM_RETRY_MAX_WAIT_SECONDS, within the deadline
+    LLM_RETRIES = int(os.environ.get("LLM_RETRIES", 2))
+    LLM_RETRY_BACKOFF_SECONDS = float(os.environ.get("LLM_RETRY_BACKOFF_SECONDS", 0.5))
+    LLM_RETRY_MAX_WAIT_SECONDS = float(os.environ.get("LLM_RETRY_MAX_WAIT_SECONDS", 8))
+    # With hedging, an attempt still unanswered after the LLM_HEDGE_QUANTILE of the latencies of the chain's recent
+    # attempts on its model gets a duplicate, and the first answer wins. It needs LLM_HEDGE_MIN_SAMPLES attempts
+    LLM_HEDGING_ENABLED = os.environ.get("LLM_HEDGING_ENABLED", "false").lower() == "true"
+    LLM_HEDGE_QUANTILE = float(os.environ.get("LLM_HEDGE_QUANTILE", 0.95))
+    LLM_HEDGE_MIN_SAMPLES = int(os.environ.get("LLM_HEDGE_MIN_SAMPLES", 20))
+    # After LLM_BREAKER_FAILURES failed attempts in a row, calls to a model fail fast, or go to its fallback, for
+    # LLM_BREAKER_RESET_SECONDS before a trial call is let through. 0 disables the circuit breaker
+    LLM_BREAKER_FAILURES = int(os.environ.get("LLM_BREAKER_FAILURES", 5))
+    LLM_BREAKER_RESET_SECONDS = float(os.environ.get("LLM_BREAKER_RESET_SECONDS", 30))
+    # Threads running the LLM attempts that have a deadline or may be hedged
+    LLM_CALL_WORKERS = int(os.environ.get("LLM_CALL_WORKERS", 32))
+
+    # Runs of signed-in users who saved an OpenAI API key call the models with it. The clients of up to
+    # USER_LLM_CLIENTS_MAX users are kept, each with a pool of USER_LLM_MAX_CONNECTIONS connections whose
+    # idle connections stay open for USER_LLM_KEEPALIVE_SECONDS
+    USER_LLM_CLIENTS_MAX = int(os.environ.get("USER_LLM_CLIENTS_MAX", 256))
+    USER_LLM_MAX_CONNECTIONS = int(os.environ.get("USER_LLM_MAX_CONNECTIONS", 20))
+    USER_LLM_KEEPALIVE_SECONDS = float(os.environ.get("USER_LLM_KEEPALIVE_SECONDS", 60))
+
+    # USD prices per million prompt ("input"), cached prompt ("cached_input") and completion ("output") tokens, for
+    # the cost estimates of the run summaries and metrics. LLM_PRICES takes a JSON object of the same shape
+    LLM_PRICES = json.loads(os.environ.get("LLM_PRICES") or "null") or {
+        "gpt-4o-mini": {"input": 0.15, "cached_input": 0.075, "output": 0.60},
+        "gpt-4o": {"input": 2.50, "cached_input": 1.25, "output": 10.00},
+    }
+
+    # Directory holding the offline Solidity documentation snapshot
+    DOCS_SNAPSHOT_DIR = os.environ.get("DOCS_SNAPSHOT_DIR") or os.path.join(
+        basedir, "app", "gen_smart_contract", "data"
+    )
+    # Without a shipped snapshot, requests fail with a DocsSnapshotError. Enable to scrape the documentation on first
+    # use instead, which puts network fetches on the request path
+    DOCS_SCRAPE_IF_MISSING = os.environ.get("DOCS_SCRAPE_IF_MISSING", "false").lower() == "true"
+
+    # Send only the documentation sections relevant to each prompt instead of the whole corpus
+    DOCS_RETRIEVAL_ENABLED = os.environ.get("DOCS_RETRIEVAL_ENABLED", "true").lower() == "true"
+    DOCS_CONTEXT_TOKEN_BUDGET = int(os.environ.get("DOCS_CONTEXT_TOKEN_BUDGET", 6000))
+    DOCS_TOP_K = int(os.environ.get("DOCS_TOP_K", 12))
+
+    # Sections matching DOCS_PINNED_QUERY, up to DOCS_PINNED_TOKEN_BUDGET of the context budget, lead every
+    # retrieved context in a fixed order. Prompts then share a prefix long enough for provider prompt caching
+    DOCS_PINNED_QUERY = os.environ.get(
+        "DOCS_PINNED_QUERY",
+        "security considerations pitfalls reentrancy gas limit loops sending and receiving ether tx.origin overflow",
+    )
+    DOCS_PINNED_TOKEN_BUDGET = int(os.environ.get("DOCS_PINNED_TOKEN_BUDGET", 2000))
+
+    # Content-addressed cache of solc compilation results
+    COMPILE_CACHE_ENABLED = os.environ.get("COMPILE_CACHE_ENABLED", "true").lower() == "true"
+    COMPILE_CACHE_DIR = os.environ.get("COMPILE_CACHE_DIR") or os.path.join(tempfile.gettempdir(), "compile-cache")
+    COMPILE_CACHE_MEMORY_BYTES = int(os.environ.get("COMPILE_CACHE_MEMORY_BYTES", 32 * 1024 * 1024))
+    COMPILE_CACHE_DISK_BYTES = int(os.environ.get("COMPILE_CACHE_DISK_BYTES", 512 * 1024 * 1024))
+
+    # solc versions installed at deploy time, optionally copied from a local mirror of solc-v<version> binaries.
+    # Requests never install compilers; unknown versions fall back to the newest installed patch release.
+    # bin/post_compile downloads SOLC_VERSIONS into the solc-bin mirror shipped with the app
+    SOLC_VERSIONS = [v.strip() for v in os.environ.get("SOLC_VERSIONS", "0.8.26").split(",") if v.strip()]
+    SOLC_MIRROR_DIR = os.environ.get("SOLC_MIRROR_DIR") or os.path.join(basedir, "solc-bin")
+    SOLC_VERSION_FALLBACK = os.environ.get("SOLC_VERSION_FALLBACK", "true").lower() == "true"
+
+    # Bounded pool of solc processes shared by the workflows and the compile endpoint
+    COMPILE_WORKERS = int(os.environ.get("COMPILE_WORKERS", min(4, os.cpu_count() or 1)))
+    COMPILE_QUEUE_SIZE = int(os.environ.get("COMPILE_QUEUE_SIZE", 16))
+    COMPILE_QUEUE_WAIT_SECONDS = float(os.environ.get("COMPILE_QUEUE_WAIT_SECONDS", 2))
+    COMPILE_NODE_QUEUE_WAIT_SECONDS = float(os.environ.get("COMPILE_NODE_QUEUE_WAIT_SECONDS", 30))
+    COMPILE_TIMEOUT_SECONDS = float(os.environ.get("COMPILE_TIMEOUT_SECONDS", 30))
+    COMPILE_MEMORY_LIMIT_MB = int(os.environ.get("COMPILE_MEMORY_LIMIT_MB", 1024))
+
+    # Exact-match cache of LLM responses: "memory", "sqlite", "redis" (uses REDIS_URL) or "none"
+    LLM_CACHE_BACKEND = os.environ.get("LLM_CACHE_BACKEND", "sqlite")
+    LLM_CACHE_TTL_SECONDS = int(os.environ.get("LLM_CACHE_TTL_SECONDS", 7 * 24 * 60 * 60))
+    LLM_CACHE_MEMORY_ENTRIES = int(os.environ.get("LLM_CACHE_MEMORY_ENTRIES", 256))
+    LLM_CACHE_MAX_ENTRIES = int(os.environ.get("LLM_CACHE_MAX_ENTRIES", 10000))
+    LLM_CACHE_SQLITE_PATH = os.environ.get("LLM_CACHE_SQLITE_PATH") or os.path.join(
+        tempfile.gettempdir(), "llm-cache.sqlite3"
+    )
+
+    # Local classifier that answers the classify step without the LLM when its confidence reaches the
+    # threshold. With CLASSIFIER_LOG_ENABLED, LLM classifications, prompts included, are appended to
+    # CLASSIFIER_LOG_PATH and kept for CLASSIFIER_LOG_TTL_SECONDS; `flask train-classifier` retrains the
+    # model at CLASSIFIER_MODEL_PATH from them. It answers with the requirements at least
+    # CLASSIFIER_MIN_SUPPORT prompts of the contract type share, and only prompts that name nothing else
+    CLASSIFIER_ENABLED = os.environ.get("CLASSIFIER_ENABLED", "true").lower() == "true"
+    CLASSIFIER_LOG_ENABLED = os.environ.get("CLASSIFIER_LOG_ENABLED", "false").lower() == "true"
+    CLASSIFIER_LOG_TTL_SECONDS = int(os.environ.get("CLASSIFIER_LOG_TTL_SECONDS", 30 * 24 * 60 * 60))
+    CLASSIFIER_MIN_SUPPORT = int(os.environ.get("CLASSIFIER_MIN_SUPPORT", 3))
+    CLASSIFIER_MODEL_PATH = os.environ.get("CLASSIFIER_MODEL_PATH") or os.path.join(
+        basedir, "app", "gen_smart_contract", "data", "local-classifier.npz"
+    )
+    CLASSIFIER_LOG_PATH = os.environ.get("CLASSIFIER_LOG_PATH") or os.path.join(basedir, "logs", "classify.jsonl")
+    # Descriptions of common contract types shipped with the app, to classify with until the model is trained
+    CLASSIFIER_SEED_PATH = os.environ.get("CLASSIFIER_SEED_PATH") or os.path.join(
+        basedir, "app", "gen_smart_contract", "data", "classifier-seed.jsonl"
+    )
+    CLASSIFIER_CONFIDENCE_THRESHOLD = float(os.environ.get("CLASSIFIER_CONFIDENCE_THRESHOLD", 0.8))
+    CLASSIFIER_NEIGHBOURS = int(os.environ.get("CLASSIFIER_NEIGHBOURS", 5))
+
+    # Opt-in cache of finished generation runs keyed on the embedding of their prompt. The same prompt, up to
+    # case, whitespace and final punctuation, gets the cached result; a prompt at least WARM_THRESHOLD similar
+    # to a cached one starts generation from its contract. SEMANTIC_CACHE_EMBEDDER is "hashing" (local),
+    # "openai" or "module:factory"
+    SEMANTIC_CACHE_ENABLED = os.environ.get("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+    SEMANTIC_CACHE_EMBEDDER = os.environ.get("SEMANTIC_CACHE_EMBEDDER", "hashing")
+    SEMANTIC_CACHE_DIMENSION = int(os.environ.get("SEMANTIC_CACHE_DIMENSION", 1024))
+    SEMANTIC_CACHE_OPENAI_MODEL = os.environ.get("SEMANTIC_CACHE_OPENAI_MODEL", "text-embedding-3-small")
+    SEMANTIC_CACHE_WARM_THRESHOLD = float(os.environ.get("SEMANTIC_CACHE_WARM_THRESHOLD", 0.8))
+    SEMANTIC_CACHE_MAX_ENTRIES = int(os.environ.get("SEMANTIC_CACHE_MAX_ENTRIES", 2000))
+    SEMANTIC_CACHE_TTL_SECONDS = int(os.environ.get("SEMANTIC_CACHE_TTL_SECONDS", 7 * 24 * 60 * 60))
+    SEMANTIC_CACHE_PATH = os.environ.get("SEMANTIC_CACHE_PATH") or os.path.join(
+        tempfile.gettempdir(), "semantic-cache.npz"
+    )
+
+    # Speculative generation: ask for this many candidates per generate round, compile them in parallel
+    # and keep the first that compiles. SPECULATIVE_MAX_GENERATIONS caps the code generation calls per run
+    SPECULATIVE_CANDIDATES = int(os.environ.get("SPECULATIVE_CANDIDATES", 1))
+    SPECULATIVE_MAX_TEMPERATURE = float(os.environ.get("SPECULATIVE_MAX_TEMPERATURE", 0.8))
+    SPECULATIVE_MAX_GENERATIONS = int(os.environ.get("SPECULATIVE_MAX_GENERATIONS", 8))
+
+    # Maximum prompt tokens per workflow node. An oversized prompt first loses documentation sections, from the
+    # least relevant, then compiler errors, from the last; requests that still do not fit are rejected with a 413.
+    # PROMPT_TOKEN_BUDGETS takes a JSON object of the same shape, a budget of 0 disables the check
+    PROMPT_TOKEN_BUDGETS = json.loads(os.environ.get("PROMPT_TOKEN_BUDGETS") or "null") or {
+        "classify": 4000,
+        "generate": 16000,
+        "reflect": 24000,
+        "document": 16000,
+    }
+
+    # Retry budget of the generate and update workflows while a contract does not compile. A run also stops
+    # retrying when a round returns the same contract or the same compiler errors. 0 disables a limit
+    RETRY_MAX_ITERATIONS = int(os.environ.get("RETRY_MAX_ITERATIONS", 4))
+    RETRY_DEADLINE_SECONDS = float(os.environ.get("RETRY_DEADLINE_SECONDS", 300))
+    RETRY_TOKEN_BUDGET = int(os.environ.get("RETRY_TOKEN_BUDGET", 100000))
+
+    # How the update workflow changes a contract: "functions" has the model return only the functions it changed,
+    # added or deleted and splices them in, "full" has it rewrite the whole contract, and "auto" patches
+    # functions of contracts of at least UPDATE_FUNCTIONS_MIN_TOKENS. Requests can override it with "mode"
+    UPDATE_MODE = os.environ.get("UPDATE_MODE", "auto")
+    UPDATE_FUNCTIONS_MIN_TOKENS = int(os.environ.get("UPDATE_FUNCTIONS_MIN_TOKENS", 600))
+
+    # Seconds of silence after which a generation stream writes a blank line, to notice disconnected clients
+    # and cancel their runs while an LLM call or compilation is still in progress
+    STREAM_HEARTBEAT_SECONDS = float(os.environ.get("STREAM_HEARTBEAT_SECONDS", 5))
+
+    # Under asgi.py, the threads serving the Flask endpoints, so that this many of them run at once
+    WSGI_THREADS = int(os.environ.get("WSGI_THREADS", 16))
+
+    # Background generation jobs: "memory", "sqlite" or "redis" (uses REDIS_URL). JOB_WORKERS threads run
+    # jobs in each web process; set it to 0 to only run them in `flask job-worker` processes
+    JOB_BACKEND = os.environ.get("JOB_BACKEND", "sqlite")
+    JOB_SQLITE_PATH = os.environ.get("JOB_SQLITE_PATH") or os.path.join(tempfile.gettempdir(), "jobs.sqlite3")
+    JOB_WORKERS = int(os.environ.get("JOB_WORKERS", 2))
+    JOB_TTL_SECONDS = int(os.environ.get("JOB_TTL_SECONDS", 24 * 60 * 60))
+    JOB_POLL_INTERVAL_SECONDS = float(os.environ.get("JOB_POLL_INTERVAL_SECONDS", 0.5))
+    # A worker renews the lease of its running job every quarter of JOB_LEASE_SECONDS. Running jobs whose
+    # lease expired, such as after a worker crash, are failed and can be resumed from their checkpoints
+    JOB_LEASE_SECONDS = float(os.environ.get("JOB_LEASE_SECONDS", 60))
+    # Job streams end with an error event after this long, clients then reconnect with the offset
+    JOB_STREAM_TIMEOUT_SECONDS = float(os.environ.get("JOB_STREAM_TIMEOUT_SECONDS", 15 * 60))
+
+    # LangGraph checkpoints of the workflow runs, so that a failed or interrupted run resumes from its last
+    # completed node. Stored in the app database, or a local SQLite file when DATABASE_URL is not set
+    CHECKPOINT_ENABLED = os.environ.get("CHECKPOINT_ENABLED", "true").lower() == "true"
+    CHECKPOINT_DATABASE_URL = os.environ.get("CHECKPOINT_DATABASE_URL") or SQLALCHEMY_DATABASE_URI or (
+        "sqlite:///" + os.path.join(tempfile.gettempdir(), "checkpoints.sqlite3")
+    )
+    CHECKPOINT_TTL_SECONDS = int(os.environ.get("CHECKPOINT_TTL_SECONDS", 24 * 60 * 60))
+
+    # Deferred documentation: generate it in background threads when a workflow finishes without it
+    DOCUMENTATION_BACKGROUND = os.environ.get("DOCUMENTATION_BACKGROUND", "true").lower() == "true"
+    DOCUMENTATION_WORKERS = int(os.environ.get("DOCUMENTATION_WORKERS", 2))
+    # A document another process started is reported as pending for this long, in case that process died
+    DOCUMENTATION_PENDING_SECONDS = int(os.environ.get("DOCUMENTATION_PENDING_SECONDS", 600))
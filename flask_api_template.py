@@ -2,6 +2,8 @@ from datetime import datetime
 
 from dateutil.relativedelta import relativedelta
 
+import click
+
 from app import create_app, db
 
 app = create_app()
@@ -40,3 +42,86 @@ def remove_old_jwts():
         print("No JWT's older than 5 days have been found")
 
     return old_tokens
+
+
+@app.cli.command("refresh-solidity-docs")
+def refresh_solidity_docs():
+    """
+    Scrape the Solidity documentation and write a new content-hashed snapshot
+    and retrieval index for the smart contract generation workflow.
+    """
+
+    from app.gen_smart_contract.docs_index import build_index
+    from app.gen_smart_contract.docs_snapshot import refresh_snapshot
+
+    manifest = refresh_snapshot()
+    index = build_index()
+
+    print(
+        "Wrote Solidity docs v{} snapshot {} ({} characters, {} indexed sections)".format(
+            manifest["version"], manifest["file"], manifest["characters"], len(index.sections)
+        )
+    )
+
+
+@app.cli.command("solc-prefetch")
+@click.option("--mirror", default=None, help="Directory holding solc-v<version> binaries to copy from")
+def solc_prefetch(mirror):
+    """
+    Install the configured solc versions so that compilation never downloads
+    a compiler on the request path.
+    """
+
+    from app.gen_smart_contract.solc_manager import solc_manager
+
+    installed = solc_manager.prefetch(app.config["SOLC_VERSIONS"], mirror or app.config["SOLC_MIRROR_DIR"])
+
+    print("Installed solc versions: {}".format(", ".join(str(v) for v in installed)))
+
+
+@app.cli.command("job-worker")
+@click.option("--workers", default=2, show_default=True, help="Number of jobs to run at once")
+def job_worker(workers):
+    """
+    Run queued smart contract generation jobs until interrupted.
+    """
+
+    from app.gen_smart_contract.jobs import get_job_queue
+
+    print("Running {} job workers on the {} job store".format(workers, app.config["JOB_BACKEND"]))
+
+    get_job_queue().serve(workers)
+
+
+@app.cli.command("prune-checkpoints")
+@click.option("--max-age", default=None, type=int, help="Seconds, defaults to CHECKPOINT_TTL_SECONDS")
+def prune_checkpoints(max_age):
+    """
+    Remove the checkpoints of workflow runs that were never resumed.
+    """
+
+    from app.gen_smart_contract.checkpointer import checkpointer
+
+    if checkpointer is None:
+        print("Workflow checkpoints are disabled")
+        return
+
+    removed = checkpointer.prune(max_age if max_age is not None else app.config["CHECKPOINT_TTL_SECONDS"])
+
+    print("{} abandoned workflow runs have been removed".format(removed))
+
+
+@app.cli.command("train-classifier")
+@click.option("--log", "log_path", default=None, help="Classification log, defaults to CLASSIFIER_LOG_PATH")
+def train_classifier(log_path):
+    """
+    Retrain the local contract classifier from the logged LLM classifications.
+    """
+
+    from app.gen_smart_contract.local_classifier import train_from_log
+
+    classifier = train_from_log(log_path or app.config["CLASSIFIER_LOG_PATH"], app.config["CLASSIFIER_MODEL_PATH"])
+
+    print("Trained the local classifier on {} prompts ({} contract types), saved to {}".format(
+        len(classifier.labels), len(classifier.types), app.config["CLASSIFIER_MODEL_PATH"]
+    ))
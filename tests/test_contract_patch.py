@@ -0,0 +1,50 @@
+import pytest
+
+from app.gen_smart_contract.contract_patch import PatchError, apply_patches
+from app.gen_smart_contract.schema import functionModel
+
+CONTRACT = """pragma solidity ^0.8.26;
+
+contract Counter {
+    uint256 public count;
+
+    // Adds one to the count
+    function increment() public {
+        count += 1;
+    }
+
+    function reset() public {
+        count = 0;
+    }
+}
+"""
+
+
+def patch(action: str, name: str, code: str = "") -> functionModel:
+    return functionModel(function_name=name, code=code, description="", action=action)
+
+
+def test_replace_keeps_the_comments():
+    source = apply_patches(CONTRACT, [patch("replace", "increment", "function increment() public {\n    count += 2;\n}")])
+
+    assert "// Adds one to the count\n    function increment() public {\n        count += 2;\n    }" in source
+    assert "count += 1;" not in source
+    assert "function reset()" in source
+
+
+def test_add_goes_before_the_closing_brace():
+    source = apply_patches(CONTRACT, [patch("add", "decrement", "function decrement() public {\n    count -= 1;\n}")])
+
+    assert source.endswith("        count = 0;\n    }\n\n    function decrement() public {\n        count -= 1;\n    }\n}\n")
+
+
+def test_delete_removes_the_member():
+    source = apply_patches(CONTRACT, [patch("delete", "reset")])
+
+    assert "reset" not in source
+    assert "function increment()" in source
+
+
+def test_replacing_an_unknown_member_fails():
+    with pytest.raises(PatchError, match="incremnt not found"):
+        apply_patches(CONTRACT, [patch("replace", "incremnt", "function incremnt() public {}")])
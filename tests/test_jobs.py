@@ -0,0 +1,113 @@
+import contextlib
+import json
+import threading
+import time
+import uuid
+
+import pytest
+
+from app.gen_smart_contract.jobs import (
+    FAILED,
+    QUEUED,
+    RUNNING,
+    SUCCEEDED,
+    JobFollowTimeout,
+    JobQueue,
+    MemoryJobStore,
+    SQLiteJobStore,
+)
+from config import Config
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return SQLiteJobStore(str(tmp_path / "jobs.sqlite3"), ttl=60)
+    return MemoryJobStore(ttl=60)
+
+
+@pytest.fixture(autouse=True)
+def short_lease(monkeypatch):
+    monkeypatch.setattr(Config, "JOB_LEASE_SECONDS", 0.2)
+    monkeypatch.setattr(Config, "JOB_POLL_INTERVAL_SECONDS", 0.01)
+
+
+class SlowGraph:
+    """
+    Streams one node output after `seconds`.
+    """
+
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+
+    def stream(self, inputs, config):
+        time.sleep(self.seconds)
+        yield {"compile": {"error": "no"}}
+
+
+def create(store) -> str:
+    now = time.time()
+    job = {"id": uuid.uuid4().hex, "kind": "generate", "status": QUEUED,
+           "payload": {"inputs": {"prompt": "A token"}, "cache_bypass": False, "llm_key": None},
+           "created_at": now, "updated_at": now}
+    store.create(job)
+    return job["id"]
+
+
+def test_abandoned_job_fails(store):
+    job_queue = JobQueue(store, {})
+    job_id = create(store)
+    assert store.claim(timeout=1)["id"] == job_id
+
+    # The worker that claimed the job never renews its lease
+    time.sleep(0.3)
+    job_queue.fail_abandoned()
+    job = job_queue.get(job_id)
+    assert job["status"] == FAILED
+    assert "stopped" in json.loads(job_queue.events(job_id)[-1])["error"]
+
+    # The job is failed once
+    job_queue.fail_abandoned()
+    assert len(job_queue.events(job_id)) == 1
+
+
+def test_running_job_keeps_its_lease(store):
+    job_queue = JobQueue(store, {"generate": SlowGraph(0.5)})
+    job_id = create(store)
+    worker = threading.Thread(target=job_queue.run, args=(store.claim(timeout=1),))
+    worker.start()
+
+    time.sleep(0.35)
+    job_queue.fail_abandoned()
+    assert job_queue.get(job_id)["status"] == RUNNING
+    worker.join()
+    assert job_queue.get(job_id)["status"] == SUCCEEDED
+
+
+def test_follow_times_out(store):
+    job_queue = JobQueue(store, {})
+    job_id = create(store)
+    store.append(job_id, json.dumps({"classify": {}}))
+
+    started = time.monotonic()
+    events = []
+    with pytest.raises(JobFollowTimeout, match="offset=1"):
+        for event in job_queue.follow(job_id, timeout=0.1):
+            events.append(event)
+    assert time.monotonic() - started < 0.5
+    assert len(events) == 1
+
+
+def test_abandoned_job_stays_failed(store, monkeypatch):
+    job_queue = JobQueue(store, {"generate": SlowGraph(0.3)})
+    job_id = create(store)
+    # The lease is not renewed, as if the worker had stalled
+    monkeypatch.setattr(JobQueue, "_lease", lambda self, job_id: contextlib.nullcontext())
+    worker = threading.Thread(target=job_queue.run, args=(store.claim(timeout=1),))
+    worker.start()
+
+    time.sleep(0.25)
+    job_queue.fail_abandoned()
+    assert job_queue.get(job_id)["status"] == FAILED
+    worker.join()
+    assert job_queue.get(job_id)["status"] == FAILED
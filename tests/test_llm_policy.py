@@ -0,0 +1,228 @@
+import asyncio
+import json
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, List
+
+import httpx
+import openai
+import pytest
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_openai import ChatOpenAI
+
+from app.gen_smart_contract import llm_policy
+from app.gen_smart_contract.llm_policy import (
+    CircuitBreaker,
+    CircuitOpen,
+    LLMCallPolicy,
+    LLMDeadlineExceeded,
+    LLMQueueTimeout,
+)
+from app.gen_smart_contract.prompts.classify_contract_prompt import classify_contract_prompt
+from app.gen_smart_contract.schema import classifyContractModel
+from config import Config
+
+ARGUMENTS = {"contract_type": "ERC20", "requirements": ["Track the total supply"]}
+
+
+def connection_error() -> openai.APIConnectionError:
+    return openai.APIConnectionError(request=httpx.Request("POST", "http://fake/v1/chat/completions"))
+
+
+class ScriptedChatModel(ChatOpenAI):
+    """
+    Answers each attempt with a classifyContractModel tool call after the latency
+    of its step of the script, or raises the step's exception. The last step
+    repeats.
+    """
+
+    steps: List[Any] = [0.0]
+
+    def _step(self):
+        state = self.__dict__.setdefault("_state", {"lock": threading.Lock(), "attempts": 0})
+        with state["lock"]:
+            step = self.steps[min(state["attempts"], len(self.steps) - 1)]
+            state["attempts"] += 1
+        return step
+
+    @property
+    def attempts(self) -> int:
+        return self.__dict__.get("_state", {}).get("attempts", 0)
+
+    def _result(self, tools) -> ChatResult:
+        message = AIMessage(content="", tool_calls=[{"name": tools[0]["function"]["name"], "args": ARGUMENTS,
+                                                     "id": "call_fake"}])
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        step = self._step()
+        if isinstance(step, Exception):
+            raise step
+        time.sleep(step)
+        return self._result(kwargs["tools"])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        step = self._step()
+        if isinstance(step, Exception):
+            raise step
+        await asyncio.sleep(step)
+        return self._result(kwargs["tools"])
+
+
+def no_config(stream, token):
+    return None
+
+
+@pytest.fixture(autouse=True)
+def short_waits(monkeypatch):
+    monkeypatch.setattr(Config, "LLM_RETRY_BACKOFF_SECONDS", 0.01)
+    monkeypatch.setattr(Config, "LLM_RETRY_MAX_WAIT_SECONDS", 0.02)
+
+
+@pytest.fixture
+def single_worker(monkeypatch):
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(llm_policy, "_executor", executor)
+    yield executor
+    executor.shutdown(wait=True)
+
+
+def scripted(*steps, deadline=None, retries=0, hedge_after=None, failures=3, reset_seconds=30.0):
+    model = ScriptedChatModel(model="fake", api_key="fake", steps=list(steps))
+    runnable = classify_contract_prompt | model.with_structured_output(classifyContractModel, include_raw=True)
+    policy = LLMCallPolicy("test", "fake", {"deadline": deadline, "retries": retries, "hedge": False})
+    policy.breaker = CircuitBreaker("fake", failures, reset_seconds)
+    if hedge_after is not None:
+        policy.hedge_delay = lambda: hedge_after
+    return model, runnable, policy
+
+
+def call(runnable, policy):
+    return policy.invoke(runnable, {"prompt": "A token"}, no_config)
+
+
+def test_breaker_opens_after_failed_attempts():
+    model, runnable, policy = scripted(connection_error(), failures=3)
+    for _ in range(3):
+        with pytest.raises(openai.APIConnectionError):
+            call(runnable, policy)
+
+    with pytest.raises(CircuitOpen):
+        call(runnable, policy)
+    assert policy.breaker.is_open
+    assert model.attempts == 3
+
+
+def test_breaker_half_open_trial_closes_it():
+    model, runnable, policy = scripted(connection_error(), 0.0, failures=1, reset_seconds=0.1)
+    with pytest.raises(openai.APIConnectionError):
+        call(runnable, policy)
+    assert policy.breaker.is_open
+
+    time.sleep(0.15)
+    response, _ = call(runnable, policy)
+    assert response["parsed"].contract_type == "ERC20"
+    assert not policy.breaker.is_open
+
+
+def test_breaker_failed_trial_reopens_it():
+    model, runnable, policy = scripted(connection_error(), failures=1, reset_seconds=0.1)
+    with pytest.raises(openai.APIConnectionError):
+        call(runnable, policy)
+
+    time.sleep(0.15)
+    with pytest.raises(openai.APIConnectionError):
+        call(runnable, policy)
+    with pytest.raises(CircuitOpen):
+        call(runnable, policy)
+    assert model.attempts == 2
+
+
+def test_breaker_lets_one_trial_through_while_half_open():
+    model, runnable, policy = scripted(connection_error(), 0.3, failures=1, reset_seconds=0.1)
+    with pytest.raises(openai.APIConnectionError):
+        call(runnable, policy)
+
+    time.sleep(0.15)
+    trial = threading.Thread(target=call, args=(runnable, policy))
+    trial.start()
+    time.sleep(0.05)
+    with pytest.raises(CircuitOpen):
+        call(runnable, policy)
+    trial.join()
+    assert not policy.breaker.is_open
+    assert model.attempts == 2
+
+
+def test_hedge_wins_over_slow_attempt():
+    model, runnable, policy = scripted(1.0, 0.0, hedge_after=0.05)
+    started = time.monotonic()
+    response, streamed = call(runnable, policy)
+    assert time.monotonic() - started < 0.5
+    assert response["parsed"].contract_type == "ERC20"
+    # The duplicate answered, and it does not stream
+    assert not streamed
+    assert model.attempts == 2
+
+
+def test_async_hedge_wins_over_slow_attempt():
+    model, runnable, policy = scripted(1.0, 0.0, hedge_after=0.05)
+    started = time.monotonic()
+    response, streamed = asyncio.run(policy.ainvoke(runnable, {"prompt": "A token"}, no_config))
+    assert time.monotonic() - started < 0.5
+    assert not streamed
+    assert model.attempts == 2
+
+
+def test_deadline_exceeded_counts_as_failure():
+    model, runnable, policy = scripted(1.0, deadline=0.2, failures=1)
+    started = time.monotonic()
+    with pytest.raises(LLMDeadlineExceeded):
+        call(runnable, policy)
+    assert time.monotonic() - started < 0.5
+    assert policy.breaker.is_open
+
+
+def test_retry_within_deadline():
+    model, runnable, policy = scripted(connection_error(), connection_error(), 0.0, deadline=2.0, retries=3)
+    response, _ = call(runnable, policy)
+    assert response["parsed"].contract_type == "ERC20"
+    assert model.attempts == 3
+    assert not policy.breaker.is_open
+
+
+def test_no_retry_starts_after_deadline(monkeypatch):
+    monkeypatch.setattr(Config, "LLM_RETRY_BACKOFF_SECONDS", 0.1)
+    monkeypatch.setattr(Config, "LLM_RETRY_MAX_WAIT_SECONDS", 0.1)
+    model, runnable, policy = scripted(connection_error(), deadline=0.3, retries=100, failures=0)
+    started = time.monotonic()
+    # A retry that starts just before the deadline may still miss it
+    with pytest.raises((openai.APIConnectionError, LLMDeadlineExceeded)):
+        call(runnable, policy)
+    assert time.monotonic() - started < 0.5
+    assert model.attempts < 100
+
+
+def test_deadline_starts_when_attempt_runs(single_worker):
+    single_worker.submit(time.sleep, 0.2)
+    model, runnable, policy = scripted(0.2, deadline=0.3)
+    response, _ = call(runnable, policy)
+    assert response["parsed"].contract_type == "ERC20"
+
+
+def test_queue_timeout_does_not_count_as_failure(single_worker):
+    release = threading.Event()
+    single_worker.submit(release.wait)
+    model, runnable, policy = scripted(0.0, deadline=0.1, failures=1)
+    try:
+        with pytest.raises(LLMQueueTimeout):
+            call(runnable, policy)
+    finally:
+        release.set()
+    assert not policy.breaker.is_open
+
+    # The attempt was dropped from the queue, so it does not run once the worker is free
+    single_worker.shutdown(wait=True)
+    assert model.attempts == 0